@@ -40,19 +40,80 @@ import bpy
 # ImportHelper is a helper class, defines filename and
 # invoke() function which calls the file selector.
 from bpy_extras.io_utils import ImportHelper, poll_file_object_drop
-from bpy.props import FloatProperty, StringProperty, BoolProperty, EnumProperty, IntProperty
-from bpy.types import Operator
+from bpy.props import FloatProperty, StringProperty, BoolProperty, EnumProperty, IntProperty, FloatVectorProperty
+from bpy.types import Operator, AddonPreferences
 
 from typing import Any, Dict
 
-from .read3dm import read_3dm
+from .read3dm import read_3dm, hydrate_materials, hydrate_proxies
+from . import read3dm
+from . import scene_cache
+from . import converters
+from . import model_cache
+from pathlib import Path
 
 
-class Import3dm(Operator, ImportHelper):
-    """Import Rhinoceros 3D files (.3dm). Currently does render meshes only, more geometry and data to follow soon."""
-    bl_idname = "import_3dm.some_data"  # important since its how bpy.ops.import_3dm.some_data is constructed
-    bl_label = "Import Rhinoceros 3D file"
-    bl_options = {"REGISTER", "UNDO"}
+def _update_model_cache_size(self, _ : bpy.types.Context):
+    model_cache.set_limit(self.model_cache_size * 1024 * 1024)
+
+
+class Import3dmPreferences(AddonPreferences):
+    bl_idname = __package__
+
+    model_cache_size: IntProperty(
+        name="Model Cache (MB)",
+        description="Maximum summed size of the 3dm files kept parsed in memory for repeated imports and hydration. 0 disables the cache.",
+        default=4096,
+        min=0,
+        update=_update_model_cache_size,
+    ) # type: ignore
+
+    texture_cache_size: IntProperty(
+        name="Texture Cache (MB)",
+        description="Size the texture cache is trimmed to with Trim Texture Cache. Files are never removed automatically, other .blend files may reference them.",
+        default=2048,
+        min=0,
+    ) # type: ignore
+
+    def draw(self, _ : bpy.types.Context):
+        layout = self.layout
+        layout.prop(self, "model_cache_size")
+        row = layout.row()
+        row.label(text="{} models cached, {:.1f} MB".format(model_cache.count(), model_cache.usage() / (1024 * 1024)))
+        row.operator(ClearModelCache.bl_idname)
+        row = layout.row()
+        row.prop(self, "texture_cache_size")
+        row.operator(TrimTextureCache.bl_idname)
+
+
+class ClearModelCache(Operator):
+    """Release the 3dm models kept parsed in memory"""
+    bl_idname = "import_3dm.clear_model_cache"
+    bl_label = "Clear Model Cache"
+
+    def execute(self, _ : bpy.types.Context):
+        model_cache.clear()
+        return {'FINISHED'}
+
+
+class TrimTextureCache(Operator):
+    """Remove the least recently used textures from the texture cache, down to the size set in the preferences. Textures used in this file are kept, other files referencing removed textures lose them"""
+    bl_idname = "import_3dm.trim_texture_cache"
+    bl_label = "Trim Texture Cache"
+
+    def execute(self, context : bpy.types.Context):
+        preferences = context.preferences.addons[__package__].preferences
+        converters.trim_texture_cache(context, preferences.texture_cache_size * 1024 * 1024)
+        return {'FINISHED'}
+
+
+class _Import3dmBase:
+    """
+    Options, drawing and execution shared by the import operators.
+    Blender only collects the properties of base classes that aren't
+    registered, so the operators derive from this plain class instead
+    of from each other.
+    """
 
     # ImportHelper mixin class uses this
     filename_ext = ".3dm"
@@ -83,12 +144,24 @@ class Import3dm(Operator, ImportHelper):
         default=True,
     ) # type: ignore
 
+    import_empty_layers: BoolProperty(
+        name="Empty Layers",
+        description="Create all layers, including layers no imported object is on.",
+        default=False,
+    ) # type: ignore
+
     import_annotations: BoolProperty(
         name="Annotations",
         description="Import annotations.",
         default=True,
     ) # type: ignore
 
+    annotation_merge_linework: BoolProperty(
+        name="Merge Linework",
+        description="Merge the dimension linework of all annotations on a layer into one curve.",
+        default=False,
+    ) # type: ignore
+
     import_curves: BoolProperty(
         name="Curves",
         description="Import curves.",
@@ -125,6 +198,48 @@ class Import3dm(Operator, ImportHelper):
         default=True,
     ) # type: ignore
 
+    pointcloud_target: EnumProperty(
+        items=(("MESH", "Mesh", "Import point clouds as vertex-only meshes."),
+               ("POINTCLOUD", "Point Cloud", "Import point clouds as point cloud data.")),
+        name="PointSet As",
+        description="Set what data point clouds are imported as",
+        default="MESH",
+    ) # type: ignore
+
+    pointcloud_tiling: BoolProperty(
+        name="Tiles",
+        description="Split large point clouds into tiles with a reduced level of detail. Full resolution tiles are loaded when selected.",
+        default=False,
+    ) # type: ignore
+
+    pointcloud_tile_points: IntProperty(
+        name="Points Per Tile",
+        description="Maximum number of points in a tile. Point clouds with less points are not tiled.",
+        default=1000000,
+        min=1000,
+    ) # type: ignore
+
+    pointcloud_lod_voxel: FloatProperty(
+        name="LOD Density",
+        description="Voxel size used to subsample tiles for the viewport level of detail.",
+        default=0.1,
+        min=0.0,
+        subtype="DISTANCE"
+    ) # type: ignore
+
+    pointcloud_tile_render: BoolProperty(
+        name="Render Full Resolution",
+        description="Add a render only object with the full resolution points for every tile. Without it load the tiles before rendering.",
+        default=False,
+    ) # type: ignore
+
+    pointcloud_tile_cache_size: IntProperty(
+        name="Tile Cache Size (MB)",
+        description="Maximum size of the cached full resolution point cloud tiles, the least recently imported tiles are removed first. Tiles of objects in this file are kept.",
+        default=8192,
+        min=1,
+    ) # type: ignore
+
     import_views: BoolProperty(
         name="Standard",
         description="Import standard views (Top, Front, Right, Perspective) as cameras.",
@@ -149,12 +264,26 @@ class Import3dm(Operator, ImportHelper):
         default=False,
     ) # type: ignore
 
+    group_mode: EnumProperty(
+        items=(("COLLECTIONS", "Collections", "Link the objects of each group into a group collection."),
+               ("ATTRIBUTES", "Attributes", "Store the groups of each object as a custom property, with a group table on the scene.")),
+        name="Groups As",
+        description="Set how group membership is represented",
+        default="COLLECTIONS",
+    ) # type: ignore
+
     import_instances: BoolProperty(
         name="Blocks",
         description="Import blocks as collection instances.",
         default=True,
     ) # type: ignore
 
+    prune_instance_definitions: BoolProperty(
+        name="Skip Unused",
+        description="Only import block definitions that are used by a block instance in the model.",
+        default=False,
+    ) # type: ignore
+
     import_instances_grid_layout: BoolProperty(
         name="Grid Layout",
         description="Lay out block definitions in a grid ",
@@ -183,6 +312,92 @@ class Import3dm(Operator, ImportHelper):
         default=True,
     ) # type: ignore
 
+    defer_materials: BoolProperty(
+        name="Defer Node Trees",
+        description="Only set the viewport color of materials. Node trees are built in material preview or with Hydrate Rhino Materials, which has to run before rendering.",
+        default=False,
+    ) # type: ignore
+
+    material_templates: BoolProperty(
+        name="Node Templates",
+        description="Create new materials from a cached node tree per material type instead of building each node tree from scratch.",
+        default=False,
+    ) # type: ignore
+
+    texture_storage: EnumProperty(
+        items=(("PACK", "Pack", "Pack embedded textures into the .blend file."),
+               ("CACHE", "Texture Cache", "Reference embedded textures from the shared texture cache directory. The files stay until the cache is trimmed from the add-on preferences.")),
+        name="Textures",
+        description="Set how embedded textures are stored",
+        default="PACK",
+    ) # type: ignore
+
+    proxy_mode: EnumProperty(
+        items=(("NONE", "None", "Import full render meshes."),
+               ("BBOX", "Bounding Box", "Import meshes as their bounding boxes."),
+               ("COARSE", "Coarse", "Import heavily decimated render meshes.")),
+        name="Proxies",
+        description="Import lightweight stand-ins for meshes that can be replaced with the full meshes later",
+        default="NONE",
+    ) # type: ignore
+
+    proxy_resolution: IntProperty(
+        name="Proxy Resolution",
+        description="Number of vertex clusters along the longest side of a coarse proxy.",
+        default=8,
+        min=1,
+        max=256,
+    ) # type: ignore
+
+    auto_instancing: BoolProperty(
+        name="Detect Instances",
+        description="Share one mesh between objects with the same geometry at different positions and orientations.",
+        default=False,
+    ) # type: ignore
+
+    instance_tolerance: FloatProperty(
+        name="Instance Tolerance",
+        description="Maximum distance between matching vertices of instances.",
+        default=0.0001,
+        min=0.0000001,
+        subtype="DISTANCE"
+    ) # type: ignore
+
+    buffer_cache: BoolProperty(
+        name="Geometry Cache",
+        description="Store extracted render meshes on disk and read them from there when importing or hydrating the same file again.",
+        default=False,
+    ) # type: ignore
+
+    buffer_cache_size: IntProperty(
+        name="Geometry Cache Size (MB)",
+        description="Maximum size of the geometry cache, the caches of the least recently imported files are removed first.",
+        default=8192,
+        min=1,
+    ) # type: ignore
+
+    polygon_budget: EnumProperty(
+        items=(("NONE", "None", "Import render meshes as they are."),
+               ("OBJECT", "Per Object", "Decimate render meshes with more triangles than the budget."),
+               ("SCENE", "Scene", "Split the budget over all render meshes in proportion to their size.")),
+        name="Polygon Budget",
+        description="Decimate render meshes to a triangle budget while importing",
+        default="NONE",
+    ) # type: ignore
+
+    polygon_budget_faces: IntProperty(
+        name="Triangles",
+        description="Maximum number of triangles per object or for the whole scene.",
+        default=100000,
+        min=12,
+    ) # type: ignore
+
+    import_normals: BoolProperty(
+        name="Rhino Normals",
+        description="Use the vertex normals of Rhino render meshes as custom normals instead of smoothing the meshes.",
+        default=False,
+    ) # type: ignore
+
     merge_by_distance: BoolProperty(
         name="Merge Vertices By Distance",
         description="Merge vertices based on their proximity.",
@@ -197,6 +412,104 @@ class Import3dm(Operator, ImportHelper):
         subtype="DISTANCE"
     ) # type: ignore
 
+    import_region: EnumProperty(
+        items=(("NONE", "Everything", "Import objects regardless of their position."),
+               ("BOX", "Box", "Import objects intersecting a box."),
+               ("NAMED_VIEW", "Named View", "Import objects in the view frustum of a named view."),
+               ("VIEWPORT", "Viewport", "Import objects in the view frustum of the 3D viewport.")),
+        name="Region",
+        description="Only import objects whose bounding boxes intersect a region",
+        default="NONE",
+    ) # type: ignore
+
+    region_min: FloatVectorProperty(
+        name="Box Min",
+        description="Minimum corner of the import region.",
+        default=(0.0, 0.0, 0.0),
+        subtype="XYZ_LENGTH",
+        size=3,
+    ) # type: ignore
+
+    region_max: FloatVectorProperty(
+        name="Box Max",
+        description="Maximum corner of the import region.",
+        default=(0.0, 0.0, 0.0),
+        subtype="XYZ_LENGTH",
+        size=3,
+    ) # type: ignore
+
+    region_view: StringProperty(
+        name="View",
+        description="Name of the named view in the 3dm file to use as the import region.",
+        default="",
+    ) # type: ignore
+
+    min_object_size: FloatProperty(
+        name="Minimum Size",
+        description="Skip objects with a bounding box diagonal shorter than this. 0 imports all objects.",
+        default=0.0,
+        min=0.0,
+        subtype="DISTANCE"
+    ) # type: ignore
+
+    scene_cache: EnumProperty(
+        items=(("NONE", "None", "Always convert the file."),
+               ("APPEND", "Append", "Append the cached result of an earlier import of the same file with the same options."),
+               ("LINK", "Link", "Link the cached result of an earlier import of the same file with the same options.")),
+        name="Scene Cache",
+        description="Reuse converted scenes of unchanged files",
+        default="NONE",
+    ) # type: ignore
+
+    scene_cache_size: IntProperty(
+        name="Cache Size (MB)",
+        description="Maximum size of the scene cache, the least recently used scenes are removed first.",
+        default=4096,
+        min=1,
+    ) # type: ignore
+
+    low_memory: BoolProperty(
+        name="Low Memory",
+        description="Convert objects in chunks and release Rhino data as early as possible to lower peak memory use. Prints the peak memory use of each import phase.",
+        default=False,
+    ) # type: ignore
+
+    memory_chunk_size: IntProperty(
+        name="Chunk Size",
+        description="Number of objects converted between releasing memory.",
+        default=1000,
+        min=1,
+    ) # type: ignore
+
+    curve_adaptive_resolution: BoolProperty(
+        name="Adaptive Resolution",
+        description="Derive curve resolution from chord height and angle tolerance instead of using a fixed resolution.",
+        default=False,
+    ) # type: ignore
+
+    curve_chord_tolerance: FloatProperty(
+        name="Chord Tolerance",
+        description="Maximum distance between a curve and its tessellation.",
+        default=0.001,
+        min=0.0,
+        subtype="DISTANCE"
+    ) # type: ignore
+
+    curve_angle_tolerance: FloatProperty(
+        name="Angle Tolerance",
+        description="Maximum angle between consecutive curve segments.",
+        default=0.174533, # 10deg
+        min=0.0,
+        max=3.141593,
+        subtype="ANGLE"
+    ) # type: ignore
+
+    curve_bake_poly: BoolProperty(
+        name="Bake To Poly",
+        description="Convert curves to poly splines, with the number of points controlled by the tolerances.",
+        default=False,
+    ) # type: ignore
+
     subD_level_viewport: IntProperty(
         name="SubD Levels Viewport",
         description="Number of subdivisions to perform in the 3D viewport.",
@@ -227,8 +540,25 @@ class Import3dm(Operator, ImportHelper):
 
     def execute(self, context : bpy.types.Context):
         options = self.as_keywords()
-        # Single file import
-        return read_3dm(context, self.filepath, options)
+
+        if self.scene_cache == "NONE":
+            # Single file import
+            result = read_3dm(context, self.filepath, options)
+        else:
+            key = scene_cache.cache_key(context, self.filepath, options, bl_info_version)
+            collection_name = Path(self.filepath).stem
+            if scene_cache.load_scene(context, key, collection_name, self.scene_cache == "LINK"):
+                result = {'FINISHED'}
+            else:
+                result = read_3dm(context, self.filepath, options)
+                collection = context.blend_data.collections.get(collection_name, None)
+                if 'FINISHED' in result and collection is not None:
+                    scene_cache.store_scene(key, collection, self.scene_cache_size * 1024 * 1024)
+
+        if self.auto_instancing and "rh_instances_found" in options:
+            self.report({'INFO'}, "Found {} instances".format(options["rh_instances_found"]))
+
+        return result
 
     def draw(self, _ : bpy.types.Context):
         layout = self.layout
@@ -245,7 +575,22 @@ class Import3dm(Operator, ImportHelper):
         col = row.column()
         col.prop(self, "import_curves")
         col.prop(self, "import_annotations")
+        sub = col.column()
+        sub.enabled = self.import_annotations
+        sub.prop(self, "annotation_merge_linework")
         col.prop(self, "import_pointset")
+        row = box.row()
+        row.enabled = self.import_pointset
+        row.prop(self, "pointcloud_target")
+        col = box.column()
+        col.enabled = self.import_pointset
+        col.prop(self, "pointcloud_tiling")
+        sub = col.column()
+        sub.enabled = self.pointcloud_tiling
+        sub.prop(self, "pointcloud_tile_points")
+        sub.prop(self, "pointcloud_lod_voxel")
+        sub.prop(self, "pointcloud_tile_render")
+        sub.prop(self, "pointcloud_tile_cache_size")
 
         box = layout.box()
         box.label(text="Visibility")
@@ -257,6 +602,7 @@ class Import3dm(Operator, ImportHelper):
         box.label(text="Layers")
         row = box.row()
         row.prop(self, "import_layers_as_empties")
+        row.prop(self, "import_empty_layers")
 
         box = layout.box()
         box.label(text="Views")
@@ -269,11 +615,15 @@ class Import3dm(Operator, ImportHelper):
         row = box.row()
         row.prop(self, "import_groups")
         row.prop(self, "import_nested_groups")
+        row = box.row()
+        row.enabled = self.import_groups
+        row.prop(self, "group_mode")
 
         box = layout.box()
         box.label(text="Blocks")
         col = box.column()
         col.prop(self, "import_instances")
+        col.prop(self, "prune_instance_definitions")
         col.prop(self, "import_instances_grid_layout")
         col.prop(self, "import_instances_grid")
 
@@ -282,22 +632,247 @@ class Import3dm(Operator, ImportHelper):
         col = box.column()
         col.prop(self, "link_materials_to")
         col.prop(self, "update_materials")
+        sub = col.column()
+        sub.enabled = self.update_materials
+        sub.prop(self, "defer_materials")
+        col.prop(self, "material_templates")
+        col.prop(self, "texture_storage")
+
+        box = layout.box()
+        box.label(text="Curves")
+        box.prop(self, "curve_adaptive_resolution")
+        col = box.column()
+        col.enabled = self.curve_adaptive_resolution
+        col.prop(self, "curve_chord_tolerance")
+        col.prop(self, "curve_angle_tolerance")
+        col.prop(self, "curve_bake_poly")
 
         box = layout.box()
         box.label(text="Meshes & SubD")
         box.prop(self, "subD_level_viewport")
         box.prop(self, "subD_level_render")
         box.prop(self, "subD_boundary_smooth")
+        box.prop(self, "proxy_mode")
+        row = box.row()
+        row.enabled = self.proxy_mode == "COARSE"
+        row.prop(self, "proxy_resolution")
+        box.prop(self, "polygon_budget")
+        row = box.row()
+        row.enabled = self.polygon_budget != "NONE"
+        row.prop(self, "polygon_budget_faces")
+        box.prop(self, "import_normals")
+        box.prop(self, "auto_instancing")
+        row = box.row()
+        row.enabled = self.auto_instancing
+        row.prop(self, "instance_tolerance")
         box.prop(self, "merge_by_distance")
         col = box.column()
         col.enabled = self.merge_by_distance
         col.prop(self, "merge_distance")
+
+        box = layout.box()
+        box.label(text="Region")
+        box.prop(self, "import_region")
+        col = box.column()
+        col.enabled = self.import_region == "BOX"
+        col.prop(self, "region_min")
+        col.prop(self, "region_max")
+        row = box.row()
+        row.enabled = self.import_region == "NAMED_VIEW"
+        row.prop(self, "region_view")
+        box.prop(self, "min_object_size")
+
+        box = layout.box()
+        box.label(text="Cache")
+        box.prop(self, "scene_cache")
+        row = box.row()
+        row.enabled = self.scene_cache != "NONE"
+        row.prop(self, "scene_cache_size")
+        box.prop(self, "buffer_cache")
+        row = box.row()
+        row.enabled = self.buffer_cache
+        row.prop(self, "buffer_cache_size")
+
+        box = layout.box()
+        box.label(text="Memory")
+        box.prop(self, "low_memory")
+        row = box.row()
+        row.enabled = self.low_memory
+        row.prop(self, "memory_chunk_size")
     
     def invoke(self, context, event):
         self.files = []
         return ImportHelper.invoke_popup(self, context)
 
 
+class Import3dm(Operator, _Import3dmBase, ImportHelper):
+    """Import Rhinoceros 3D files (.3dm). Currently does render meshes only, more geometry and data to follow soon."""
+    bl_idname = "import_3dm.some_data"  # important since its how bpy.ops.import_3dm.some_data is constructed
+    bl_label = "Import Rhinoceros 3D file"
+    bl_options = {"REGISTER", "UNDO"}
+
+
+class Import3dmNoUndo(Operator, _Import3dmBase, ImportHelper):
+    """Import Rhinoceros 3D files (.3dm) without an undo step. Saves the copy of the imported data the undo step keeps, but the import can't be undone."""
+    bl_idname = "import_3dm.some_data_no_undo"
+    bl_label = "Import Rhinoceros 3D file (No Undo)"
+    bl_options = {"REGISTER"}
+
+
+class HydrateMaterials(Operator):
+    """Build the full node trees of deferred Rhino materials"""
+    bl_idname = "import_3dm.hydrate_materials"
+    bl_label = "Hydrate Rhino Materials"
+    bl_options = {"REGISTER", "UNDO"}
+
+    target: EnumProperty(
+        items=(("SELECTED", "Selected", "Hydrate the materials of the selected objects."),
+               ("RENDER", "Render", "Hydrate the materials of the objects that get rendered, run this before rendering.")),
+        name="Target",
+        description="Set which materials to hydrate",
+        default="SELECTED",
+    ) # type: ignore
+
+    @classmethod
+    def poll(cls, context: bpy.types.Context):
+        return context.scene is not None
+
+    def execute(self, context : bpy.types.Context):
+        if self.target == "SELECTED":
+            blmats = set()
+            for ob in context.selected_objects:
+                for slot in ob.material_slots:
+                    if slot.material:
+                        blmats.add(slot.material)
+        else:
+            blmats = read3dm.renderable_deferred_materials(context.scene)
+        count = hydrate_materials(context, blmats, retry=True)
+        self.report({'INFO'}, "Hydrated {} materials".format(count))
+        return {'FINISHED'}
+
+
+class HydrateProxies(Operator):
+    """Replace Rhino proxy meshes with the full render meshes from their 3dm files"""
+    bl_idname = "import_3dm.hydrate_proxies"
+    bl_label = "Hydrate Rhino Proxies"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    target: EnumProperty(
+        items=(("SELECTED", "Selected", "Hydrate the selected proxies."),
+               ("VISIBLE", "Visible", "Hydrate the proxies visible in the view layer.")),
+        name="Target",
+        description="Set which proxies to hydrate",
+        default="SELECTED",
+    ) # type: ignore
+
+    def execute(self, context : bpy.types.Context):
+        if self.target == "SELECTED":
+            objects = context.selected_objects
+        else:
+            objects = [ob for ob in context.view_layer.objects if ob.visible_get()]
+        count = hydrate_proxies(context, objects)
+        self.report({'INFO'}, "Hydrated {} proxies".format(count))
+        return {'FINISHED'}
+
+
+class LoadTiles(Operator):
+    """Load the full resolution points of Rhino point cloud tiles from the tile cache"""
+    bl_idname = "import_3dm.load_tiles"
+    bl_label = "Load Full Point Cloud Tiles"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    target: EnumProperty(
+        items=(("SELECTED", "Selected", "Load the selected tiles."),
+               ("RENDER", "Render", "Load the tiles that get rendered, run this before rendering.")),
+        name="Target",
+        description="Set which tiles to load",
+        default="SELECTED",
+    ) # type: ignore
+
+    def execute(self, context : bpy.types.Context):
+        if self.target == "SELECTED":
+            tiles = [ob for ob in context.selected_objects if ob.get("rhtile_lod", False)]
+        else:
+            tiles = converters.renderable_tiles(context.scene)
+        for tile_ob in tiles:
+            converters.load_full_tile(tile_ob)
+        self.report({'INFO'}, "Loaded {} tiles".format(len(tiles)))
+        return {'FINISHED'}
+
+
+def _active_groups(context : bpy.types.Context, all_groups : bool):
+    groups = list(context.active_object.get(converters.groups.GROUP_PROP, ()))
+    return set(groups) if all_groups else set(groups[:1])
+
+
+class SelectGroup(Operator):
+    """Select the objects in the Rhino group of the active object"""
+    bl_idname = "import_3dm.select_group"
+    bl_label = "Select Rhino Group"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    all_groups: BoolProperty(
+        name="All Groups",
+        description="Use all groups of the active object instead of only the innermost one.",
+        default=False,
+    ) # type: ignore
+
+    extend: BoolProperty(
+        name="Extend",
+        description="Add to the current selection.",
+        default=False,
+    ) # type: ignore
+
+    @classmethod
+    def poll(cls, context: bpy.types.Context):
+        ob = context.active_object
+        return ob is not None and converters.groups.GROUP_PROP in ob
+
+    def execute(self, context : bpy.types.Context):
+        numbers = _active_groups(context, self.all_groups)
+        members = converters.group_members(context.view_layer.objects)
+        if not self.extend:
+            for ob in context.selected_objects:
+                ob.select_set(False)
+        count = 0
+        for number in numbers:
+            for ob in members.get(number, ()):
+                if ob.visible_get():
+                    ob.select_set(True)
+                    count += 1
+        names = ", ".join(converters.group_name(context.scene, n) for n in numbers)
+        self.report({'INFO'}, "Selected {} objects in {}".format(count, names))
+        return {'FINISHED'}
+
+
+class IsolateGroup(Operator):
+    """Hide all objects that are not in the Rhino group of the active object"""
+    bl_idname = "import_3dm.isolate_group"
+    bl_label = "Isolate Rhino Group"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    all_groups: BoolProperty(
+        name="All Groups",
+        description="Use all groups of the active object instead of only the innermost one.",
+        default=False,
+    ) # type: ignore
+
+    @classmethod
+    def poll(cls, context: bpy.types.Context):
+        ob = context.active_object
+        return ob is not None and converters.groups.GROUP_PROP in ob
+
+    def execute(self, context : bpy.types.Context):
+        numbers = _active_groups(context, self.all_groups)
+        members = converters.group_members(context.view_layer.objects)
+        isolated = set()
+        for number in numbers:
+            isolated.update(ob.name for ob in members.get(number, ()))
+        for ob in context.view_layer.objects:
+            ob.hide_set(ob.name not in isolated)
+        return {'FINISHED'}
+
+
 class IO_FH_3dm_import(bpy.types.FileHandler):
     bl_idname = "IO_FH_3dm_import"
     bl_label = "File handler for Rhinoceros 3D file import"
@@ -314,18 +889,55 @@ class IO_FH_3dm_import(bpy.types.FileHandler):
 # Only needed if you want to add into a dynamic menu
 def menu_func_import(self, _ : bpy.types.Context):
     self.layout.operator(Import3dm.bl_idname, text="Rhinoceros 3D (.3dm)")
+    self.layout.operator(Import3dmNoUndo.bl_idname, text="Rhinoceros 3D (.3dm, No Undo)")
+
+
+def menu_func_object(self, _ : bpy.types.Context):
+    self.layout.separator()
+    self.layout.operator(HydrateMaterials.bl_idname, text="Hydrate Selected Rhino Materials").target = "SELECTED"
+    self.layout.operator(HydrateMaterials.bl_idname, text="Hydrate Rendered Rhino Materials").target = "RENDER"
+    self.layout.operator(SelectGroup.bl_idname)
+    self.layout.operator(IsolateGroup.bl_idname)
+    self.layout.operator(HydrateProxies.bl_idname, text="Hydrate Selected Rhino Proxies").target = "SELECTED"
+    self.layout.operator(HydrateProxies.bl_idname, text="Hydrate Visible Rhino Proxies").target = "VISIBLE"
+    self.layout.operator(LoadTiles.bl_idname, text="Load Rendered Point Cloud Tiles").target = "RENDER"
 
 
 def register():
+    bpy.utils.register_class(Import3dmPreferences)
+    bpy.utils.register_class(ClearModelCache)
+    bpy.utils.register_class(TrimTextureCache)
     bpy.utils.register_class(Import3dm)
+    bpy.utils.register_class(Import3dmNoUndo)
     bpy.utils.register_class(IO_FH_3dm_import)
+    bpy.utils.register_class(HydrateMaterials)
+    bpy.utils.register_class(HydrateProxies)
+    bpy.utils.register_class(LoadTiles)
+    bpy.utils.register_class(SelectGroup)
+    bpy.utils.register_class(IsolateGroup)
     bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
+    bpy.types.VIEW3D_MT_object.append(menu_func_object)
+    read3dm.register_handlers()
+    # the preference update callback only runs when it is edited
+    model_cache.set_limit(read3dm.model_cache_limit(bpy.context))
 
 
 def unregister():
+    bpy.utils.unregister_class(Import3dmPreferences)
+    bpy.utils.unregister_class(ClearModelCache)
+    bpy.utils.unregister_class(TrimTextureCache)
     bpy.utils.unregister_class(Import3dm)
+    bpy.utils.unregister_class(Import3dmNoUndo)
     bpy.utils.unregister_class(IO_FH_3dm_import)
+    bpy.utils.unregister_class(HydrateMaterials)
+    bpy.utils.unregister_class(HydrateProxies)
+    bpy.utils.unregister_class(LoadTiles)
+    bpy.utils.unregister_class(SelectGroup)
+    bpy.utils.unregister_class(IsolateGroup)
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
+    bpy.types.VIEW3D_MT_object.remove(menu_func_object)
+    read3dm.unregister_handlers()
+    model_cache.clear()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,861 @@
+# MIT License
+
+# Copyright (c) 2018-2024 Nathan Letwory, Joel Putnam, Tom Svilans, Lukas Fertig
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Extract rhino3dm geometry into flat NumPy buffers.
+
+This module doesn't use bpy, so it can be used and benchmarked with
+plain Python. The converters turn the buffers into Blender data with
+foreach_set.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import numpy as np
+import rhino3dm as r3d
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class GeometryBuffer:
+    """
+    Flat arrays describing one Rhino geometry.
+
+    positions    (N, 3) float32, in model units
+    face_sizes   (F,) int32, 3 or 4 for each face
+    face_indices (L,) int32, vertex index of each face corner
+    uvs          (N, 2) float32 per vertex or (L, 2) per face corner
+    uvs_per_loop True if uvs are per face corner
+    colors       (N, 4) float32 in the range 0..1
+    normals      (N, 3) float32
+    part_offsets (P + 1,) int32, first vertex of each concatenated part
+
+    Any of the optional arrays is None when the geometry doesn't
+    have that data. Point clouds have no faces.
+    """
+    __slots__ = (
+        "positions",
+        "face_sizes",
+        "face_indices",
+        "uvs",
+        "uvs_per_loop",
+        "colors",
+        "normals",
+        "part_offsets",
+    )
+
+    def __init__(self, positions, face_sizes=None, face_indices=None, uvs=None,
+                 uvs_per_loop=False, colors=None, normals=None, part_offsets=None):
+        self.positions = positions
+        self.face_sizes = face_sizes
+        self.face_indices = face_indices
+        self.uvs = uvs
+        self.uvs_per_loop = uvs_per_loop
+        self.colors = colors
+        self.normals = normals
+        if part_offsets is None:
+            part_offsets = np.array([0, len(positions)], dtype=np.int32)
+        self.part_offsets = part_offsets
+
+    @property
+    def vertex_count(self):
+        return len(self.positions)
+
+    @property
+    def face_count(self):
+        return 0 if self.face_sizes is None else len(self.face_sizes)
+
+    @property
+    def loop_count(self):
+        return 0 if self.face_indices is None else len(self.face_indices)
+
+    def loop_starts(self):
+        """
+        Index of the first face corner of each face.
+        """
+        starts = np.zeros(self.face_count, dtype=np.int32)
+        if self.face_count > 1:
+            np.cumsum(self.face_sizes[:-1], out=starts[1:])
+        return starts
+
+    def nbytes(self):
+        return sum(getattr(self, a).nbytes for a in self.__slots__
+                   if isinstance(getattr(self, a), np.ndarray))
+
+
+@contextlib.contextmanager
+def _exclusive(f):
+    """
+    Hold an exclusive lock on the open file f, waiting for other
+    processes to release theirs.
+    """
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+    try:
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class BufferCache:
+    """
+    On-disk cache of GeometryBuffers for the objects of one 3dm file.
+    All arrays are appended to one data file at aligned offsets, an
+    index file maps each key to the offsets, dtypes and shapes of its
+    arrays. Cached buffers are read as views of a memory map of the
+    data file, without copying.
+
+    Several processes can share a cache: appends and index writes hold
+    a lock, and flush merges the index on disk with the entries added
+    here. Until flush the cache holds a shared lock marking it as in
+    use, so that trimming skips it.
+    """
+    ALIGN = 64
+    DATA = "buffers.bin"
+    INDEX = "index.json"
+    LOCK = "write.lock"
+    USERS = "users.lock"
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # mark the cache as recently used for trimming
+        os.utime(directory)
+        self._datapath = os.path.join(directory, self.DATA)
+        self._indexpath = os.path.join(directory, self.INDEX)
+        self._map = None
+        self._writer = None
+        self._lock = None
+        self._users = None
+        self._dirty = False
+        self._open()
+        self.index = self._read_index()
+
+    @staticmethod
+    def in_use(directory):
+        """
+        True if a process has the cache in directory open. Always
+        False where file locks aren't available to check.
+        """
+        if fcntl is None:
+            return False
+        try:
+            with open(os.path.join(directory, BufferCache.USERS), "a+b") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    def _open(self):
+        if self._users is not None:
+            return
+        self._lock = open(os.path.join(self.directory, self.LOCK), "a+b")
+        self._users = open(os.path.join(self.directory, self.USERS), "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._users.fileno(), fcntl.LOCK_SH)
+
+    def _read_index(self):
+        if not (os.path.exists(self._indexpath) and os.path.exists(self._datapath)):
+            return dict()
+        try:
+            with open(self._indexpath, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def _mapped(self, end):
+        if self._writer is not None:
+            self._writer.flush()
+        if self._map is None or len(self._map) < end:
+            self._map = np.memmap(self._datapath, dtype=np.uint8, mode="r")
+        return self._map
+
+    def get(self, key):
+        """
+        The buffer cached under key, or None.
+        """
+        entry = self.index.get(key, None)
+        if entry is None:
+            return None
+        self._open()
+        arrays = entry["arrays"]
+        end = max((a[0] + a[3] for a in arrays.values()), default=0)
+        data = self._mapped(end) if arrays else None
+        fields = dict()
+        for name, (offset, dtype, shape, nbytes) in arrays.items():
+            fields[name] = data[offset:offset + nbytes].view(dtype).reshape(shape)
+        return GeometryBuffer(
+            fields["positions"],
+            face_sizes=fields.get("face_sizes", None),
+            face_indices=fields.get("face_indices", None),
+            uvs=fields.get("uvs", None),
+            uvs_per_loop=entry["uvs_per_loop"],
+            colors=fields.get("colors", None),
+            normals=fields.get("normals", None),
+            part_offsets=fields.get("part_offsets", None),
+        )
+
+    def put(self, key, buffer):
+        """
+        Append buffer to the data file under key, unless key is
+        cached already.
+        """
+        if key in self.index:
+            return
+        self._open()
+        if self._writer is None:
+            self._writer = open(self._datapath, "ab")
+        arrays = dict()
+        # other processes append to the same file, offsets are only
+        # valid while holding the lock
+        with _exclusive(self._lock):
+            self._writer.seek(0, os.SEEK_END)
+            for name in GeometryBuffer.__slots__:
+                arr = getattr(buffer, name)
+                if not isinstance(arr, np.ndarray):
+                    continue
+                arr = np.ascontiguousarray(arr)
+                offset = self._writer.tell()
+                padding = -offset % self.ALIGN
+                if padding:
+                    self._writer.write(b"\0" * padding)
+                    offset += padding
+                self._writer.write(arr.tobytes())
+                arrays[name] = (offset, arr.dtype.str, list(arr.shape), arr.nbytes)
+            self._writer.flush()
+        self.index[key] = {"arrays": arrays, "uvs_per_loop": bool(buffer.uvs_per_loop)}
+        self._dirty = True
+
+    def flush(self):
+        """
+        Close the data file, merge the new entries into the index on
+        disk and release the cache. It is opened again on the next get
+        or put.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._dirty:
+            with _exclusive(self._lock):
+                index = self._read_index()
+                index.update(self.index)
+                tmppath = "{}.{}.tmp".format(self._indexpath, os.getpid())
+                with open(tmppath, "w") as f:
+                    json.dump(index, f)
+                os.replace(tmppath, self._indexpath)
+            self.index = index
+            self._dirty = False
+        self._map = None
+        if self._users is not None:
+            self._users.close()
+            self._lock.close()
+            self._users = None
+            self._lock = None
+
+
+def _float_array(items, count, width, fields):
+    """
+    Get count elements of items as a (count, width) float32 array. Use
+    the ToFloatArray bulk accessor when the rhino3dm build has it, read
+    fields of each element otherwise. fields is a tuple of attribute
+    names, or None when the elements are sequences themselves.
+
+    rhino3dm 8.17 has no bulk accessors on the mesh lists, so every
+    element goes through Python there. Indexing the list creates the
+    element, it is fetched once for all its fields.
+    """
+    to_float_array = getattr(items, "ToFloatArray", None)
+    if to_float_array:
+        return np.asarray(to_float_array(), dtype=np.float32).reshape(-1, width)
+    elements = (items[i] for i in range(count))
+    if fields is None:
+        values = [tuple(item)[:width] for item in elements]
+    else:
+        values = [tuple(getattr(item, f) for f in fields) for item in elements]
+    return np.array(values, dtype=np.float32).reshape(-1, width)
+
+
+def mesh_positions(m):
+    vertices = m.Vertices
+    return _float_array(vertices, len(vertices), 3, ("X", "Y", "Z"))
+
+
+def mesh_faces(m):
+    """
+    Get the faces of m as (face_sizes, face_indices). Rhino always uses
+    four indices per face, triangles repeat the third index.
+    """
+    faces = m.Faces
+    count = len(faces)
+    to_int_array = getattr(faces, "ToIntArray", None)
+    if to_int_array:
+        quads = np.asarray(to_int_array(), dtype=np.int32).reshape(-1, 4)
+    else:
+        quads = np.array([faces[f][:4] for f in range(count)], dtype=np.int32).reshape(-1, 4)
+    is_quad = quads[:, 3] != quads[:, 2]
+    face_sizes = np.where(is_quad, 4, 3).astype(np.int32)
+    mask = np.ones(quads.shape, dtype=bool)
+    mask[:, 3] = is_quad
+    return (face_sizes, quads[mask])
+
+
+def mesh_uvs(m):
+    """
+    Texture coordinates of m as a (N, 2) float array, or None if m
+    doesn't have any.
+    """
+    tcs = m.TextureCoordinates
+    count = len(tcs)
+    if count == 0:
+        return None
+    return _float_array(tcs, count, 2, ("X", "Y"))
+
+
+def mesh_colors(m):
+    """
+    Vertex colors of m as a (N, 4) float array in the range 0..1, or
+    None if m doesn't have any.
+    """
+    vcs = m.VertexColors
+    count = len(vcs)
+    if count == 0:
+        return None
+    return _float_array(vcs, count, 4, None) / 255.0
+
+
+def mesh_normals(m):
+    """
+    Vertex normals of m as a (N, 3) float array, or None if m doesn't
+    have a normal for every vertex.
+    """
+    normals = m.Normals
+    count = len(m.Vertices)
+    if len(normals) != count:
+        return None
+    return _float_array(normals, count, 3, ("X", "Y", "Z"))
+
+
+def render_meshes(og):
+    """
+    Get the meshes to import for og as a tuple (meshes, texture_meshes).
+    texture_meshes holds meshes that only provide per face corner
+    texture coordinates, and is empty for all but SubDs.
+    """
+    if og.ObjectType == r3d.ObjectType.Extrusion:
+        return ([og.GetMesh(r3d.MeshType.Any)], [])
+    if og.ObjectType == r3d.ObjectType.Mesh:
+        return ([og], [])
+    if og.ObjectType == r3d.ObjectType.SubD:
+        return ([r3d.Mesh.CreateFromSubDControlNet(og, False)],
+                [r3d.Mesh.CreateFromSubDControlNet(og, True)])
+    if og.ObjectType == r3d.ObjectType.Brep:
+        faces = og.Faces
+        meshes = []
+        for f in range(len(faces)):
+            face = faces[f]
+            if type(face) != list:
+                meshes.append(face.GetMesh(r3d.MeshType.Any))
+        return (meshes, [])
+    return ([], [])
+
+
+def mesh_buffer(meshes, texture_meshes=(), normals=False):
+    """
+    Concatenate meshes into one GeometryBuffer, offsetting the face
+    indices of each part. Texture coordinates and colors are kept when
+    any part has them, parts without get zero coordinates and white.
+    Normals are only kept when every part provides them for every
+    vertex.
+    """
+    meshes = [m for m in meshes if m]
+
+    positions = []
+    face_sizes = []
+    face_indices = []
+    uvs = []
+    colors = []
+    nrmls = [] if normals else None
+    offsets = [0]
+
+    for m in meshes:
+        pos = mesh_positions(m)
+        sizes, indices = mesh_faces(m)
+        positions.append(pos)
+        face_sizes.append(sizes)
+        face_indices.append(indices + offsets[-1])
+        offsets.append(offsets[-1] + len(pos))
+
+        muvs = mesh_uvs(m)
+        uvs.append(muvs if muvs is not None and len(muvs) == len(pos) else None)
+        mcolors = mesh_colors(m)
+        colors.append(mcolors if mcolors is not None and len(mcolors) == len(pos) else None)
+        if nrmls is not None:
+            mnormals = mesh_normals(m)
+            nrmls = nrmls + [mnormals] if mnormals is not None else None
+
+    def _join(arrays, width, dtype=np.float32):
+        if not arrays:
+            return np.zeros((0, width), dtype=dtype) if width else np.zeros(0, dtype=dtype)
+        return np.concatenate(arrays)
+
+    def _fill(arrays, width, value):
+        # None if no part has the data, else fill the parts without
+        if all(a is None for a in arrays):
+            return None
+        return [a if a is not None else np.full((len(p), width), value, dtype=np.float32)
+                for a, p in zip(arrays, positions)]
+
+    uvs = _fill(uvs, 2, 0.0)
+    colors = _fill(colors, 4, 1.0)
+
+    buffer = GeometryBuffer(
+        _join(positions, 3),
+        face_sizes=_join(face_sizes, 0, np.int32),
+        face_indices=_join(face_indices, 0, np.int32),
+        uvs=_join(uvs, 2) if uvs else None,
+        colors=_join(colors, 4) if colors else None,
+        normals=_join(nrmls, 3) if nrmls else None,
+        part_offsets=np.array(offsets, dtype=np.int32),
+    )
+
+    texture_meshes = [mt for mt in texture_meshes if mt]
+    if texture_meshes:
+        loop_uvs = [mesh_uvs(mt) for mt in texture_meshes]
+        loop_uvs = [u for u in loop_uvs if u is not None]
+        if loop_uvs:
+            buffer.uvs = np.concatenate(loop_uvs)
+            buffer.uvs_per_loop = True
+
+    return buffer
+
+
+def point_positions(og):
+    """
+    Point positions of point cloud og as a (N, 3) float array.
+    """
+    to_float_array = getattr(og, "ToFloatArray", None)
+    if to_float_array:
+        return np.asarray(to_float_array(), dtype=np.float32).reshape(-1, 3)
+    get_points = getattr(og, "GetPoints", None)
+    pts = get_points() if get_points else [og[v] for v in range(og.Count)]
+    return np.array([(p.X, p.Y, p.Z) for p in pts], dtype=np.float32).reshape(-1, 3)
+
+
+def point_colors(og):
+    """
+    Point colors of point cloud og as a (N, 4) float array in the
+    range 0..1, or None if og doesn't have colors.
+    """
+    if not getattr(og, "ContainsColors", False):
+        return None
+    get_colors = getattr(og, "GetColors", None)
+    if not get_colors:
+        return None
+    colors = np.array(get_colors(), dtype=np.float32).reshape(-1, 4)
+    return colors / 255.0
+
+
+def point_normals(og):
+    """
+    Point normals of point cloud og as a (N, 3) float array, or None
+    if og doesn't have normals.
+    """
+    if not getattr(og, "ContainsNormals", False):
+        return None
+    get_normals = getattr(og, "GetNormals", None)
+    if not get_normals:
+        return None
+    return np.array([(n.X, n.Y, n.Z) for n in get_normals()], dtype=np.float32).reshape(-1, 3)
+
+
+def pointcloud_buffer(og):
+    return GeometryBuffer(point_positions(og), colors=point_colors(og), normals=point_normals(og))
+
+
+def geometry_buffer(og, normals=False):
+    """
+    Extract og into a GeometryBuffer. Returns None for geometry types
+    that have no buffer representation.
+    """
+    if og.ObjectType == r3d.ObjectType.PointSet:
+        return pointcloud_buffer(og)
+    meshes, texture_meshes = render_meshes(og)
+    if not meshes:
+        return None
+    return mesh_buffer(meshes, texture_meshes, normals)
+
+
+# *** proxies
+
+_BOX_FACES = np.array([
+    0, 3, 2, 1,
+    4, 5, 6, 7,
+    0, 1, 5, 4,
+    1, 2, 6, 5,
+    2, 3, 7, 6,
+    3, 0, 4, 7,
+], dtype=np.int32)
+
+
+def bbox_buffer(minimum, maximum):
+    """
+    A GeometryBuffer holding the box between the corner points minimum
+    and maximum, given as (x, y, z) sequences.
+    """
+    (x0, y0, z0), (x1, y1, z1) = minimum, maximum
+    positions = np.array([
+        (x0, y0, z0), (x1, y0, z0), (x1, y1, z0), (x0, y1, z0),
+        (x0, y0, z1), (x1, y0, z1), (x1, y1, z1), (x0, y1, z1),
+    ], dtype=np.float32)
+    return GeometryBuffer(positions, face_sizes=np.full(6, 4, dtype=np.int32), face_indices=_BOX_FACES.copy())
+
+
+def triangles(buffer):
+    """
+    The faces of buffer as a (T, 3) index array, quads split in two.
+    """
+    starts = buffer.loop_starts()
+    idx = buffer.face_indices
+    tris = [np.stack((idx[starts], idx[starts + 1], idx[starts + 2]), axis=1)]
+    quads = starts[buffer.face_sizes == 4]
+    if len(quads):
+        tris.append(np.stack((idx[quads], idx[quads + 2], idx[quads + 3]), axis=1))
+    return np.concatenate(tris)
+
+
+def decimate_buffer(buffer, resolution):
+    """
+    Reduce buffer by vertex clustering: vertices are snapped to a grid
+    with resolution cells along the longest side of the bounding box,
+    each occupied cell becomes one vertex at the mean of its members.
+    Triangles collapsing to a line or point are dropped. Returns a new
+    buffer without texture coordinates, colors or normals.
+    """
+    if buffer.vertex_count == 0 or buffer.face_count == 0:
+        return buffer
+    positions = buffer.positions
+    lo = positions.min(axis=0)
+    extent = float((positions.max(axis=0) - lo).max())
+    if extent == 0.0:
+        return buffer
+    cell = extent / max(int(resolution), 1)
+
+    cells = np.floor((positions - lo) / cell).astype(np.int64)
+    _, cluster, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    cluster = cluster.reshape(-1)
+    sums = np.zeros((len(counts), 3), dtype=np.float64)
+    np.add.at(sums, cluster, positions)
+    new_positions = (sums / counts[:, None]).astype(np.float32)
+
+    tris = cluster[triangles(buffer)]
+    keep = (tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 2] != tris[:, 0])
+    tris = np.unique(np.sort(tris[keep], axis=1), axis=0) if keep.any() else tris[keep]
+
+    return GeometryBuffer(
+        new_positions,
+        face_sizes=np.full(len(tris), 3, dtype=np.int32),
+        face_indices=tris.astype(np.int32).ravel(),
+    )
+
+
+# *** canonical forms
+
+def _reference_axes(centered, basis, tolerance):
+    """
+    Orthonormal axes spanning the rows of basis, picked by projecting
+    the vertices in order onto the subspace. Copies with the same vertex
+    order get the same axes no matter how the subspace is rotated.
+    """
+    axes = []
+    for p in centered @ basis.T:
+        for a in axes:
+            p = p - (p @ a) * a
+        length = np.linalg.norm(p)
+        if length > tolerance:
+            axes.append(p / length)
+            if len(axes) == len(basis):
+                break
+    # flat or degenerate data, complete with the basis itself
+    for b in np.eye(len(basis)):
+        if len(axes) == len(basis):
+            break
+        for a in axes:
+            b = b - (b @ a) * a
+        length = np.linalg.norm(b)
+        if length > 1e-6:
+            axes.append(b / length)
+    return np.array(axes) @ basis
+
+
+def canonical_frame(positions, tolerance):
+    """
+    Find the frame of positions: the centroid and a rotation built from
+    the principal axes. Axes with distinct variance come from the
+    eigenvectors of the covariance, their signs and any axes sharing a
+    variance are fixed by the vertex order. Returns (centroid, rotation,
+    canonical) where canonical = (positions - centroid) @ rotation.T.
+    The rotation is always proper, mirrored copies don't share a
+    canonical form.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    centroid = positions.mean(axis=0)
+    centered = positions - centroid
+
+    values, vectors = np.linalg.eigh(centered.T @ centered / len(positions))
+    values = values[::-1]
+    vectors = vectors[:, ::-1].T
+
+    # group axes with (nearly) the same variance
+    gap = max(values[0], tolerance * tolerance) * 1e-4
+    groups = [[0]]
+    for i in (1, 2):
+        if values[groups[-1][-1]] - values[i] > gap:
+            groups.append([i])
+        else:
+            groups[-1].append(i)
+
+    axes = np.concatenate([_reference_axes(centered, vectors[g], tolerance) for g in groups])
+    rotation = np.array([axes[0], axes[1], np.cross(axes[0], axes[1])])
+    return (centroid, rotation, centered @ rotation.T)
+
+
+def canonical_key(canonical, face_indices, quantum):
+    """
+    Bucket of a canonical form: a hash of the topology and the spread
+    of the vertices along the first axis, snapped to quantum. Rounding
+    the coordinates themselves would put copies with float noise into
+    different buckets. The spreads of copies within quantum of each
+    other are at most one bucket apart, look them up with
+    neighbour_keys.
+    """
+    sha = hashlib.sha1()
+    sha.update(np.int64(len(canonical)).tobytes())
+    sha.update(np.asarray(face_indices, dtype=np.int32).tobytes())
+    spread = float(np.sqrt(np.mean(canonical[:, 0] ** 2)))
+    return (sha.hexdigest(), int(np.floor(spread / quantum)))
+
+
+def neighbour_keys(key):
+    """
+    The canonical keys a copy of the form with key may have.
+    """
+    return [(key[0], key[1] + d) for d in (0, -1, 1)]
+
+
+# *** polygon budget
+
+def triangle_count(buffer):
+    if buffer.face_count == 0:
+        return 0
+    return int((buffer.face_sizes - 2).sum())
+
+
+def mesh_triangle_count(meshes):
+    """
+    Number of triangles in meshes, counting quads as two, without
+    extracting the faces.
+    """
+    count = 0
+    for m in meshes:
+        if not m:
+            continue
+        faces = m.Faces
+        triangles_ = getattr(faces, "TriangleCount", None)
+        quads = getattr(faces, "QuadCount", None)
+        if triangles_ is not None and quads is not None:
+            count += triangles_ + 2 * quads
+        else:
+            count += 2 * len(faces)
+    return count
+
+
+def boundary_vertices(buffer):
+    """
+    Mask of the vertices on open edges, edges used by only one face.
+    Brep face boundaries and texture seams are open edges since the
+    vertices along them are split.
+    """
+    mask = np.zeros(buffer.vertex_count, dtype=bool)
+    if buffer.face_count == 0:
+        return mask
+    starts = buffer.loop_starts()
+    loops = np.arange(buffer.loop_count)
+    following = loops + 1
+    last = starts + buffer.face_sizes - 1
+    following[last] = starts
+    idx = buffer.face_indices
+    edges = np.sort(np.stack((idx[loops], idx[following]), axis=1), axis=1)
+    unique, counts = np.unique(edges, axis=0, return_counts=True)
+    mask[unique[counts == 1].ravel()] = True
+    return mask
+
+
+def _cluster(buffer, resolution, parts, keep, keep_scale=0):
+    """
+    Cluster the vertices of buffer on a grid with resolution cells
+    along the longest side. Vertices of different parts never share a
+    cluster. Vertices in keep are clustered apart from the others on a
+    grid keep_scale times finer, or get a cluster of their own with a
+    keep_scale of 0. Returns the cluster of each vertex and the number
+    of clusters.
+    """
+    positions = buffer.positions
+    lo = positions.min(axis=0)
+    extent = float((positions.max(axis=0) - lo).max())
+    cell = max(extent / max(int(resolution), 1), 1e-12)
+    keys = np.empty((buffer.vertex_count, 4), dtype=np.int64)
+    keys[:, 0] = parts
+    keys[:, 1:] = np.floor((positions - lo) / cell).astype(np.int64)
+    if keep is not None:
+        kept = np.flatnonzero(keep)
+        if keep_scale:
+            keys[kept, 0] = -1 - parts[kept]
+            keys[kept, 1:] = np.floor((positions[kept] - lo) * (keep_scale / cell)).astype(np.int64)
+        else:
+            keys[kept, 0] = -1 - kept
+            keys[kept, 1:] = 0
+    _, cluster, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    return (cluster.reshape(-1), len(counts))
+
+
+def _finest_clustering(buffer, max_triangles, iterations, parts, keep, keep_scale):
+    """
+    Search for the finest grid clustering buffer to at most max_triangles
+    triangles. Returns (cluster, count, triangles), or None if even the
+    coarsest grid doesn't fit.
+    """
+    best = None
+    lo, hi = 1, 1 << 16
+    for _ in range(iterations):
+        if lo > hi:
+            break
+        resolution = (lo + hi) // 2
+        cluster, count = _cluster(buffer, resolution, parts, keep, keep_scale)
+        tris = _clustered_triangles(buffer, cluster)
+        if len(tris) <= max_triangles:
+            best = (cluster, count, tris)
+            lo = resolution + 1
+        else:
+            hi = resolution - 1
+    if best is None and hi >= 1:
+        # the search ran out of iterations above the coarsest grid
+        cluster, count = _cluster(buffer, 1, parts, keep, keep_scale)
+        tris = _clustered_triangles(buffer, cluster)
+        if len(tris) <= max_triangles:
+            best = (cluster, count, tris)
+    return best
+
+
+def _clustered_triangles(buffer, cluster):
+    tris = cluster[triangles(buffer)]
+    keep = (tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 2] != tris[:, 0])
+    tris = tris[keep]
+    if len(tris):
+        # drop duplicates of the same triangle, keeping the winding
+        _, first = np.unique(np.sort(tris, axis=1), axis=0, return_index=True)
+        tris = tris[np.sort(first)]
+    return tris
+
+
+def _cluster_mean(values, cluster, count):
+    sums = np.stack([np.bincount(cluster, weights=values[:, i], minlength=count)
+                     for i in range(values.shape[1])], axis=1)
+    sizes = np.bincount(cluster, minlength=count)[:, None]
+    return (sums / np.maximum(sizes, 1)).astype(np.float32)
+
+
+def decimate_to_budget(buffer, max_triangles, iterations=17):
+    """
+    Reduce buffer to at most max_triangles triangles by vertex
+    clustering, searching for the finest grid that fits the budget.
+    Vertices on part boundaries and texture seams are kept where
+    possible so that adjacent Brep faces don't crack: if keeping them
+    can't meet the budget they are clustered on a finer grid than the
+    other vertices, then like the others, and last the parts are merged
+    as well. Per vertex texture coordinates, colors and normals are
+    averaged per cluster, per face corner texture coordinates are
+    dropped. Tiny budgets can still be exceeded by the coarsest grid,
+    check the triangle count of the result.
+    """
+    if triangle_count(buffer) <= max_triangles or buffer.vertex_count == 0:
+        return buffer
+
+    parts = np.searchsorted(buffer.part_offsets, np.arange(buffer.vertex_count), side="right") - 1
+    keep = boundary_vertices(buffer)
+    merged = np.zeros_like(parts)
+
+    best = None
+    for part_ids, mask, keep_scale in ((parts, keep, 0), (parts, keep, 4), (parts, None, 0), (merged, None, 0)):
+        best = _finest_clustering(buffer, max_triangles, iterations, part_ids, mask, keep_scale)
+        if best is not None:
+            break
+    if best is None:
+        cluster, count = _cluster(buffer, 1, merged, None)
+        best = (cluster, count, _clustered_triangles(buffer, cluster))
+    cluster, count, tris = best
+
+    uvs = None
+    if buffer.uvs is not None and not buffer.uvs_per_loop:
+        uvs = _cluster_mean(buffer.uvs, cluster, count)
+    colors = _cluster_mean(buffer.colors, cluster, count) if buffer.colors is not None else None
+    normals = None
+    if buffer.normals is not None:
+        normals = _cluster_mean(buffer.normals, cluster, count)
+        lengths = np.linalg.norm(normals, axis=1)[:, None]
+        normals = np.where(lengths > 0.0, normals / np.maximum(lengths, 1e-12), normals).astype(np.float32)
+
+    # drop clusters no triangle uses
+    used = np.zeros(count, dtype=bool)
+    used[tris.ravel()] = True
+    remap = (np.cumsum(used) - 1).astype(np.int32)
+
+    def _used(values):
+        return values[used] if values is not None else None
+
+    return GeometryBuffer(
+        _cluster_mean(buffer.positions, cluster, count)[used],
+        face_sizes=np.full(len(tris), 3, dtype=np.int32),
+        face_indices=remap[tris].ravel(),
+        uvs=_used(uvs),
+        colors=_used(colors),
+        normals=_used(normals),
+    )
@@ -23,22 +23,30 @@
 import rhino3dm as r3d
 import bpy
 from bpy import context
+from mathutils import Matrix
 
 import uuid
 
 from typing import Any, Dict
 
-from .material import handle_materials, material_name, DEFAULT_RHINO_MATERIAL
-from .layers import handle_layers
-from .render_mesh import import_render_mesh
+from .material import handle_materials, material_name, material_key, DEFAULT_RHINO_MATERIAL, trim_texture_cache
+from .layers import handle_layers, get_layer
+from .render_mesh import import_render_mesh, proxy_source, build_render_mesh, render_mesh_triangles
+from .render_mesh import decimate_to_face_budget
 from .curve import import_curve
 from .views import handle_views
-from .groups import handle_groups
+from .groups import handle_groups, handle_group_attributes, group_members, group_name
 from .instances import import_instance_reference, handle_instance_definitions, populate_instance_definitions
-from .pointcloud import import_pointcloud
+from .instances import reachable_instance_definitions
+from .pointcloud import import_pointcloud, import_pointcloud_tiles, needs_tiling
+from .pointcloud import load_full_tile, renderable_tiles, trim_tile_cache
+from . import pointcloud
 from .annotation import import_annotation
 
 from . import utils
+from . import annotation
+from . import instancing
+from . import groups
 
 '''
 Dictionary mapping between the Rhino file types and importer functions
@@ -60,10 +68,21 @@ def initialize(
         context     : bpy.types.Context
 ) -> None:
     utils.reset_all_dict(context)
+    annotation.initialize()
+    instancing.initialize()
+    groups.initialize()
 
 def cleanup() -> None:
     utils.clear_all_dict()
 
+
+def register_handlers() -> None:
+    pointcloud.register_handlers()
+
+
+def unregister_handlers() -> None:
+    pointcloud.unregister_handlers()
+
 # TODO: Decouple object data creation from object creation
 #       and consolidate object-level conversion.
 
@@ -91,6 +110,13 @@ def convert_object(
     # and parented to the annotation main import object
     text_curve = None
     text_object = None
+
+    # Large point clouds are imported as a collection of tiles
+    # under the layer instead of a single object
+    if ob.Geometry.ObjectType == r3d.ObjectType.PointSet and needs_tiling(ob.Geometry, options):
+        import_pointcloud_tiles(context, ob, name, layer, rhinomat, view_color, scale, options)
+        return
+
     if ob.Geometry.ObjectType in RHINO_TYPE_TO_IMPORT:
         data = RHINO_TYPE_TO_IMPORT[ob.Geometry.ObjectType](context, ob, name, scale, options)
         if ob.Geometry.ObjectType == r3d.ObjectType.Annotation:
@@ -99,10 +125,24 @@ def convert_object(
 
     mat_from_object = ob.Attributes.MaterialSource == r3d.ObjectMaterialSource.MaterialFromObject
 
-    tags = utils.create_tag_dict(ob.Attributes.Id, ob.Attributes.Name)
+    # merged annotation linework is shared by all annotations on
+    # a layer, so is the object holding it
+    merged = annotation.merges_linework(ob, options)
+
+    if merged and data is not None:
+        tags = utils.create_tag_dict(data['rhid'], data.name)
+    else:
+        tags = utils.create_tag_dict(ob.Attributes.Id, ob.Attributes.Name)
+    # objects sharing the mesh of an automatically found instance
+    # keep the material of the prototype mesh on the data
+    instance_matrix = None
+    if options.get("auto_instancing", False) and ob.Geometry.ObjectType in RHINO_TYPE_TO_IMPORT:
+        instance_matrix = instancing.instance_matrix(ob.Attributes.Id)
+
     if data is not None:
-        data.materials.clear()
-        data.materials.append(rhinomat)
+        if instance_matrix is None:
+            data.materials.clear()
+            data.materials.append(rhinomat)
         blender_object = utils.get_or_create_iddata(context.blend_data.objects, tags, data)
         if link_materials_to == "PREFERENCES":
             link_materials_to = bpy.context.preferences.edit.material_link
@@ -111,9 +151,19 @@ def convert_object(
         for slot in blender_object.material_slots:
             slot.link = link_materials_to
 
+        if options.get("auto_instancing", False) and RHINO_TYPE_TO_IMPORT.get(ob.Geometry.ObjectType) is import_render_mesh:
+            blender_object.matrix_world = instance_matrix if instance_matrix is not None else Matrix.Identity(4)
+            if instance_matrix is not None and len(blender_object.material_slots) > 0:
+                blender_object.material_slots[0].link = 'OBJECT'
+                blender_object.material_slots[0].material = rhinomat
+
         if text_curve:
-            text_tags = utils.create_tag_dict(uuid.uuid1(), f"TXT{ob.Attributes.Name}")
-            text_curve[0].materials.append(rhinomat)
+            # derive the text object id from the annotation id so that
+            # re-imports update the text object in place
+            text_tags = utils.create_tag_dict(uuid.uuid5(ob.Attributes.Id, "annotation-text"), f"TXT{ob.Attributes.Name}")
+            # text curves are shared, the material is linked to the object
+            if len(text_curve[0].materials) == 0:
+                text_curve[0].materials.append(rhinomat)
             text_object = utils.get_or_create_iddata(context.blend_data.objects, text_tags, text_curve[0])
             text_object.material_slots[0].link = 'OBJECT'
             text_object.material_slots[0].material = rhinomat
@@ -121,28 +171,27 @@ def convert_object(
             texmatrix = text_curve[1]
             text_object.matrix_world = texmatrix
     else:
-        blender_object = context.blend_data.objects.new(name+"_Instance", None)
-        utils.tag_data(blender_object, tags)
+        # registered by id like other objects, so that definitions and
+        # groups find nested block instances and re-imports reuse them
+        blender_object = utils.get_or_create_iddata(context.blend_data.objects, tags, None, use_none=True)
+        blender_object.name = name+"_Instance"
 
     blender_object.color = [x/255. for x in view_color]
 
     if ob.Geometry.ObjectType == r3d.ObjectType.InstanceReference and options.get("import_instances",False):
         import_instance_reference(context, ob, blender_object, name, scale, options)
 
-    # If subd, apply subdivision modifier
-    if ob.Geometry.ObjectType == r3d.ObjectType.SubD:
-        if blender_object.modifiers.find("SubD") == -1:
-            blender_object.modifiers.new(type="SUBSURF", name="SubD")
-            blender_object.modifiers["SubD"].levels = options.get("subD_level_viewport", 2)
-            blender_object.modifiers["SubD"].render_levels = options.get("subD_level_render", 2)
-            blender_object.modifiers["SubD"].boundary_smooth = options.get("subD_boundary_smooth", "ALL")
+    # If subd, apply subdivision modifier. Proxies get it once hydrated.
+    if ob.Geometry.ObjectType == r3d.ObjectType.SubD and 'rhproxy' not in data:
+        add_subd_modifier(blender_object, options)
 
     # Import Rhino user strings
-    for pair in ob.Attributes.GetUserStrings():
-        blender_object[pair[0]] = pair[1]
+    if not merged:
+        for pair in ob.Attributes.GetUserStrings():
+            blender_object[pair[0]] = pair[1]
 
-    for pair in ob.Geometry.GetUserStrings():
-        blender_object[pair[0]] = pair[1]
+        for pair in ob.Geometry.GetUserStrings():
+            blender_object[pair[0]] = pair[1]
 
     if not ob.Attributes.IsInstanceDefinitionObject and ob.Geometry.ObjectType != r3d.ObjectType.InstanceReference and update_materials:
         blender_object.material_slots[0].link = 'OBJECT'
@@ -150,19 +199,99 @@ def convert_object(
 
     #instance definition objects are linked within their definition collections
     if not ob.Attributes.IsInstanceDefinitionObject:
-        try:
-            if options.get("import_layers_as_empties", False):
-                blender_object.parent = layer
-                if text_object is not None:
-                    text_object.parent = layer
-                # also link object to same collections as parent
-                for col in layer.users_collection:
-                    col.objects.link(blender_object)
-                    if text_object is not None:
-                        col.objects.link(text_object)
-            else:
-                layer.objects.link(blender_object)
+        if options.get("import_layers_as_empties", False):
+            blender_object.parent = layer
+            if text_object is not None:
+                text_object.parent = layer
+            # also link object to same collections as parent
+            for col in layer.users_collection:
+                _link_object(col, blender_object)
                 if text_object is not None:
-                    layer.objects.link(text_object)
-        except Exception:
-            pass
+                    _link_object(col, text_object)
+        else:
+            _link_object(layer, blender_object)
+            if text_object is not None:
+                _link_object(layer, text_object)
+
+
+def add_subd_modifier(
+        blender_object  : bpy.types.Object,
+        options         : Dict[str, Any]) -> None:
+    if blender_object.modifiers.find("SubD") == -1:
+        blender_object.modifiers.new(type="SUBSURF", name="SubD")
+        blender_object.modifiers["SubD"].levels = options.get("subD_level_viewport", 2)
+        blender_object.modifiers["SubD"].render_levels = options.get("subD_level_render", 2)
+        blender_object.modifiers["SubD"].boundary_smooth = options.get("subD_boundary_smooth", "ALL")
+
+
+def hydrate_proxy_from_cache(
+        context         : bpy.types.Context,
+        cache,
+        blender_object  : bpy.types.Object) -> bool:
+    """
+    Replace the proxy mesh of blender_object with the full render mesh
+    from the buffer cache, without reading the 3dm file. Returns True
+    if the proxy was replaced, False if the mesh isn't cached.
+    """
+    mesh = blender_object.data
+    source = proxy_source(mesh)
+    if source is None:
+        return False
+    buffer = cache.get(mesh['rhid'])
+    if buffer is None:
+        return False
+
+    # the proxy keeps the polygon budget of its import
+    if source.get("face_budget", None) is not None:
+        buffer = decimate_to_face_budget(buffer, source["face_budget"], blender_object.name)
+
+    tags = utils.create_tag_dict(mesh['rhid'], utils.get_tag(mesh, 'rhname'))
+    build_render_mesh(context, tags, blender_object.name, buffer, source["scale"], source)
+    del mesh['rhproxy']
+
+    if source.get("subd", False):
+        add_subd_modifier(blender_object, source)
+    return True
+
+
+def hydrate_proxy(
+        context         : bpy.types.Context,
+        model           : r3d.File3dm,
+        blender_object  : bpy.types.Object,
+        cache = None) -> bool:
+    """
+    Replace the proxy mesh of blender_object with the full render mesh
+    from model. Returns True if the proxy was replaced. The extracted
+    mesh is added to cache if given.
+    """
+    mesh = blender_object.data
+    source = proxy_source(mesh)
+    if source is None:
+        return False
+
+    ob = model.Objects.FindId(uuid.UUID(mesh['rhid']))
+    if ob is None:
+        print("Object {} not found in {}".format(mesh['rhid'], source["file"]))
+        return False
+
+    options = dict(source)
+    options["proxy_mode"] = "NONE"
+    options["rh_buffer_cache"] = cache
+    # the mesh is found by its rhid and filled in place, keeping materials
+    import_render_mesh(context, ob, blender_object.name, source["scale"], options)
+    del mesh['rhproxy']
+
+    if ob.Geometry.ObjectType == r3d.ObjectType.SubD:
+        add_subd_modifier(blender_object, options)
+    return True
+
+
+def _link_object(
+        collection  : bpy.types.Collection,
+        ob          : bpy.types.Object) -> None:
+    if ob.name in collection.objects:
+        return
+    try:
+        collection.objects.link(ob)
+    except Exception:
+        pass
@@ -27,6 +27,8 @@ from . import curve
 
 from mathutils import Matrix
 import math
+import numpy as np
+import uuid
 
 from enum import IntEnum, auto
 import bpy
@@ -45,6 +47,49 @@ class Arrow(IntEnum):
     Leader2 = auto() # used in angular for second arrow
 
 
+# per import caches of dimension styles by id and of unit
+# arrowhead outlines by arrowhead type
+_dimstyles = dict()
+_arrowheads = dict()
+# merged linework curves by layer index
+_linework = dict()
+# shared text curves by (body, size, align_x, align_y)
+_textcurves = dict()
+
+# namespace for the ids of shared text curves
+TEXT_NAMESPACE = uuid.UUID("6f3c2a4e-5b1d-4c8e-9a7f-2d0e1b3c4a5f")
+
+
+def initialize() -> None:
+    global _dimstyles, _arrowheads, _linework, _textcurves
+    _dimstyles = dict()
+    _arrowheads = dict()
+    _linework = dict()
+    _textcurves = dict()
+
+
+def _find_dimstyle(model : r3d.File3dm, dimstyle_id) -> r3d.DimensionStyle:
+    key = str(dimstyle_id)
+    dimstyle = _dimstyles.get(key, None)
+    if dimstyle is None:
+        dimstyle = model.DimStyles.FindId(dimstyle_id)
+        _dimstyles[key] = dimstyle
+    return dimstyle
+
+
+def _arrowhead_outline(arrtype) -> np.ndarray:
+    """
+    Get the outline of the arrowhead type at unit size as
+    a (N, 2) array of plane coordinates.
+    """
+    outline = _arrowheads.get(arrtype, None)
+    if outline is None:
+        points = r3d.Arrowhead.GetPoints(arrtype, 1.0)
+        outline = np.array([(uv.X, uv.Y) for uv in points], dtype=np.float64).reshape(-1, 2)
+        _arrowheads[arrtype] = outline
+    return outline
+
+
 def _arrowtype_from_arrow(dimstyle : r3d.DimensionStyle, arrow : Arrow):
     if arrow == Arrow.Arrow1:
         return dimstyle.ArrowType1
@@ -69,10 +114,7 @@ def _rotate_plane_to_line(plane : r3d.Plane, line : r3d.Line, addangle=0.0):
 
 def _add_arrow(dimstyle : r3d.DimensionStyle, pt : PartType, plane : r3d.Plane, bc, tip : r3d.Point3d, tail : r3d.Point3d, arrow : Arrow, scale : float):
     arrtype = _arrowtype_from_arrow(dimstyle, arrow)
-    arrowhead_points = r3d.Arrowhead.GetPoints(arrtype, 1.0)
-    arrowhead = bc.splines.new('POLY')
-    arrowhead.use_cyclic_u = True
-    arrowhead.points.add(len(arrowhead_points)-1)
+    outline = _arrowhead_outline(arrtype)
     l = r3d.Line(tip, tail)
     arrowLength = dimstyle.ArrowLength
     inside = arrowLength * 2 < l.Length if arrow not in (Arrow.Leader, Arrow.Leader2) else True
@@ -92,11 +134,19 @@ def _add_arrow(dimstyle : r3d.DimensionStyle, pt : PartType, plane : r3d.Plane,
         if arrow == Arrow.Arrow1:
             tip_plane = tip_plane.Rotate(math.pi, tip_plane.ZAxis)
 
-    if inside:
-        for i in range(0, len(arrowhead_points)):
-            uv = arrowhead_points[i]
-            p = tip_plane.PointAt(uv.X, uv.Y)
-            arrowhead.points[i].co = (p.X * scale, p.Y * scale, p.Z * scale, 1)
+    if inside and len(outline) > 0:
+        # map the unit outline onto the tip plane in one go
+        o = tip_plane.Origin
+        x = tip_plane.XAxis
+        y = tip_plane.YAxis
+        axes = np.array(((x.X, x.Y, x.Z), (y.X, y.Y, y.Z)))
+        co = np.ones((len(outline), 4))
+        co[:, 0:3] = (outline @ axes + (o.X, o.Y, o.Z)) * scale
+
+        arrowhead = bc.splines.new('POLY')
+        arrowhead.use_cyclic_u = True
+        arrowhead.points.add(len(outline)-1)
+        arrowhead.points.foreach_set("co", co.ravel())
 
 
 def _populate_line(dimstyle : r3d.DimensionStyle, pt : PartType, plane : r3d.Plane, bc, pt1 : r3d.Point3d, pt2 : r3d.Point3d, scale : float):
@@ -122,20 +172,40 @@ def _populate_line(dimstyle : r3d.DimensionStyle, pt : PartType, plane : r3d.Pla
     line.points[1].co = (pt2.X, pt2.Y, pt2.Z, 1)
 
 
+def _text_curve(txt : str, size : float, align_x : str, align_y : str):
+    """
+    Get the FONT curve for the given text body, size and alignment.
+    Text curves are shared by all annotations with the same text, and
+    tagged with an id derived from their content so that re-imports
+    find them again.
+    """
+    key = (txt, size, align_x, align_y)
+    textcurve = _textcurves.get(key, None)
+    if textcurve is None:
+        textid = uuid.uuid5(TEXT_NAMESPACE, "{}\x00{!r}\x00{}\x00{}".format(*key))
+        tags = utils.create_tag_dict(textid, "annotation_text")
+        textcurve = utils.get_or_create_iddata(bpy.context.blend_data.curves, tags, None, curve_type="FONT")
+        textcurve.body = txt
+        textcurve.size = size
+        textcurve.align_x = align_x
+        textcurve.align_y = align_y
+        _textcurves[key] = textcurve
+    return textcurve
+
+
 def _add_text(dimstyle : r3d.DimensionStyle, plane : r3d.Plane, bc, pt : r3d.Point3d, txt : str, scale : float, left=False, textob=False):
-    textcurve = bpy.context.blend_data.curves.new(name="annotation_text", type="FONT")
-    textcurve.body = txt
     # for now only use blender built-in font. Scale that down to
     # 0.8 since it is a bit larger than Rhino default Arial
-    textcurve.size = dimstyle.TextHeight * scale * 0.8
-    textcurve.align_x = 'CENTER' if not left else 'LEFT'
+    size = dimstyle.TextHeight * scale * 0.8
+    align_x = 'CENTER' if not left else 'LEFT'
+    align_y = 'TOP_BASELINE'
     pt *= scale
     plane = r3d.Plane(pt, plane.XAxis, plane.YAxis)
     if not textob:
         xform = r3d.Transform.PlaneToPlane(r3d.Plane.WorldXY(), plane)
     else:
-        textcurve.align_x = 'CENTER'
-        textcurve.align_y = 'TOP'
+        align_x = 'CENTER'
+        align_y = 'TOP'
         plane = plane.Rotate(math.pi, plane.ZAxis)
         trl = r3d.Transform.Translation(0.0, -0.05, 0.00)
         xform = r3d.Transform.Multiply(trl, r3d.Transform.PlaneToPlane(r3d.Plane.WorldXY(), plane))
@@ -155,13 +225,15 @@ def _add_text(dimstyle : r3d.DimensionStyle, plane : r3d.Plane, bc, pt : r3d.Poi
             q = rote.to_quaternion()
             bm = Matrix.LocRotScale(loc, q, sca)
 
+    textcurve = _text_curve(txt, size, align_x, align_y)
+
     return (textcurve, bm)
 
 
 def import_dim_linear(model, dimlin, bc, scale):
     pts = dimlin.Points
     txt = dimlin.PlainText
-    dimstyle = model.DimStyles.FindId(dimlin.DimensionStyleId)
+    dimstyle = _find_dimstyle(model, dimlin.DimensionStyleId)
     p = dimlin.Plane
     displines = dimlin.GetDisplayLines(dimstyle)
 
@@ -180,7 +252,7 @@ CONVERT[r3d.AnnotationTypes.Rotated] = import_dim_linear
 def import_radius(model, dimrad, bc, scale):
     pts = dimrad.Points
     txt = dimrad.PlainText
-    dimstyle = model.DimStyles.FindId(dimrad.DimensionStyleId)
+    dimstyle = _find_dimstyle(model, dimrad.DimensionStyleId)
     p = dimrad.Plane
     displines = dimrad.GetDisplayLines(dimstyle)
 
@@ -200,7 +272,7 @@ def import_angular(model, dimang, bc, scale):
     r = dimang.Radius
     a = dimang.Angle
     txt = dimang.PlainText
-    dimstyle = model.DimStyles.FindId(dimang.DimensionStyleId)
+    dimstyle = _find_dimstyle(model, dimang.DimensionStyleId)
     displines = dimang.GetDisplayLines(dimstyle)
     p = dimang.Plane
 
@@ -268,7 +340,7 @@ CONVERT[r3d.AnnotationTypes.Angular3pt] = import_angular
 
 def import_leader(model, dimlead, bc, scale):
     txt = dimlead.PlainText
-    dimstyle = model.DimStyles.FindId(dimlead.DimensionStyleId)
+    dimstyle = _find_dimstyle(model, dimlead.DimensionStyleId)
     pts = dimlead.Points
     textptuv = dimlead.GetTextPoint2d(dimstyle, 1.0)
     textpt = dimlead.Plane.PointAt(textptuv.X, textptuv.Y)
@@ -286,7 +358,7 @@ CONVERT[r3d.AnnotationTypes.Leader] = import_leader
 
 def import_text(model, textannotation, bc, scale):
     txt = textannotation.PlainText
-    dimstyle = model.DimStyles.FindId(textannotation.DimensionStyleId)
+    dimstyle = _find_dimstyle(model, textannotation.DimensionStyleId)
     textpt = textannotation.Plane.Origin
 
     return _add_text(dimstyle, textannotation.Plane, bc, textpt, txt, scale, left=False, textob=True)
@@ -295,7 +367,7 @@ CONVERT[r3d.AnnotationTypes.Text] = import_text
 
 def import_ordinate(model, dimordinate, bc, scale):
     txt = dimordinate.PlainText
-    dimstyle = model.DimStyles.FindId(dimordinate.DimensionStyleId)
+    dimstyle = _find_dimstyle(model, dimordinate.DimensionStyleId)
     pts = dimordinate.Points
     textplane = dimordinate.Plane
     displines = dimordinate.GetDisplayLines(dimstyle)
@@ -312,7 +384,7 @@ CONVERT[r3d.AnnotationTypes.Ordinate] = import_ordinate
 
 
 def import_centermark(model, centermark, bc, scale):
-    dimstyle = model.DimStyles.FindId(centermark.DimensionStyleId)
+    dimstyle = _find_dimstyle(model, centermark.DimensionStyleId)
     lines = centermark.GetDisplayLines(dimstyle)
     for line in lines:
         _populate_line(dimstyle, PartType.DimensionLine, centermark.Plane, bc, line.From, line.To, scale)
@@ -321,6 +393,42 @@ def import_centermark(model, centermark, bc, scale):
 CONVERT[r3d.AnnotationTypes.CenterMark] = import_centermark
 
 
+def linework_id(layer : r3d.Layer) -> uuid.UUID:
+    """
+    Id for the merged annotation linework of layer
+    """
+    return uuid.uuid5(layer.Id, "annotation-linework")
+
+
+def _merged_linework(context, model, layer_index):
+    """
+    Get the curve collecting the linework of all annotations on the
+    layer with layer_index. Curves from a previous import are cleared
+    the first time they are used.
+    """
+    curve_data = _linework.get(layer_index, None)
+    if curve_data is None:
+        layer = model.Layers.FindIndex(layer_index)
+        tags = utils.create_tag_dict(linework_id(layer), "Annotations " + layer.Name)
+        curve_data = utils.get_or_create_iddata(context.blend_data.curves, tags, None, curve_type="CURVE")
+        curve_data.splines.clear()
+        curve_data.dimensions = '2D'
+        curve_data.fill_mode = 'BOTH'
+        _linework[layer_index] = curve_data
+    return curve_data
+
+
+def merges_linework(ob, options) -> bool:
+    """
+    True if the linework of the annotation ob goes into the merged
+    linework of its layer. Members of instance definitions keep their
+    own curves, their block places them.
+    """
+    return (options.get("annotation_merge_linework", False)
+            and ob.Geometry.ObjectType == r3d.ObjectType.Annotation
+            and not ob.Attributes.IsInstanceDefinitionObject)
+
+
 def import_annotation(context, ob, name, scale, options):
     if not "rh_model" in options:
         return
@@ -331,9 +439,14 @@ def import_annotation(context, ob, name, scale, options):
     oa = ob.Attributes
     text = None
 
-    curve_data = context.blend_data.curves.new(name, type="CURVE")
-    curve_data.dimensions = '2D'
-    curve_data.fill_mode = 'BOTH'
+    if merges_linework(ob, options):
+        curve_data = _merged_linework(context, model, oa.LayerIndex)
+    else:
+        tags = utils.create_tag_dict(oa.Id, name)
+        curve_data = utils.get_or_create_iddata(context.blend_data.curves, tags, None, curve_type="CURVE")
+        curve_data.splines.clear()
+        curve_data.dimensions = '2D'
+        curve_data.fill_mode = 'BOTH'
 
     if og.AnnotationType in CONVERT:
         text = CONVERT[og.AnnotationType](model, og, curve_data, scale)
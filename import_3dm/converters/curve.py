@@ -27,14 +27,140 @@ from  . import utils
 from mathutils import Vector
 from mathutils.geometry import intersect_line_line
 
+import math
+from typing import NamedTuple
+
 CONVERT = {}
 
-def import_null(rcurve, bcurve, scale):
+# Blender caps spline resolution at 1024, keep the
+# sampling budget for adaptive tessellation in the same
+# ballpark so huge curves don't stall the import
+MAX_RESOLUTION = 1024
+MIN_SAMPLES = 16
+MAX_SAMPLES = 512
+
+
+class CurveTolerance(NamedTuple):
+    """
+    Tessellation tolerances in model units. chord is the
+    maximum distance between the curve and its tessellation,
+    angle the maximum turn between two segments in radians.
+    When bake is set curves are converted to POLY splines.
+    """
+    chord : float
+    angle : float
+    bake  : bool
+
+
+def curve_tolerance(options, scale):
+    """
+    Create the CurveTolerance from the import options, or None
+    when the fixed resolution should be used. The tolerance in
+    options is in Blender units, so it gets scaled back to model
+    units here.
+    """
+    if not options.get("curve_adaptive_resolution", False):
+        return None
+    chord = options.get("curve_chord_tolerance", 0.001)
+    angle = options.get("curve_angle_tolerance", math.radians(10.0))
+    bake = options.get("curve_bake_poly", False)
+    return CurveTolerance(chord / scale if scale else chord, angle, bake)
+
+
+def _segment_length(curvature, tol):
+    """
+    Longest segment that satisfies both chord height and angle
+    tolerance for the given curvature.
+    """
+    if curvature < 1e-12:
+        return math.inf
+    radius = 1.0 / curvature
+    seglen = tol.angle * radius if tol.angle > 0.0 else math.inf
+    if tol.chord > 0.0 and tol.chord < radius:
+        seglen = min(seglen, 2.0 * math.sqrt(2.0 * tol.chord * radius - tol.chord * tol.chord))
+    return seglen
+
+
+def _curvature(p0, p1, p2):
+    """
+    Curvature of the circle through three points
+    """
+    a = p1 - p0
+    b = p2 - p1
+    c = p2 - p0
+    denom = a.length * b.length * c.length
+    if denom < 1e-24:
+        return 0.0
+    return 2.0 * a.cross(b).length / denom
+
+
+def _sample_intervals(rcurve, tol, count_hint):
+    """
+    Sample rcurve and return a list of (t0, t1, n) where n is the
+    number of segments needed for that parameter interval to stay
+    within tol.
+    """
+    dom = rcurve.Domain
+    t0 = dom.T0
+    t1 = dom.T1
+    count = min(max(4 * count_hint, MIN_SAMPLES), MAX_SAMPLES)
+    ts = [t0 + (t1 - t0) * i / count for i in range(count + 1)]
+    pts = [point_to_vector(rcurve.PointAt(t)) for t in ts]
+
+    kappa = [0.0] * len(pts)
+    for i in range(1, len(pts) - 1):
+        kappa[i] = _curvature(pts[i - 1], pts[i], pts[i + 1])
+    kappa[0] = kappa[1] if len(pts) > 2 else 0.0
+    kappa[-1] = kappa[-2] if len(pts) > 2 else 0.0
+
+    intervals = []
+    for i in range(count):
+        seglen = _segment_length(max(kappa[i], kappa[i + 1]), tol)
+        length = (pts[i + 1] - pts[i]).length
+        n = 1 if seglen == math.inf else max(1, math.ceil(length / seglen))
+        intervals.append((ts[i], ts[i + 1], n))
+    return intervals
+
+
+def curve_resolution(rcurve, tol, segments):
+    """
+    Compute the Blender resolution_u for rcurve such that
+    the evaluated spline stays within tol. segments is the
+    number of spline segments Blender multiplies the resolution
+    with.
+    """
+    intervals = _sample_intervals(rcurve, tol, segments)
+    needed = sum(n for _, _, n in intervals)
+    return min(max(math.ceil(needed / max(segments, 1)), 1), MAX_RESOLUTION)
+
+
+def bake_poly(rcurve, bcurve, scale, tol):
+    """
+    Tessellate rcurve within tol and add it as a POLY spline
+    """
+    intervals = _sample_intervals(rcurve, tol, len(rcurve.Points))
+    co = []
+    for (t0, t1, n) in intervals:
+        for j in range(n):
+            p = rcurve.PointAt(t0 + (t1 - t0) * j / n)
+            co.extend((p.X * scale, p.Y * scale, p.Z * scale, 1.0))
+    if not rcurve.IsClosed:
+        p = rcurve.PointAt(rcurve.Domain.T1)
+        co.extend((p.X * scale, p.Y * scale, p.Z * scale, 1.0))
+
+    poly = bcurve.splines.new('POLY')
+    poly.use_cyclic_u = rcurve.IsClosed
+    poly.points.add(len(co) // 4 - 1)
+    poly.points.foreach_set("co", co)
+    return poly
+
+
+def import_null(rcurve, bcurve, scale, tol=None):
 
     print("Failed to convert type", type(rcurve))
     return None
 
-def import_line(rcurve, bcurve, scale):
+def import_line(rcurve, bcurve, scale, tol=None):
 
     fr = point_to_vector(rcurve.Line.From) * scale
     to = point_to_vector(rcurve.Line.To) * scale
@@ -49,7 +175,7 @@ def import_line(rcurve, bcurve, scale):
 
 CONVERT[r3d.LineCurve] = import_line
 
-def import_polyline(rcurve, bcurve, scale):
+def import_polyline(rcurve, bcurve, scale, tol=None):
 
     N = rcurve.PointCount
 
@@ -67,7 +193,10 @@ def import_polyline(rcurve, bcurve, scale):
 
 CONVERT[r3d.PolylineCurve] = import_polyline
 
-def import_nurbs_curve(rcurve, bcurve, scale, is_arc = False):
+def import_nurbs_curve(rcurve, bcurve, scale, is_arc = False, tol = None):
+    if tol and tol.bake:
+        return bake_poly(rcurve, bcurve, scale, tol)
+
     # create a list of points where
     # we ensure we don't have duplicates. Rhino curves
     # may have duplicate points, which Blender doesn't like
@@ -109,7 +238,10 @@ def import_nurbs_curve(rcurve, bcurve, scale, is_arc = False):
         nurbs.points[i].co = (rpt.X * scale, rpt.Y * scale, rpt.Z * scale, rpt.W)
 
     # set relevant properties
-    nurbs.resolution_u = 12
+    if tol:
+        nurbs.resolution_u = curve_resolution(rcurve, tol, N if rcurve.IsClosed else N - 1)
+    else:
+        nurbs.resolution_u = 12
     nurbs.use_bezier_u = rcurve.IsRational # set to bezier when rational
     nurbs.use_endpoint_u = is_arc if is_arc else not rcurve.IsClosed
     nurbs.use_cyclic_u = rcurve.IsClosed
@@ -130,24 +262,25 @@ def point_to_vector(point) -> Vector:
     return Vector((point.X, point.Y, point.Z))
 
 
-def import_arc(rcurve, bcurve, scale):
+def import_arc(rcurve, bcurve, scale, tol=None):
     nc_arc = rcurve.Arc.ToNurbsCurve()
-    import_nurbs_curve(nc_arc, bcurve, scale, is_arc=True)
+    import_nurbs_curve(nc_arc, bcurve, scale, is_arc=True, tol=tol)
 
 
 CONVERT[r3d.ArcCurve] = import_arc
 
-def import_polycurve(rcurve, bcurve, scale):
+def import_polycurve(rcurve, bcurve, scale, tol=None):
 
     for seg in range(rcurve.SegmentCount):
         segcurve = rcurve.SegmentCurve(seg)
         if type(segcurve) in CONVERT.keys():
-            CONVERT[type(segcurve)](segcurve, bcurve, scale)
+            CONVERT[type(segcurve)](segcurve, bcurve, scale, tol=tol)
 
 CONVERT[r3d.PolyCurve] = import_polycurve
 
 def import_curve(context, ob, name, scale, options):
     og = ob.Geometry
+    tol = curve_tolerance(options, scale)
 
     curve_data = context.blend_data.curves.new(name, type="CURVE")
 
@@ -155,6 +288,6 @@ def import_curve(context, ob, name, scale, options):
         curve_data.dimensions = '3D'
         curve_data.resolution_u = 2 if type(og) in (r3d.PolylineCurve, r3d.LineCurve) else 12
 
-        CONVERT[type(og)](og, curve_data, scale)
+        CONVERT[type(og)](og, curve_data, scale, tol=tol)
 
     return curve_data
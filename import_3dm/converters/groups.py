@@ -19,8 +19,22 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import bpy
+import rhino3dm as r3d
 from . import utils
 
+from typing import Dict, List
+
+# scene custom property holding the group table, mapping the group
+# numbers stored on objects to the id and name of the Rhino group
+GROUP_TABLE = "rhgroups"
+# object custom property holding the numbers of the groups the object
+# is in, innermost group first
+GROUP_PROP = "rhgroups"
+
+# Rhino group id to group number, for the scene being imported into
+_numbers = None
+
 def handle_groups(context,attr,toplayer, import_nested_groups):
     #check if object is member of one or more groups
     if attr.GroupCount>0:
@@ -82,3 +96,64 @@ def handle_groups(context,attr,toplayer, import_nested_groups):
                         ccol.objects.link(last_obj)
                     except Exception:
                         pass
+
+
+def initialize() -> None:
+    global _numbers
+    _numbers = None
+
+
+def _group_number(context : bpy.types.Context, model : r3d.File3dm, group_index : int) -> int:
+    """
+    Get the number of the Rhino group with group_index in the scene
+    group table, adding the group if it isn't there yet. Groups are
+    identified by their id so that groups from different files don't
+    share numbers.
+    """
+    global _numbers
+    scene = context.scene
+    if GROUP_TABLE not in scene:
+        scene[GROUP_TABLE] = dict()
+    table = scene[GROUP_TABLE]
+    if _numbers is None:
+        _numbers = {entry["id"]: int(number) for number, entry in table.items()}
+
+    group = model.Groups.FindIndex(group_index)
+    if group is None:
+        return -1
+    gid = str(group.Id)
+    number = _numbers.get(gid, None)
+    if number is None:
+        number = len(_numbers)
+        _numbers[gid] = number
+        table[str(number)] = {"id": gid, "name": group.Name or "Group_{}".format(group_index)}
+    return number
+
+
+def handle_group_attributes(context : bpy.types.Context, model : r3d.File3dm, attr : r3d.ObjectAttributes) -> None:
+    """
+    Store the groups of the object with attr as group numbers on the
+    Blender object instead of linking it into group collections.
+    """
+    if attr.GroupCount == 0:
+        return
+    blender_object = utils.get_dict_for_base(context.blend_data.objects).get(str(attr.Id), None)
+    if blender_object is None:
+        return
+    blender_object[GROUP_PROP] = [_group_number(context, model, gi) for gi in attr.GetGroupList()]
+
+
+def group_members(objects) -> Dict[int, List[bpy.types.Object]]:
+    """
+    Index objects by the group numbers stored on them.
+    """
+    members = dict()
+    for ob in objects:
+        for number in ob.get(GROUP_PROP, ()):
+            members.setdefault(number, list()).append(ob)
+    return members
+
+
+def group_name(scene : bpy.types.Scene, number : int) -> str:
+    entry = scene.get(GROUP_TABLE, {}).get(str(number), None)
+    return entry["name"] if entry else str(number)
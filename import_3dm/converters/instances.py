@@ -33,10 +33,50 @@ from . import utils
 #proper exception handling
 
 
-def handle_instance_definitions(context, model, toplayer, layername):
+def reachable_instance_definitions(model):
+    """
+    Find the instance definitions used by the model, either referenced
+    by top-level objects or nested inside other used definitions.
+    Returns the set of used definition ids and the set of ids of the
+    objects that are members of those definitions, both as strings.
+    """
+    definitions = {str(idef.Id): idef for idef in model.InstanceDefinitions}
+
+    roots = list()
+    nested = dict()
+    for ob in model.Objects:
+        og = ob.Geometry
+        if og.ObjectType != r3d.ObjectType.InstanceReference:
+            continue
+        if ob.Attributes.IsInstanceDefinitionObject:
+            nested[str(ob.Attributes.Id)] = str(og.ParentIdefId)
+        else:
+            roots.append(str(og.ParentIdefId))
+
+    reachable = set()
+    members = set()
+    stack = roots
+    while stack:
+        idef_id = stack.pop()
+        if idef_id in reachable or idef_id not in definitions:
+            continue
+        reachable.add(idef_id)
+        for guid in definitions[idef_id].GetObjectIds():
+            member_id = str(guid)
+            members.add(member_id)
+            if member_id in nested:
+                stack.append(nested[member_id])
+
+    return (reachable, members)
+
+
+def handle_instance_definitions(context, model, toplayer, layername, reachable=None):
     """
     Import instance definitions from rhino model as empty collections. These
     will later be populated to contain actual geometry.
+
+    If reachable is given only the definitions with ids in it are
+    imported.
     """
 
     # TODO: here we need to get instance name and material used by this instance
@@ -52,6 +92,8 @@ def handle_instance_definitions(context, model, toplayer, layername):
             toplayer.children.link(instance_col)
 
     for idef in model.InstanceDefinitions:
+        if reachable is not None and str(idef.Id) not in reachable:
+            continue
         tags = utils.create_tag_dict(idef.Id, idef.Name, None, None, True)
         idef_col=utils.get_or_create_iddata(context.blend_data.collections, tags, None )
 
@@ -92,16 +134,20 @@ def import_instance_reference(context : bpy.context, ob : r3d.File3dmObject, ire
     iref.matrix_world = Matrix(xform)
 
 
-def populate_instance_definitions(context, model, toplayer, layername, options, scale):
+def populate_instance_definitions(context, model, toplayer, layername, options, scale, reachable=None):
     import_as_grid = options.get("import_instances_grid_layout",False)
 
+    idefs = [idef for idef in model.InstanceDefinitions if reachable is None or str(idef.Id) in reachable]
+
     if import_as_grid:
         count = 0
-        columns = int(sqrt(len(model.InstanceDefinitions)))
+        columns = max(int(sqrt(len(idefs))), 1)
         grid = options.get("import_instances_grid",False) *scale
 
+    objects = utils.get_dict_for_base(context.blend_data.objects)
+
     #for every instance definition fish out the instance definition objects and link them to their parent
-    for idef in model.InstanceDefinitions:
+    for idef in idefs:
         tags = utils.create_tag_dict(idef.Id, idef.Name, None, None, True)
         parent=utils.get_or_create_iddata(context.blend_data.collections, tags, None)
         objectids=idef.GetObjectIds()
@@ -112,12 +158,13 @@ def populate_instance_definitions(context, model, toplayer, layername, options,
             parent.instance_offset = offset #this sets the offset for the collection instances (read: resets the origin)
             count +=1
 
-        for ob in context.blend_data.objects:
-            for guid in objectids:
-                if ob.get('rhid',None) == str(guid):
-                    try:
-                        parent.objects.link(ob)
-                        if import_as_grid:
-                            ob.location += offset #apply the previously calculated offset to all instance definition objects
-                    except Exception:
-                        pass
+        for guid in objectids:
+            ob = objects.get(str(guid), None)
+            if ob is None:
+                continue
+            try:
+                parent.objects.link(ob)
+                if import_as_grid:
+                    ob.location += offset #apply the previously calculated offset to all instance definition objects
+            except Exception:
+                pass
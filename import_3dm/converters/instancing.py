@@ -0,0 +1,99 @@
+# MIT License
+
+# Copyright (c) 2018-2024 Nathan Letwory, Joel Putnam, Tom Svilans, Lukas Fertig
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import bpy
+import numpy as np
+from mathutils import Matrix
+
+from typing import NamedTuple, Optional, Tuple
+
+from .. import buffers
+
+
+class Frame(NamedTuple):
+    centroid: np.ndarray
+    rotation: np.ndarray
+    canonical: np.ndarray
+    key: Tuple[str, int]
+
+
+# canonical key to the list of (mesh, frame) imported so far
+_prototypes = dict()
+# rhino object id to the matrix_world of objects sharing
+# the mesh of a prototype
+_matrices = dict()
+
+
+def initialize() -> None:
+    global _prototypes, _matrices
+    _prototypes = dict()
+    _matrices = dict()
+
+
+def canonicalize(buffer : buffers.GeometryBuffer, scale : float, tolerance : float) -> Optional[Frame]:
+    """
+    Get the canonical frame of the scaled mesh in buffer, or None if
+    the mesh is too small to have one.
+    """
+    if buffer.vertex_count < 3 or buffer.face_count == 0:
+        return None
+    centroid, rotation, canonical = buffers.canonical_frame(buffer.positions * scale, tolerance)
+    key = buffers.canonical_key(canonical, buffer.face_indices, tolerance * 10.0)
+    return Frame(centroid, rotation, canonical, key)
+
+
+def find_prototype(frame : Frame, tolerance : float) -> Optional[Tuple[bpy.types.Mesh, Frame]]:
+    """
+    Find an earlier mesh with the same canonical form as frame, within
+    tolerance. Returns the mesh and its frame as a tuple, or None.
+    """
+    for key in buffers.neighbour_keys(frame.key):
+        for mesh, other in _prototypes.get(key, ()):
+            if other.canonical.shape != frame.canonical.shape:
+                continue
+            if np.abs(other.canonical - frame.canonical).max() <= tolerance:
+                return (mesh, other)
+    return None
+
+
+def add_prototype(mesh : bpy.types.Mesh, frame : Frame) -> None:
+    _prototypes.setdefault(frame.key, list()).append((mesh, frame))
+
+
+def set_instance(rhid, prototype : Frame, frame : Frame) -> None:
+    """
+    Record the matrix that places the prototype mesh, which is in world
+    coordinates, onto the geometry of the object rhid.
+    """
+    m = np.eye(4)
+    rotation = frame.rotation.T @ prototype.rotation
+    m[:3, :3] = rotation
+    m[:3, 3] = frame.centroid - rotation @ prototype.centroid
+    _matrices[str(rhid)] = Matrix(m.tolist())
+
+
+def instance_matrix(rhid) -> Optional[Matrix]:
+    return _matrices.get(str(rhid), None)
+
+
+def instance_count() -> int:
+    return len(_matrices)
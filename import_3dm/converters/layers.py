@@ -22,14 +22,25 @@
 
 from . import utils
 
+# state for creating layers on demand, set up by handle_layers
+_layer_col = None
+_rhino_layers = None
+_import_hidden = False
+_layers_as_empties = False
 
-def handle_layers(context, model, toplayer, layerids, materials, update, import_hidden=False, layers_as_empties=False):
+
+def handle_layers(context, model, toplayer, layerids, materials, update, import_hidden=False, layers_as_empties=False, create_all=True):
     """
     In context read the Rhino layers from model
     then update the layerids dictionary passed in.
     Update materials dictionary with materials created
     for layer color.
+
+    When create_all is False layers are only created once
+    get_layer is called for them, or for one of their
+    sub-layers.
     """
+    global _layer_col, _rhino_layers, _import_hidden, _layers_as_empties
     #setup main container to hold all layer collections
     layer_col_id="Layers"
     if not layer_col_id in context.blend_data.collections:
@@ -42,42 +53,59 @@ def handle_layers(context, model, toplayer, layerids, materials, update, import_
         #If "Layers" collection is in place, we assume the plugin had imported 3dm before
         layer_col = context.blend_data.collections[layer_col_id]
 
-    # build lookup table for LayerTable index
-    # from GUID, create collection for each
-    # layer
+    _layer_col = layer_col
+    _import_hidden = import_hidden
+    _layers_as_empties = layers_as_empties
+
+    # build lookup table for LayerTable index from GUID
+    _rhino_layers = dict()
     for lid, l in enumerate(model.Layers):
-        if not l.Visible and not import_hidden:
-            continue
-        tags = utils.create_tag_dict(l.Id, l.Name)
-        if layers_as_empties:
-            lcol = utils.get_or_create_iddata(context.blend_data.objects, tags, None, use_none=True)
-        else:
-            lcol = utils.get_or_create_iddata(context.blend_data.collections, tags, None)
-        layerids[str(l.Id)] = (lid, lcol)
-        #utils.tag_data(layerids[str(l.Id)][1], l.Id, l.Name)
-
-    # second pass so we can link layers to each other
-    for l in model.Layers:
-        # link up layers to their parent layers
-        if str(l.ParentLayerId) in layerids:
-            parentlayer = layerids[str(l.ParentLayerId)][1]
-            try:
-                if layers_as_empties:
-                    # set the parent
-                    child = layerids[str(l.Id)][1]
-                    child.parent = parentlayer
-                    # and also link to Layers collection
-                    layer_col.objects.link(child)
-                else:
-                    parentlayer.children.link(layerids[str(l.Id)][1])
-            except Exception:
-                pass
+        _rhino_layers[str(l.Id)] = (lid, l)
+
+    if create_all:
+        for l in model.Layers:
+            get_layer(context, l, layerids)
+
+
+def get_layer(context, l, layerids):
+    """
+    Get the collection, or empty when importing layers as empties,
+    for Rhino layer l. The layer and its parent layers are created
+    the first time they are asked for. Returns None for hidden layers
+    when those aren't imported.
+    """
+    key = str(l.Id)
+    if key in layerids:
+        return layerids[key][1]
+    if not l.Visible and not _import_hidden:
+        return None
+
+    tags = utils.create_tag_dict(l.Id, l.Name)
+    if _layers_as_empties:
+        lcol = utils.get_or_create_iddata(context.blend_data.objects, tags, None, use_none=True)
+    else:
+        lcol = utils.get_or_create_iddata(context.blend_data.collections, tags, None)
+    layerids[key] = (_rhino_layers[key][0], lcol)
+
+    # link up layers to their parent layers
+    parent = _rhino_layers.get(str(l.ParentLayerId), None)
+    parentlayer = get_layer(context, parent[1], layerids) if parent else None
+    try:
+        if parentlayer is not None:
+            if _layers_as_empties:
+                # set the parent
+                lcol.parent = parentlayer
+                # and also link to Layers collection
+                _layer_col.objects.link(lcol)
+            else:
+                parentlayer.children.link(lcol)
         # or to the top collection if no parent layer was found
         else:
-            try:
-                if layers_as_empties:
-                    layer_col.objects.link(layerids[str(l.Id)][1])
-                else:
-                    layer_col.children.link(layerids[str(l.Id)][1])
-            except Exception:
-                pass
+            if _layers_as_empties:
+                _layer_col.objects.link(lcol)
+            else:
+                _layer_col.children.link(lcol)
+    except Exception:
+        pass
+
+    return lcol
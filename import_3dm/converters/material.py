@@ -30,11 +30,14 @@ from . import utils
 from . import rdk_manager
 from pathlib import Path, PureWindowsPath, PurePosixPath
 import base64
-import tempfile
-import uuid
+import hashlib
+import json
 import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from typing import Any, Tuple
+from typing import Any, Dict, Tuple
 
 ### default Rhino material name
 DEFAULT_RHINO_MATERIAL = "Rhino Default Material"
@@ -156,22 +159,64 @@ def get_bool_field(rm : r3d.RenderMaterial, field_name : str) -> bool:
         return False
     return bool(b)
 
-def hash_rendermaterial(M : r3d.RenderMaterial):
+# render content child slots that can hold a texture
+TEXTURE_FIELDS = (
+    "pbr-base-color",
+    "pbr-metallic",
+    "pbr-roughness",
+    "pbr-specular",
+    "pbr-opacity",
+    "pbr-alpha",
+    "pbr-emission",
+    "emission-multiplier",
+    "bitmap-texture",
+)
+
+# render content parameters read by the material handlers
+RENDER_FIELDS = (
+    "color",
+    "diffuse",
+    "reflectivity",
+    "reflectivity-color",
+    "transparency",
+    "transparency-color",
+    "polish-amount",
+    "clarity-amount",
+    "ior",
+    "fresnel-enabled",
+    "emission-multiplier",
+    "pbr-base-color",
+    "pbr-metallic",
+    "pbr-roughness",
+    "pbr-specular",
+    "pbr-alpha",
+    "pbr-opacity",
+    "pbr-opacity-ior",
+    "pbr-opacity-roughness",
+    "pbr-emission",
+    "pbr-subsurface_scattering-color",
+)
+
+def hash_rendermaterial(M : r3d.RenderMaterial) -> str:
     """
-    Hash a rhino3dm.Material. A CRC32 is calculated using the
-    material name and data that affects render results
+    Hash a rhino3dm.RenderMaterial. A SHA-256 digest is calculated
+    using the material type and data that affects render results, the
+    hash identifies materials across files and imports so a 32-bit
+    checksum would collide. The name and id are left out so that
+    identical materials hash the same. Textures are hashed by their
+    full path, extracting embedded files just to build keys would undo
+    lazy extraction and deferred materials.
     """
-    crc = 13
-    crc = binascii.crc32(bytes(M.Name, "utf-8"))
-    crc = binascii.crc32(bytes(M.GetParameter("pbr-base-color"), "utf-8"), crc)
-    crc = binascii.crc32(bytes(M.GetParameter("pbr-emission"), "utf-8"), crc)
-    crc = binascii.crc32(bytes(M.GetParameter("pbr-subsurface_scattering-color"), "utf-8"), crc)
-    crc = binascii.crc32(tobytes(get_float_field(M, "pbr-opacity")), crc)
-    crc = binascii.crc32(tobytes(get_float_field(M, "pbr-opacity-ior")), crc)
-    crc = binascii.crc32(tobytes(get_float_field(M, "pbr-opacity-roughness")), crc)
-    crc = binascii.crc32(tobytes(get_float_field(M, "pbr-roughness")), crc)
-    crc = binascii.crc32(tobytes(get_float_field(M, "pbr-metallic")), crc)
-    return crc
+    sha = hashlib.sha256(bytes(M.TypeName, "utf-8"))
+    for field_name in RENDER_FIELDS:
+        sha.update(b"\0" + bytes(str(M.GetParameter(field_name)), "utf-8"))
+    for field_name in TEXTURE_FIELDS:
+        rhino_tex = M.FindChild(field_name)
+        if rhino_tex:
+            sha.update(b"\0" + bytes(field_name, "utf-8"))
+            sha.update(b"\0" + bytes(rhino_tex.FileName, "utf-8"))
+            sha.update(tobytes(get_bool_field(rhino_tex, "use-alpha-channel")))
+    return sha.hexdigest()
 
 
 
@@ -184,6 +229,25 @@ def rendermaterial_name(m):
     return m.Name  #+ "~" + str(h)
 
 
+def rendermaterial_key(m : r3d.RenderMaterial) -> str:
+    """
+    Key for the materials dictionary, based on the render content
+    of m rather than its name.
+    """
+    return hash_rendermaterial(m)
+
+
+def material_key(model : r3d.File3dm, m : r3d.Material) -> str:
+    """
+    Key for the materials dictionary of the render material used by
+    m, or DEFAULT_RHINO_MATERIAL if it doesn't have one.
+    """
+    rm = model.RenderContent.FindId(m.RenderMaterialInstanceId)
+    if not rm:
+        return DEFAULT_RHINO_MATERIAL
+    return rendermaterial_key(rm)
+
+
 class PlasterWrapper(ShaderWrapper):
     NODES_LIST = (
         "node_out",
@@ -212,6 +276,15 @@ class PlasterWrapper(ShaderWrapper):
         nodes = tree.nodes
         links = tree.links
 
+        # reuse the nodes of a tree that already has the plaster
+        # setup, for instance one copied from a template
+        node_out = next((n for n in nodes if n.bl_idname == 'ShaderNodeOutputMaterial'), None)
+        node_diffuse_bsdf = next((n for n in nodes if n.bl_idname == 'ShaderNodeBsdfDiffuse'), None)
+        if len(nodes) == 2 and node_out and node_diffuse_bsdf and node_out.inputs["Surface"].is_linked:
+            self.node_out = node_out
+            self.node_diffuse_bsdf = node_diffuse_bsdf
+            return
+
         nodes.clear()
 
         node_out = nodes.new('ShaderNodeOutputMaterial')
@@ -325,9 +398,9 @@ def handle_pbr_texture(rhino_material : r3d.RenderMaterial, pbr : PrincipledBSDF
     if rhino_tex:
         fp = _name_from_embedded_filepath(rhino_tex.FileName)
         use_alpha = get_bool_field(rhino_tex, "use-alpha-channel")
-        if fp in _efps.keys():
+        img = get_embedded_image(fp)
+        if img:
             pbr_tex = _get_blender_pbr_texture(pbr, field_name)
-            img = _efps[fp]
             pbr_tex.node_image.image = img
             if use_alpha and field_name in ("pbr-base-color", "diffuse"):
                 pbr.material.node_tree.links.new(pbr_tex.node_image.outputs['Alpha'], pbr.node_principled_bsdf.inputs['Alpha'])
@@ -339,9 +412,9 @@ def handle_basic_texture(rhino_material : r3d.RenderMaterial, pbr : PrincipledBS
     rhino_tex = rhino_material.FindChild(field_name)
     if rhino_tex:
         fp = _name_from_embedded_filepath(rhino_tex.FileName)
-        if fp in _efps.keys():
+        img = get_embedded_image(fp)
+        if img:
             pbr_tex = _get_blender_basic_texture(pbr, field_name)
-            img = _efps[fp]
             pbr_tex.node_image.image = img
         else:
             print(f"Image {fp} not found in Blender")
@@ -438,8 +511,45 @@ def harvest_from_rendercontent(model : r3d.File3dm, mat : r3d.RenderMaterial, bl
     material_handler(mat, blender_material)
 
 
+def material_template(type_name : str) -> bpy.types.Material:
+    """
+    Get the template material for the handler of type_name. The
+    template is created by running the handler on an empty render
+    material, copies of it only need their parameter values set since
+    the wrappers reuse the nodes they find. Templates are looked up by
+    name each time, references to ID data don't survive undo or
+    loading another file.
+    """
+    name = ".rhino_template_" + type_name
+    template = bpy.context.blend_data.materials.get(name, None)
+    if template is not None:
+        return template
+
+    template = bpy.context.blend_data.materials.new(name=name)
+    if bpy.app.version[0] < 5:
+        template.use_nodes = True
+    material_handler = material_handlers.get(type_name, not_yet_implemented)
+    material_handler(r3d.RenderMaterial(), template)
+    return template
+
+
 _model = None
+# embedded file name to its path in the 3dm file
 _efps = None
+# embedded file name to the extracted Blender image
+_images = None
+# content digest to the Blender image, to share images
+# between embedded files with identical content and
+# with images from earlier imports
+_images_by_digest = None
+_cachedir = None
+# either PACK to pack images into the .blend, or CACHE to
+# reference the files in the texture cache
+_texture_storage = "PACK"
+
+TEXTURE_CACHE = "textures"
+# embedded files decoded at the same time by prefetch_embedded_images
+PREFETCH_BATCH = 16
 
 def _name_from_embedded_filepath(efp : str) -> str:
     efpath = PureWindowsPath(efp)
@@ -447,42 +557,235 @@ def _name_from_embedded_filepath(efp : str) -> str:
         efpath = PurePosixPath(efp)
     return efpath.name
 
-def handle_embedded_files(model : r3d.File3dm):
-    global _model, _efps
+def handle_embedded_files(model : r3d.File3dm, texture_storage : str = "PACK"):
+    """
+    Index the files embedded in model. The files are extracted only
+    when a material references them through get_embedded_image.
+    """
+    global _model, _efps, _images, _images_by_digest, _texture_storage, _cachedir
     _model = model
     _efps = dict()
+    _images = dict()
+    _texture_storage = texture_storage
+    _cachedir = utils.cache_directory(TEXTURE_CACHE)
+
+    # images from earlier imports are found by their content digest
+    _images_by_digest = dict()
+    for blender_image in bpy.context.blend_data.images:
+        digest = blender_image.get('rhdigest', None)
+        if digest:
+            _images_by_digest[digest] = blender_image
 
     for rhino_embedded_filename in _model.EmbeddedFilePaths():
+        ef_name = _name_from_embedded_filepath(rhino_embedded_filename)
+        if ef_name not in _efps:
+            _efps[ef_name] = rhino_embedded_filename
 
-        if rhino_embedded_filename in _efps.keys():
-            continue
 
-        encoded_img = _model.GetEmbeddedFileAsBase64(rhino_embedded_filename)
-        decoded_img = base64.b64decode(encoded_img)
+def trim_texture_cache(context : bpy.types.Context, size_limit : int) -> None:
+    """
+    Remove the least recently used files from the texture cache until
+    it fits size_limit bytes. Files referenced by images of the open
+    .blend are kept. Other saved .blend files may still reference the
+    removed files, so this only runs on request.
+    """
+    in_use = set()
+    for blender_image in context.blend_data.images:
+        if blender_image.filepath:
+            in_use.add(os.path.normpath(bpy.path.abspath(blender_image.filepath)))
+    utils.trim_cache_directory(utils.cache_directory(TEXTURE_CACHE), size_limit, in_use)
 
-        ef_name = _name_from_embedded_filepath(rhino_embedded_filename)
 
-        with tempfile.NamedTemporaryFile(delete=False) as tmpf:
+def release_embedded_files():
+    """
+    Drop the model and the embedded file index kept by
+    handle_embedded_files.
+    """
+    global _model, _efps
+    _model = None
+    _efps = dict()
+
+
+def _decode_embedded_file(ef_name : str, encoded_img : str) -> Tuple[str, str, bytes]:
+    """
+    Decode an embedded file. Returns the digest, the path in the
+    content-addressed texture cache and the decoded data. With CACHE
+    texture storage the file is written to the cache and no data is
+    returned, otherwise the cache isn't touched and there is no path.
+    Doesn't touch bpy so it can run in a worker thread.
+    """
+    decoded_img = base64.b64decode(encoded_img)
+    digest = hashlib.sha256(decoded_img).hexdigest()
+    if _texture_storage != "CACHE":
+        return (digest, None, decoded_img)
+    cachepath = os.path.join(_cachedir, digest + PurePosixPath(ef_name).suffix.lower())
+    if os.path.exists(cachepath):
+        # mark the file as recently used for trim_cache_directory
+        os.utime(cachepath)
+    else:
+        tmppath = "{}.{}.tmp".format(cachepath, threading.get_ident())
+        with open(tmppath, "wb") as tmpf:
             tmpf.write(decoded_img)
+        os.replace(tmppath, cachepath)
+    return (digest, cachepath, None)
+
 
-        blender_image = bpy.context.blend_data.images.load(tmpf.name, check_existing=True)
-        blender_image.name = ef_name
-        blender_image.pack()
-        _efps[ef_name] = blender_image
+def prefetch_embedded_images(ef_names):
+    """
+    Decode the given embedded files in a thread pool and create their
+    Blender images, so that get_embedded_image finds them ready. Files
+    are decoded in batches to bound the memory held by their data.
+    """
+    todo = sorted(ef_name for ef_name in set(ef_names) if ef_name in _efps and ef_name not in _images)
+    if not todo:
+        return
+    workers = min(len(todo), os.cpu_count() or 1, 8)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for first in range(0, len(todo), PREFETCH_BATCH):
+            batch = todo[first:first + PREFETCH_BATCH]
+            # rhino3dm and bpy are accessed from the main thread only
+            encoded = [(ef_name, _model.GetEmbeddedFileAsBase64(_efps[ef_name])) for ef_name in batch]
+            decoded = list(pool.map(lambda item: _decode_embedded_file(*item), encoded))
+            del encoded
+            for ef_name, (digest, cachepath, data) in zip(batch, decoded):
+                _create_image(ef_name, digest, cachepath, data)
+
+
+def _image_from_bytes(name : str, data : bytes) -> bpy.types.Image:
+    """
+    Create a packed image directly from the file contents in data
+    """
+    blender_image = bpy.context.blend_data.images.new(name, 8, 8)
+    blender_image.pack(data=data, data_len=len(data))
+    blender_image.source = 'FILE'
+    return blender_image
+
+
+def _create_image(ef_name : str, digest : str, cachepath : str, data : bytes) -> bpy.types.Image:
+    blender_image = _images_by_digest.get(digest, None)
+    if blender_image is None:
+        if data is None:
+            blender_image = bpy.context.blend_data.images.load(cachepath, check_existing=True)
+            blender_image.name = ef_name
+        else:
+            blender_image = _image_from_bytes(ef_name, data)
+        blender_image['rhdigest'] = digest
+        _images_by_digest[digest] = blender_image
+    _images[ef_name] = blender_image
+    return blender_image
 
-        tmpfpath = tmpf.name
-        try:
-            tmpf.close()
-            os.unlink(tmpfpath)
-        except RuntimeError:
-            pass
 
+def get_embedded_image(ef_name : str) -> bpy.types.Image:
+    """
+    Get the Blender image for the embedded file ef_name, extracting
+    it from the model on first use. Returns None if no such file is
+    embedded.
+    """
+    if ef_name in _images:
+        return _images[ef_name]
+    if ef_name not in _efps:
+        return None
+
+    encoded_img = _model.GetEmbeddedFileAsBase64(_efps[ef_name])
+    return _create_image(ef_name, *_decode_embedded_file(ef_name, encoded_img))
+
+
+def _referenced_embedded_files(rendermaterials):
+    """
+    Collect the names of the embedded files used as textures by
+    the given render materials.
+    """
+    ef_names = set()
+    for m in rendermaterials:
+        for field_name in TEXTURE_FIELDS:
+            rhino_tex = m.FindChild(field_name)
+            if rhino_tex:
+                ef_names.add(_name_from_embedded_filepath(rhino_tex.FileName))
+    return ef_names
+
+
+def viewport_color(m : r3d.RenderMaterial) -> Tuple[float, float, float, float]:
+    """
+    Get the color used for the viewport display of m
+    """
+    if m.TypeName == '5a8d7b9b-cdc9-49de-8c16-2ef64fb097ab':
+        field_name = "pbr-base-color"
+    elif m.TypeName == 'rcm-basic-material':
+        field_name = "diffuse"
+    else:
+        field_name = "color"
+    return get_color_field(m, field_name)[0:4]
+
+
+def defer_material(m : r3d.RenderMaterial, blender_material : bpy.types.Material, source : str, texture_storage : str):
+    """
+    Set only the viewport color of blender_material and mark it for
+    harvesting later from source with hydrate_material. The digest of
+    source is recorded so that changed files aren't harvested.
+    """
+    blender_material.diffuse_color = viewport_color(m)
+    blender_material['rhdeferred'] = json.dumps({
+        'file': source,
+        'textures': texture_storage,
+        'digest': utils.file_digest(source),
+    })
+    if 'rhdeferred_failed' in blender_material:
+        del blender_material['rhdeferred_failed']
 
 
-def handle_materials(context, model : r3d.File3dm, materials, update):
+def deferred_source(blender_material : bpy.types.Material) -> Dict[str, str]:
     """
+    Get the source file, texture storage and file digest recorded for
+    a deferred material, or None if blender_material isn't deferred.
     """
-    handle_embedded_files(model)
+    deferred = blender_material.get('rhdeferred', None)
+    if not deferred:
+        return None
+    return json.loads(deferred)
+
+
+def deferred_failed(blender_material : bpy.types.Material) -> bool:
+    """
+    True if hydrating the deferred blender_material failed before.
+    """
+    return bool(blender_material.get('rhdeferred_failed', False))
+
+
+def defer_failed(blender_material : bpy.types.Material, reason : str):
+    """
+    Mark the deferred blender_material as failed to hydrate so that it
+    isn't tried again automatically, reporting reason once.
+    """
+    if not deferred_failed(blender_material):
+        print("Failed to hydrate material {}: {}".format(blender_material.name, reason))
+    blender_material['rhdeferred_failed'] = True
+
+
+def hydrate_material(model : r3d.File3dm, blender_material : bpy.types.Material) -> bool:
+    """
+    Harvest the full node tree for a deferred material from model.
+    handle_embedded_files must have been called for model.
+    """
+    rhid = blender_material.get('rhid', None)
+    m = model.RenderContent.FindId(uuid.UUID(rhid)) if rhid else None
+    if not m:
+        defer_failed(blender_material, "render material not found")
+        return False
+    prefetch_embedded_images(_referenced_embedded_files((m,)))
+    harvest_from_rendercontent(model, m, blender_material)
+    del blender_material['rhdeferred']
+    if 'rhdeferred_failed' in blender_material:
+        del blender_material['rhdeferred_failed']
+    return True
+
+
+def handle_materials(context, model : r3d.File3dm, materials, update, texture_storage="PACK", use_templates=False, defer_source=None):
+    """
+    Create Blender materials for the render materials in model. When
+    defer_source is set materials only get their viewport color, the
+    node trees are harvested later from the file defer_source.
+    """
+    handle_embedded_files(model, texture_storage)
 
     if DEFAULT_RHINO_MATERIAL not in materials:
         tags = utils.create_tag_dict(DEFAULT_RHINO_MATERIAL_ID, DEFAULT_RHINO_MATERIAL)
@@ -496,6 +799,7 @@ def handle_materials(context, model : r3d.File3dm, materials, update):
         default_text_material(blmat)
         materials[DEFAULT_TEXT_MATERIAL] = blmat
 
+    rendermaterials = list()
     for mat in model.Materials:
         if not mat.PhysicallyBased:
             mat.ToPhysicallyBased()
@@ -503,11 +807,39 @@ def handle_materials(context, model : r3d.File3dm, materials, update):
 
         if not m:
             continue
-
-        matname = rendermaterial_name(m)
-        if matname not in materials:
-            tags = utils.create_tag_dict(m.Id, m.Name)
-            blmat = utils.get_or_create_iddata(context.blend_data.materials, tags, None)
-            if update:
-                harvest_from_rendercontent(model, m, blmat)
-            materials[matname] = blmat
+        rendermaterials.append(m)
+
+    # materials from earlier imports are reused when their
+    # render content is identical
+    existing = dict()
+    for blmat in context.blend_data.materials:
+        key = utils.get_tag(blmat, 'rhhash')
+        if key:
+            existing[key] = blmat
+
+    to_create = list()
+    for m in rendermaterials:
+        key = rendermaterial_key(m)
+        if key in materials:
+            continue
+        if key in existing:
+            materials[key] = existing[key]
+            continue
+        materials[key] = None
+        to_create.append((key, m))
+
+    defer = update and defer_source is not None
+
+    if update and not defer:
+        prefetch_embedded_images(_referenced_embedded_files(m for _, m in to_create))
+
+    for key, m in to_create:
+        tags = utils.create_tag_dict(m.Id, m.Name, content_hash=key)
+        template = material_template(m.TypeName) if update and use_templates and not defer else None
+        blmat = utils.get_or_create_iddata(context.blend_data.materials, tags, None, template=template)
+        utils.set_tag(blmat, 'rhhash', key)
+        if defer:
+            defer_material(m, blmat, defer_source, texture_storage)
+        elif update:
+            harvest_from_rendercontent(model, m, blmat)
+        materials[key] = blmat
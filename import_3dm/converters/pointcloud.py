@@ -21,7 +21,66 @@
 # SOFTWARE.
 
 import rhino3dm as r3d
+import bpy
+from bpy.app.handlers import persistent
+import numpy as np
+import os
+import uuid
 from . import utils
+from .. import buffers
+
+
+def _set_point_attributes(data, colors, normals, count):
+    if colors is not None and len(colors) == count:
+        rcl = data.attributes.new("RhinoColor", "FLOAT_COLOR", "POINT")
+        rcl.data.foreach_set("color", colors.ravel())
+    if normals is not None and len(normals) == count:
+        rnl = data.attributes.new("RhinoNormal", "FLOAT_VECTOR", "POINT")
+        rnl.data.foreach_set("vector", normals.ravel())
+
+
+def _new_pointcloud(context, name, count):
+    """
+    Create a PointCloud datablock with count points. Returns None
+    if this Blender version can't create point clouds from Python.
+    """
+    pointclouds = getattr(context.blend_data, "pointclouds", None)
+    if pointclouds is None:
+        return None
+    pointcloud = pointclouds.new(name=name)
+    if not hasattr(pointcloud, "resize"):
+        pointclouds.remove(pointcloud)
+        return None
+    pointcloud.resize(count)
+    return pointcloud
+
+
+def _points_data(context, name, positions, colors, normals, target):
+    """
+    Create the datablock holding the given points, either a
+    PointCloud or a vertex-only mesh depending on target.
+    """
+    count = len(positions)
+
+    pointcloud = None
+    if target == "POINTCLOUD":
+        pointcloud = _new_pointcloud(context, name, count)
+        if pointcloud is None:
+            print("Point cloud datablocks not supported, importing {} as mesh".format(name))
+        else:
+            pointcloud.attributes["position"].data.foreach_set("vector", positions.ravel())
+            _set_point_attributes(pointcloud, colors, normals, count)
+            pointcloud.update_tag()
+            return pointcloud
+
+    # add points as mesh vertices
+    pointcloud = context.blend_data.meshes.new(name=name)
+    pointcloud.vertices.add(count)
+    pointcloud.vertices.foreach_set("co", positions.ravel())
+    _set_point_attributes(pointcloud, colors, normals, count)
+    pointcloud.update()
+
+    return pointcloud
 
 
 def import_pointcloud(context, ob, name, scale, options):
@@ -29,14 +88,262 @@ def import_pointcloud(context, ob, name, scale, options):
     og = ob.Geometry
     oa = ob.Attributes
 
-    # add points as mesh vertices
+    target = options.get("pointcloud_target", "MESH")
 
     # The following line crashes. Seems rhino3dm does not like iterating over pointclouds.
     #vertices = [(p.X * scale, p.Y * scale, p.Z * scale) for p in og]
 
-    vertices = [(og[v].X * scale, og[v].Y * scale, og[v].Z * scale) for v in range(og.Count)]
+    buffer = buffers.pointcloud_buffer(og)
 
-    pointcloud = context.blend_data.meshes.new(name=name)
-    pointcloud.from_pydata(vertices, [], [])
+    return _points_data(context, name, buffer.positions * scale, buffer.colors, buffer.normals, target)
 
-    return pointcloud
+
+# *** tiled point clouds
+
+TILE_CACHE = "pointcloud_tiles"
+MAX_TILE_DEPTH = 12
+
+
+def needs_tiling(og, options):
+    """
+    Return True if the point cloud og should be imported as tiles
+    """
+    if not options.get("pointcloud_tiling", False):
+        return False
+    return og.Count > options.get("pointcloud_tile_points", 1000000)
+
+
+def _octree_tiles(positions, max_points):
+    """
+    Split positions into octree leaves holding at most max_points.
+    Returns a list of index arrays.
+    """
+    tiles = []
+    stack = [(np.arange(len(positions)), 0)]
+    while stack:
+        idx, depth = stack.pop()
+        pts = positions[idx]
+        lo = pts.min(axis=0)
+        hi = pts.max(axis=0)
+        if len(idx) <= max_points or depth >= MAX_TILE_DEPTH or np.allclose(lo, hi):
+            tiles.append(idx)
+            continue
+        center = (lo + hi) * 0.5
+        octant = ((pts > center) * np.array((1, 2, 4))).sum(axis=1)
+        for o in range(8):
+            sub = idx[octant == o]
+            if len(sub):
+                stack.append((sub, depth + 1))
+    return tiles
+
+
+def _voxel_subsample(positions, voxel):
+    """
+    Keep one point per voxel of size voxel. Returns the indices
+    of the points to keep.
+    """
+    if voxel <= 0.0 or len(positions) == 0:
+        return np.arange(len(positions))
+    cells = np.floor((positions - positions.min(axis=0)) / voxel).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    keys = cells[:, 0] + cells[:, 1] * dims[0] + cells[:, 2] * dims[0] * dims[1]
+    _, keep = np.unique(keys, return_index=True)
+    return np.sort(keep)
+
+
+def _tile_paths(tile_id):
+    cachedir = utils.cache_directory(TILE_CACHE)
+    base = os.path.join(cachedir, tile_id)
+    return (base + ".npy", base + "_color.npy", base + "_normal.npy")
+
+
+def _save_tile(tile_id, positions, colors, normals):
+    ppath, cpath, npath = _tile_paths(tile_id)
+    np.save(ppath, positions)
+    for path, arr in ((cpath, colors), (npath, normals)):
+        if arr is not None:
+            np.save(path, arr)
+        elif os.path.exists(path):
+            os.unlink(path)
+
+
+def _load_tile(tile_id):
+    ppath, cpath, npath = _tile_paths(tile_id)
+    if not os.path.exists(ppath):
+        return None
+    positions = np.load(ppath, mmap_mode="r")
+    colors = np.load(cpath, mmap_mode="r") if os.path.exists(cpath) else None
+    normals = np.load(npath, mmap_mode="r") if os.path.exists(npath) else None
+    return (positions, colors, normals)
+
+
+def trim_tile_cache(context, size_limit):
+    """
+    Remove the least recently written tiles until the tile cache takes
+    at most size_limit bytes. Tiles of the objects in the open .blend
+    are kept, tile objects of other files keep their level of detail
+    points if their tiles are removed.
+    """
+    keep = []
+    for ob in context.blend_data.objects:
+        tile_id = ob.get("rhtile", None)
+        if tile_id:
+            keep.extend(_tile_paths(tile_id))
+    utils.trim_cache_directory(utils.cache_directory(TILE_CACHE), size_limit, keep)
+
+
+def import_pointcloud_tiles(context, ob, name, layer, material, view_color, scale, options):
+    """
+    Import a large point cloud as a collection of tile objects, each
+    with a voxel-subsampled level of detail. The full resolution points
+    are cached to disk and loaded when a tile gets selected, and
+    optionally added as render only objects.
+    """
+    og = ob.Geometry
+    oa = ob.Attributes
+
+    target = options.get("pointcloud_target", "MESH")
+    max_points = options.get("pointcloud_tile_points", 1000000)
+    voxel = options.get("pointcloud_lod_voxel", 0.1)
+    render_full = options.get("pointcloud_tile_render", False)
+
+    buffer = buffers.pointcloud_buffer(og)
+    positions = buffer.positions * scale
+    colors = buffer.colors
+    normals = buffer.normals
+
+    tags = utils.create_tag_dict(uuid.uuid5(oa.Id, "tiles"), name)
+    tile_col = utils.get_or_create_iddata(context.blend_data.collections, tags, None)
+    if layer is None:
+        parents = []
+    elif isinstance(layer, bpy.types.Collection):
+        parents = [layer]
+    else:
+        parents = layer.users_collection
+    for col in parents:
+        if tile_col.name not in col.children:
+            col.children.link(tile_col)
+
+    # tiles are keyed by the content of the source file as well, object
+    # ids are only unique within one file
+    source = options.get("rh_filepath", None)
+    digest = utils.file_digest(source)[:16] if source else "unsaved"
+
+    for i, idx in enumerate(_octree_tiles(positions, max_points)):
+        tile_id = "{}_{}_{}".format(digest, oa.Id, i)
+        tile_pos = positions[idx]
+        tile_col_data = colors[idx] if colors is not None else None
+        tile_nrm = normals[idx] if normals is not None else None
+        _save_tile(tile_id, tile_pos, tile_col_data, tile_nrm)
+
+        keep = _voxel_subsample(tile_pos, voxel)
+        data = _points_data(context, "{} LOD {}".format(name, i), tile_pos[keep],
+                            tile_col_data[keep] if tile_col_data is not None else None,
+                            tile_nrm[keep] if tile_nrm is not None else None,
+                            target)
+        data.materials.append(material)
+
+        tile_tags = utils.create_tag_dict(uuid.uuid5(oa.Id, "tile{}".format(i)), "{} {}".format(name, i))
+        tile_ob = utils.get_or_create_iddata(context.blend_data.objects, tile_tags, data)
+        tile_ob.color = [x/255. for x in view_color]
+        tile_ob["rhtile"] = tile_id
+        tile_ob["rhtile_lod"] = True
+        tile_ob["rhtile_target"] = target
+        if layer is not None and not isinstance(layer, bpy.types.Collection):
+            tile_ob.parent = layer
+        if tile_ob.name not in tile_col.objects:
+            tile_col.objects.link(tile_ob)
+
+        # the full resolution points for rendering are built now, data
+        # can't be swapped once rendering starts
+        if render_full:
+            render_data = _points_data(context, "{} {}".format(name, i), tile_pos, tile_col_data, tile_nrm, target)
+            render_data.materials.append(material)
+            render_tags = utils.create_tag_dict(uuid.uuid5(oa.Id, "tilerender{}".format(i)), "{} {} Render".format(name, i))
+            render_ob = utils.get_or_create_iddata(context.blend_data.objects, render_tags, render_data)
+            render_ob.color = tile_ob.color
+            render_ob.hide_viewport = True
+            tile_ob.hide_render = True
+            if layer is not None and not isinstance(layer, bpy.types.Collection):
+                render_ob.parent = layer
+            if render_ob.name not in tile_col.objects:
+                tile_col.objects.link(render_ob)
+
+
+def load_full_tile(tile_ob):
+    """
+    Replace the level of detail points of tile_ob with the
+    full resolution points from the tile cache.
+    """
+    if not tile_ob.get("rhtile_lod", False):
+        return
+    tile = _load_tile(tile_ob["rhtile"])
+    tile_ob["rhtile_lod"] = False
+    if tile is None:
+        print("Tile cache for {} not found".format(tile_ob.name))
+        return
+    lod = tile_ob.data
+    data = _points_data(bpy.context, tile_ob.name, tile[0], tile[1], tile[2],
+                        tile_ob.get("rhtile_target", "MESH"))
+    for mat in lod.materials:
+        data.materials.append(mat)
+    tile_ob.data = data
+    if lod.users == 0:
+        if isinstance(lod, bpy.types.Mesh):
+            bpy.data.meshes.remove(lod)
+        else:
+            bpy.data.pointclouds.remove(lod)
+
+
+def renderable_tiles(scene):
+    """
+    The tile objects of scene that would be rendered with their
+    level of detail points.
+    """
+    return [ob for ob in scene.objects if ob.get("rhtile_lod", False) and not ob.hide_render]
+
+
+# names of the tile objects to load on the next timer call
+_pending_tiles = set()
+
+
+def _load_pending_tiles():
+    while _pending_tiles:
+        tile_ob = bpy.data.objects.get(_pending_tiles.pop(), None)
+        if tile_ob is not None:
+            load_full_tile(tile_ob)
+    return None
+
+
+@persistent
+def tile_selection_handler(scene, depsgraph):
+    # data can't be changed from a depsgraph handler, the tiles are
+    # loaded from a timer instead
+    for tile_ob in depsgraph.view_layer.objects.selected:
+        if tile_ob.get("rhtile_lod", False):
+            _pending_tiles.add(tile_ob.name)
+    if _pending_tiles and not bpy.app.timers.is_registered(_load_pending_tiles):
+        bpy.app.timers.register(_load_pending_tiles, first_interval=0.0)
+
+
+@persistent
+def tile_render_handler(scene, _):
+    # render handlers can't swap data either, the full tiles have to be
+    # loaded before rendering with the Load Full Point Cloud Tiles operator
+    count = len(renderable_tiles(scene))
+    if count:
+        print("Rendering {} point cloud tiles at their level of detail".format(count))
+
+
+def register_handlers():
+    bpy.app.handlers.depsgraph_update_post.append(tile_selection_handler)
+    bpy.app.handlers.render_pre.append(tile_render_handler)
+
+
+def unregister_handlers():
+    if tile_selection_handler in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(tile_selection_handler)
+    if tile_render_handler in bpy.app.handlers.render_pre:
+        bpy.app.handlers.render_pre.remove(tile_render_handler)
+    if bpy.app.timers.is_registered(_load_pending_tiles):
+        bpy.app.timers.unregister(_load_pending_tiles)
@@ -23,120 +23,294 @@
 import bpy
 import rhino3dm as r3d
 from . import utils
-import bpy
+from . import instancing
+from .. import buffers
 import bmesh
 import bpy.app
+import numpy as np
+import json
 
-import traceback
 
+def _valid_normals(normals):
+    """
+    Copy of normals with zero length normals pointing up. The normals
+    can be a read-only view of the buffer cache.
+    """
+    lengths = np.linalg.norm(normals, axis=1)
+    return np.where((lengths == 0.0)[:, None], np.float32((0.0, 0.0, 1.0)), normals).astype(np.float32)
 
-def import_render_mesh(context, ob, name, scale, options):
-    # concatenate all meshes from all (brep) faces,
-    # adjust vertex indices for faces accordingly
-    # first get all render meshes
+
+def _shade_smooth(mesh):
+    # flat faces ignore custom normals
+    if bpy.app.version < (4, 1):
+        mesh.use_auto_smooth = True
+        mesh.polygons.foreach_set("use_smooth", np.ones(len(mesh.polygons), dtype=bool))
+    else:
+        mesh.shade_smooth()
+
+
+def _set_custom_normals(mesh, normals):
+    """
+    Use the Rhino vertex normals as custom split normals on mesh. The
+    faces are smoothed as well.
+    """
+    _shade_smooth(mesh)
+    mesh.normals_split_custom_set_from_vertices(_valid_normals(normals))
+
+
+# face corner attribute carrying the Rhino normals through welding
+WELD_NORMALS = "rhweld_normals"
+
+
+def mesh_from_buffer(mesh, buffer, scale):
+    """
+    Fill mesh with the vertices and faces of buffer using foreach_set.
+    """
+    mesh.clear_geometry()
+
+    mesh.vertices.add(buffer.vertex_count)
+    mesh.vertices.foreach_set("co", (buffer.positions * scale).astype(np.float32).ravel())
+
+    mesh.loops.add(buffer.loop_count)
+    mesh.loops.foreach_set("vertex_index", buffer.face_indices)
+
+    mesh.polygons.add(buffer.face_count)
+    mesh.polygons.foreach_set("loop_start", buffer.loop_starts())
+    if bpy.app.version[0] < 4:
+        mesh.polygons.foreach_set("loop_total", buffer.face_sizes)
+    if bpy.app.version < (4, 1):
+        mesh.polygons.foreach_set("use_smooth", np.ones(buffer.face_count, dtype=bool))
+
+    mesh.update(calc_edges=True)
+
+
+# options needed to turn a proxy into the full mesh later on
+PROXY_OPTIONS = (
+    "merge_by_distance",
+    "merge_distance",
+    "import_normals",
+    "subD_level_viewport",
+    "subD_level_render",
+    "subD_boundary_smooth",
+    "buffer_cache",
+    "polygon_budget",
+    "polygon_budget_faces",
+)
+
+
+def import_proxy_mesh(context, ob, name, scale, options):
+    """
+    Import ob as a bounding box or a decimated render mesh. The mesh
+    is tagged with 'rhproxy', holding the source file, scale and mesh
+    options so it can be replaced with the full mesh later.
+    """
     og = ob.Geometry
     oa = ob.Attributes
 
-    needs_welding = options.get("merge_by_distance", False)
-
-    msh_tex = list()
-    if og.ObjectType == r3d.ObjectType.Extrusion:
-        msh = [og.GetMesh(r3d.MeshType.Any)]
-    elif og.ObjectType == r3d.ObjectType.Mesh:
-        msh = [og]
-    elif og.ObjectType == r3d.ObjectType.SubD:
-        msh = [r3d.Mesh.CreateFromSubDControlNet(og, False)]
-        msh_tex = [r3d.Mesh.CreateFromSubDControlNet(og, True)]
-    elif og.ObjectType == r3d.ObjectType.Brep:
-        msh = [og.Faces[f].GetMesh(r3d.MeshType.Any) for f in range(len(og.Faces)) if type(og.Faces[f])!=list]
-    fidx = 0
-    faces = []
-    vertices = []
-    coords = []
-    vcls = []
-
-    # now add all faces and vertices to the main lists
-    for m in msh:
-        if not m:
-            continue
-        faces.extend([list(map(lambda x: x + fidx, m.Faces[f])) for f in range(len(m.Faces))])
-
-        # Rhino always uses 4 values to describe faces, which can lead to
-        # invalid faces in Blender. Tris will have a duplicate index for the 4th
-        # value.
-        for f in faces:
-            if f[-1] == f[-2]:
-                del f[-1]
-
-        fidx = fidx + len(m.Vertices)
-        vertices.extend([(m.Vertices[v].X * scale, m.Vertices[v].Y * scale, m.Vertices[v].Z * scale) for v in range(len(m.Vertices))])
-        coords.extend([(m.TextureCoordinates[v].X, m.TextureCoordinates[v].Y) for v in range(len(m.TextureCoordinates))])
-        vcls.extend((m.VertexColors[v][0], m.VertexColors[v][1], m.VertexColors[v][2], m.VertexColors[v][3]) for v in range(len(m.VertexColors)))
+    if options.get("proxy_mode") == "BBOX":
+        bbox = og.GetBoundingBox(True)
+        buffer = buffers.bbox_buffer(
+            (bbox.Min.X, bbox.Min.Y, bbox.Min.Z),
+            (bbox.Max.X, bbox.Max.Y, bbox.Max.Z))
+    else:
+        buffer = render_mesh_buffer(og, oa, options)
+        buffer = buffers.decimate_buffer(buffer, options.get("proxy_resolution", 8))
 
     tags = utils.create_tag_dict(oa.Id, oa.Name)
     mesh = utils.get_or_create_iddata(context.blend_data.meshes, tags, None)
-    mesh.clear_geometry()
-    mesh.from_pydata(vertices, [], faces, shade_flat=False)
+    mesh_from_buffer(mesh, buffer, scale)
+    mesh.validate()
+    mesh.update()
+
+    proxy = {key: options[key] for key in PROXY_OPTIONS if key in options}
+    source = options.get("rh_filepath")
+    proxy["file"] = source
+    # hydration checks that the file still has this content
+    proxy["digest"] = utils.file_digest(source) if source else None
+    proxy["scale"] = scale
+    proxy["subd"] = og.ObjectType == r3d.ObjectType.SubD
+    # the scene budget of the object, hydration has no scene to split
+    proxy["face_budget"] = face_budget(oa, options)
+    mesh['rhproxy'] = json.dumps(proxy)
+
+    return mesh
+
+
+def proxy_source(mesh):
+    """
+    Get the dictionary stored on a proxy mesh, or None if mesh
+    isn't a proxy.
+    """
+    data = mesh.get('rhproxy', None)
+    return json.loads(data) if data else None
+
+
+def render_mesh_buffer(og, oa, options):
+    """
+    Get the render mesh of og as a GeometryBuffer. With a buffer cache
+    in options the buffer is read from the cache, or extracted and
+    stored in it on a miss. Cached buffers have normals even when they
+    aren't imported.
+    """
+    normals = options.get("import_normals", False)
+    cache = options.get("rh_buffer_cache", None)
+    if cache is None:
+        meshes, texture_meshes = buffers.render_meshes(og)
+        return buffers.mesh_buffer(meshes, texture_meshes, normals)
+
+    key = str(oa.Id)
+    buffer = cache.get(key)
+    if buffer is None:
+        # cache the normals too, so the cache serves imports with
+        # and without them
+        meshes, texture_meshes = buffers.render_meshes(og)
+        buffer = buffers.mesh_buffer(meshes, texture_meshes, True)
+        cache.put(key, buffer)
+    return buffer
 
-    coords_tex = list()
-    for mt in msh_tex:
-        if not mt:
-            continue
-        coords_tex.extend([(mt.TextureCoordinates[v].X, mt.TextureCoordinates[v].Y) for v in range(len(mt.TextureCoordinates))])
 
-    if mesh.loops:  # and len(coords) == len(vertices):
+def render_mesh_triangles(og, oa, options):
+    """
+    Number of triangles in the render mesh of og. With a buffer cache
+    in options the mesh is extracted into the cache, for the import to
+    read it from there.
+    """
+    if options.get("rh_buffer_cache", None) is None:
+        meshes, _ = buffers.render_meshes(og)
+        return buffers.mesh_triangle_count(meshes)
+    return buffers.triangle_count(render_mesh_buffer(og, oa, options))
+
+
+def build_render_mesh(context, tags, name, buffer, scale, options):
+    """
+    Create or update the mesh tagged with tags from buffer, with
+    texture coordinates, colors and normals.
+    """
+    needs_welding = options.get("merge_by_distance", False)
+
+    mesh = utils.get_or_create_iddata(context.blend_data.meshes, tags, None)
+    mesh_from_buffer(mesh, buffer, scale)
+
+    if mesh.loops and buffer.uvs is not None:
         # todo:
         # * check for multiple mappings and handle them
         # * get mapping name (missing from rhino3dm)
         # * rhino assigns a default mapping to unmapped objects, so if nothing is specified, this will be imported
 
-        #create a new uv_layer and copy texcoords from input mesh
-        mesh.uv_layers.new(name="RhinoUVMap")
-
-        if sum(len(x) for x in faces) == len(mesh.uv_layers["RhinoUVMap"].data):
-            uvl = mesh.uv_layers["RhinoUVMap"].data[:]
-
-            for loop in mesh.loops:
-                try:
-                    if coords_tex:
-                        uvl[loop.index].uv = coords_tex[loop.index]
-                    elif coords:
-                        # print(loop.index, loop.vertex_index, len(uvl), len(coords))
-                        uvl[loop.index].uv = coords[loop.vertex_index]
-                    else:
-                        print("no tex coords")
-                except IndexError:
-                    print(name)
-                    print(traceback.format_exc())
-
-            mesh.validate()
-            mesh.update()
+        # per vertex texture coordinates are spread to the face corners
+        uvs = buffer.uvs if buffer.uvs_per_loop else buffer.uvs[buffer.face_indices]
 
+        if len(uvs) == len(mesh.loops):
+            #create a new uv_layer and copy texcoords from input mesh
+            uvl = mesh.uv_layers.new(name="RhinoUVMap")
+            uvl.data.foreach_set("uv", uvs.ravel())
         else:
-            #in case there was a data mismatch, cleanup the created layer
-            mesh.uv_layers.remove(mesh.uv_layers["RhinoUVMap"])
+            print("{}: texture coordinates don't match the mesh".format(name))
+
+    if buffer.colors is not None:
+        rcl = mesh.attributes.new("RhinoColor", "FLOAT_COLOR", "POINT")
+        rcl.data.foreach_set("color", buffer.colors.ravel())
 
-    if len(vcls) == len(vertices):
-        mesh.attributes.new("RhinoColor", "FLOAT_COLOR", "POINT")
-        rcl = mesh.attributes["RhinoColor"]
-        for i in range(len(vcls)):
-            vcl = vcls[i]
-            rcl.data[i].color =  (vcl[0] / 255.0, vcl[1] / 255.0, vcl[2] / 255.0, vcl[3] / 255.0)
+    mesh.validate()
+    mesh.update()
 
-        mesh.validate()
-        mesh.update()
+    has_normals = options.get("import_normals", False) and buffer.normals is not None and len(mesh.loops) > 0
 
     if needs_welding:
+        # custom normals are stored relative to the faces around each
+        # vertex and welding changes those, so the normals go through
+        # the weld as a face corner attribute and are set afterwards
+        if has_normals:
+            # validate may have removed faces, map through the loops left
+            loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+            mesh.loops.foreach_get("vertex_index", loop_vertices)
+            corner_normals = mesh.attributes.new(WELD_NORMALS, "FLOAT_VECTOR", "CORNER")
+            corner_normals.data.foreach_set("vector", _valid_normals(buffer.normals)[loop_vertices].ravel())
         bm = bmesh.new()
         bm.from_mesh(mesh)
         merge_distance = options.get("merge_distance", 0.0001)
         bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=merge_distance)
         bm.to_mesh(mesh)
         bm.free()
-        if bpy.app.version >= (4, 1):
+        if has_normals:
+            corner_normals = mesh.attributes[WELD_NORMALS]
+            normals = np.empty(len(mesh.loops) * 3, dtype=np.float32)
+            corner_normals.data.foreach_get("vector", normals)
+            mesh.attributes.remove(corner_normals)
+            _shade_smooth(mesh)
+            mesh.normals_split_custom_set(normals.reshape(-1, 3))
+        elif bpy.app.version >= (4, 1):
             mesh.set_sharp_from_angle(angle=0.523599) # 30deg
         else:
             mesh.use_auto_smooth = True
+    elif has_normals:
+        _set_custom_normals(mesh, buffer.normals)
+
+    return mesh
+
+
+def face_budget(oa, options):
+    """
+    Maximum number of triangles for the render mesh of the object with
+    attributes oa, or None if there is no budget.
+    """
+    mode = options.get("polygon_budget", "NONE")
+    if mode == "OBJECT":
+        return options.get("polygon_budget_faces", 100000)
+    if mode == "SCENE":
+        budgets = options.get("rh_face_budgets", None)
+        if budgets is None:
+            # hydrated proxies keep the budget they were imported with
+            return options.get("face_budget", None)
+        return budgets.get(str(oa.Id), None)
+    return None
+
+
+def decimate_to_face_budget(buffer, budget, name):
+    """
+    Decimate buffer to budget triangles, reporting meshes that can't
+    be reduced that far.
+    """
+    buffer = buffers.decimate_to_budget(buffer, budget)
+    count = buffers.triangle_count(buffer)
+    if count > budget:
+        print("{}: {} triangles exceed the polygon budget of {}".format(name, count, budget))
+    return buffer
+
+
+def import_render_mesh(context, ob, name, scale, options):
+    if options.get("proxy_mode", "NONE") != "NONE":
+        return import_proxy_mesh(context, ob, name, scale, options)
+
+    # concatenate all meshes from all (brep) faces,
+    # adjust vertex indices for faces accordingly
+    og = ob.Geometry
+    oa = ob.Attributes
+
+    buffer = render_mesh_buffer(og, oa, options)
+
+    # geometry repeating an earlier mesh under a rigid transform shares
+    # that mesh, convert_object places the object with instance_matrix
+    frame = None
+    if options.get("auto_instancing", False):
+        tolerance = options.get("instance_tolerance", 0.0001)
+        frame = instancing.canonicalize(buffer, scale, tolerance)
+        prototype = instancing.find_prototype(frame, tolerance) if frame else None
+        if prototype is not None:
+            instancing.set_instance(oa.Id, prototype[1], frame)
+            return prototype[0]
+
+    # decimate after looking for instances, copies wouldn't decimate
+    # the same way
+    budget = face_budget(oa, options)
+    if budget is not None:
+        buffer = decimate_to_face_budget(buffer, budget, name)
+
+    tags = utils.create_tag_dict(oa.Id, oa.Name)
+    mesh = build_render_mesh(context, tags, name, buffer, scale, options)
+
+    if frame is not None:
+        instancing.add_prototype(mesh, frame)
 
     # done, now add object to blender
     return mesh
@@ -23,12 +23,99 @@
 # *** data tagging
 
 import bpy
+import hashlib
+import json
+import os
+import shutil
+import tempfile
 import uuid
 import rhino3dm as r3d
 from mathutils import Matrix
 
 from typing import Any, Dict
 
+# Tags that are only stored when they differ from these defaults.
+# rhname is always stored, the datablock name changes when users
+# rename it.
+TAG_DEFAULTS = {
+    'rhname': None,
+    'rhmatid': None,
+    'rhparentid': None,
+    'rhidef': False,
+    'rhmat_from_object': True,
+    'rhhash': None,
+}
+
+# Key of the ID property holding the packed non-default tags
+PACKED_TAGS = 'rhtag'
+
+
+def _is_default_tag(key : str, value : Any) -> bool:
+    return value == TAG_DEFAULTS[key]
+
+
+def _write_tags(idblock : bpy.types.ID, tags : Dict[str, Any]) -> None:
+    packed = {k: v for k, v in tags.items() if not _is_default_tag(k, v)}
+    if packed:
+        idblock[PACKED_TAGS] = json.dumps(packed, separators=(',', ':'))
+    elif PACKED_TAGS in idblock:
+        del idblock[PACKED_TAGS]
+
+
+def _read_tags(idblock : bpy.types.ID) -> Dict[str, Any]:
+    packed = idblock.get(PACKED_TAGS, None)
+    if not packed:
+        return dict()
+    return json.loads(packed)
+
+
+def get_tag(idblock : bpy.types.ID, key : str, default : Any = None) -> Any:
+    """
+    Read the tag key from idblock. Tags at their default value aren't
+    stored, so return the default for those.
+    """
+    if key == 'rhid':
+        return idblock.get('rhid', default)
+    tags = _read_tags(idblock)
+    if key in tags:
+        return tags[key]
+    if key == 'rhname':
+        # written by versions that left out names equal to the
+        # datablock name
+        return idblock.name
+    return TAG_DEFAULTS.get(key, default)
+
+
+def set_tag(idblock : bpy.types.ID, key : str, value : Any) -> None:
+    """
+    Set a single tag on idblock, keeping the packed form compact
+    """
+    if key == 'rhid':
+        idblock['rhid'] = str(value)
+        return
+    tags = _read_tags(idblock)
+    tags[key] = value
+    _write_tags(idblock, tags)
+
+
+def migrate_tags(idblock : bpy.types.ID) -> None:
+    """
+    Convert tags written as separate ID properties by earlier
+    versions of the importer into the packed form.
+    """
+    legacy = [k for k in TAG_DEFAULTS if k in idblock]
+    if not legacy:
+        return
+    tags = _read_tags(idblock)
+    for k in legacy:
+        v = idblock[k]
+        if k in ('rhmatid', 'rhparentid') and v == "None":
+            v = None
+        tags[k] = v
+        del idblock[k]
+    _write_tags(idblock, tags)
+
+
 def tag_data(
         idblock : bpy.types.ID,
         tag_dict: Dict[str, Any]
@@ -37,18 +124,21 @@ def tag_data(
     Given a Blender data idblock tag it with the id an name
     given using custom properties. These are used to track the
     relationship with original Rhino data.
+
+    Only the rhid is stored as its own property, the remaining
+    tags are packed into one property and only if they differ
+    from their defaults.
     """
     guid = tag_dict.get('rhid', None)
-    name = tag_dict.get('rhname', None)
-    matid = tag_dict.get('rhmatid', None)
-    parentid = tag_dict.get('rhparentid', None)
-    is_idef = tag_dict.get('rhidef', False)
-    idblock['rhid'] = str(guid)
-    idblock['rhname'] = name
-    idblock['rhmatid'] = str(matid)
-    idblock['rhparentid'] = str(parentid)
-    idblock['rhidef'] = is_idef
-    idblock['rhmat_from_object'] = tag_dict.get('rhmat_from_object', True)
+    if guid is not None:
+        idblock['rhid'] = str(guid)
+    tags = dict()
+    for key in TAG_DEFAULTS:
+        value = tag_dict.get(key, TAG_DEFAULTS[key])
+        if key in ('rhmatid', 'rhparentid') and value is not None:
+            value = str(value)
+        tags[key] = value
+    _write_tags(idblock, tags)
 
 def create_tag_dict(
         guid            : uuid.UUID,
@@ -57,6 +147,7 @@ def create_tag_dict(
         parentid        : uuid.UUID = None,
         is_idef         : bool = False,
         mat_from_object : bool = True,
+        content_hash    : str = None,
 ) -> Dict[str, Any]:
     """
     Create a dictionary with the tag data. This can be used
@@ -70,7 +161,8 @@ def create_tag_dict(
         'rhmatid': matid,
         'rhparentid': parentid,
         'rhidef': is_idef,
-        'rhmat_from_object': mat_from_object
+        'rhmat_from_object': mat_from_object,
+        'rhhash': content_hash,
     }
 
 all_dict = dict()
@@ -101,6 +193,7 @@ def reset_all_dict(context : bpy.types.Context) -> None:
         for item in base:
             rhid = item.get('rhid', None)
             if rhid:
+                migrate_tags(item)
                 dct[rhid] = item
 
 def get_dict_for_base(base : bpy.types.bpy_prop_collection) -> Dict[str, bpy.types.ID]:
@@ -114,7 +207,9 @@ def get_or_create_iddata(
         base    : bpy.types.bpy_prop_collection,
         tag_dict: Dict[str, Any],
         obdata : bpy.types.ID,
-        use_none : bool = False
+        use_none : bool = False,
+        template : bpy.types.ID = None,
+        curve_type : str = None
     )   -> bpy.types.ID:
     """
     Get an iddata.
@@ -125,13 +220,13 @@ def get_or_create_iddata(
 
     If obdata is given then the found object data will be set
     to that.
+
+    If template is given a new item is created as a copy of it.
+    For curves curve_type has to be given.
     """
     founditem : bpy.types.ID = None
     guid = tag_dict.get('rhid', None)
     name = tag_dict.get('rhname', None)
-    matid = tag_dict.get('rhmatid', None)
-    parentid = tag_dict.get('rhparentid', None)
-    is_idef = tag_dict.get('rhidef', False)
     dct = get_dict_for_base(base)
     if guid is not None:
         strguid = str(guid)
@@ -139,11 +234,16 @@ def get_or_create_iddata(
             founditem = dct[strguid]
     if founditem:
         theitem = founditem
-        theitem['rhname'] = name
+        set_tag(theitem, 'rhname', name)
         if obdata and type(theitem) != type(obdata):
             theitem.data = obdata
     else:
-        if obdata or use_none:
+        if template is not None:
+            theitem = template.copy()
+            theitem.name = name
+        elif curve_type:
+            theitem = base.new(name=name, type=curve_type)
+        elif obdata or use_none:
             theitem = base.new(name=name, object_data=obdata)
         else:
             theitem = base.new(name=name)
@@ -160,4 +260,86 @@ def matrix_from_xform(xform : r3d.Transform):
             (xform.M20, xform.M21, xform.M22, xform.M23),
             (xform.M30, xform.M31, xform.M32, xform.M33))
      )
-     return m
\ No newline at end of file
+     return m
+
+def cache_directory(subdir : str) -> str:
+    """
+    Get the directory for cached import data of the given kind,
+    creating it when necessary. Use the extension user directory
+    when available, otherwise fall back to the system temp directory.
+    """
+    package = __package__.rpartition(".")[0]
+    try:
+        root = bpy.utils.extension_path_user(package, path="cache", create=True)
+    except (ValueError, AttributeError):
+        root = os.path.join(tempfile.gettempdir(), "import_3dm", "cache")
+    path = os.path.join(root, subdir)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _entry_size(path : str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def trim_cache_directory(directory : str, size_limit : int, keep = ()) -> None:
+    """
+    Remove the least recently modified files and subdirectories of
+    directory until it takes at most size_limit bytes. Paths in keep
+    are never removed.
+    """
+    keep = {os.path.normpath(path) for path in keep}
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            entries.append((os.stat(path).st_mtime, _entry_size(path), path))
+        except OSError:
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= size_limit:
+            break
+        if os.path.normpath(path) in keep:
+            continue
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+# (path, size, mtime) to the content digest of the file
+_digests = dict()
+
+
+def file_digest(filepath : str, chunk_size : int = 1 << 20) -> str:
+    """
+    Get the sha256 hex digest of the content of the file at filepath.
+    Digests are remembered until the size or modification time of the
+    file changes.
+    """
+    stat = os.stat(filepath)
+    key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime)
+    digest = _digests.get(key, None)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        _digests[key] = digest
+    return digest
@@ -0,0 +1,137 @@
+# MIT License
+
+# Copyright (c) 2018-2024 Nathan Letwory, Joel Putnam, Tom Svilans, Lukas Fertig
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Session cache of parsed 3dm files. Models are kept by path, size and
+modification time so that importing the same file again, or hydrating
+proxies and materials from it, doesn't read it again. The cache is
+limited by the summed size of the files and drops the least recently
+used models first.
+"""
+
+import os
+from collections import OrderedDict
+
+import rhino3dm as r3d
+
+
+class CachedModel:
+    """
+    A parsed model with lookup tables for the tables the importer
+    queries for every object.
+    """
+    __slots__ = ("model", "size", "layers", "materials")
+
+    def __init__(self, model : r3d.File3dm, size : int):
+        self.model = model
+        self.size = size
+        self.layers = {layer.Index: layer for layer in model.Layers}
+        self.materials = {material.Index: material for material in model.Materials}
+
+    def layer(self, index : int) -> r3d.Layer:
+        return self.layers.get(index, None)
+
+    def material(self, index : int) -> r3d.Material:
+        return self.materials.get(index, None)
+
+
+# (path, size, mtime) to CachedModel, least recently used first
+_models = OrderedDict()
+DEFAULT_LIMIT = 4096 * 1024 * 1024
+_limit = DEFAULT_LIMIT
+
+
+def set_limit(limit : int) -> None:
+    """
+    Set the cache limit in bytes of file size. 0 disables the cache.
+    """
+    global _limit
+    _limit = limit
+    _evict()
+
+
+def _evict() -> None:
+    total = usage()
+    while _models and total > _limit:
+        _, entry = _models.popitem(last=False)
+        total -= entry.size
+
+
+def usage() -> int:
+    return sum(entry.size for entry in _models.values())
+
+
+def count() -> int:
+    return len(_models)
+
+
+def clear() -> None:
+    _models.clear()
+
+
+def discard(filepath : str) -> None:
+    """
+    Drop the cached models of the file at filepath, for instance
+    before changing a model returned by load.
+    """
+    path = os.path.abspath(filepath)
+    for key in [k for k in _models if k[0] == path]:
+        del _models[key]
+
+
+def load(filepath : str, keep : bool = True) -> CachedModel:
+    """
+    Get the model for the file at filepath, reading the file when it
+    isn't cached or changed since it was cached. Returns None if the
+    file can't be read. A model read with keep set to False isn't
+    added to the cache.
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        stat = None
+
+    key = None
+    if stat is not None:
+        key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime)
+        entry = _models.get(key, None)
+        if entry is not None:
+            _models.move_to_end(key)
+            return entry
+
+    try:
+        model = r3d.File3dm.Read(filepath)
+    except:
+        print("Failed to import .3dm model: {}".format(filepath))
+        return None
+    if model is None:
+        print("Failed to import .3dm model: {}".format(filepath))
+        return None
+
+    entry = CachedModel(model, stat.st_size if stat is not None else 0)
+    if keep and key is not None and entry.size <= _limit:
+        # drop older versions of the same file
+        for old in [k for k in _models if k[0] == key[0]]:
+            del _models[old]
+        _models[key] = entry
+        _evict()
+    return entry
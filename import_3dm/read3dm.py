@@ -22,8 +22,10 @@
 
 import os.path
 import bpy
+from bpy.app.handlers import persistent
 import sys
 import os
+import gc
 from pathlib import Path
 from typing import Any, Dict, Set
 
@@ -53,6 +55,17 @@ modules_path()
 
 import rhino3dm as r3d
 from . import converters
+from . import spatial
+from . import model_cache
+from . import buffers
+
+BUFFER_CACHE = "buffers"
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
 
 
 def create_or_get_top_layer(context, filepath):
@@ -64,6 +77,481 @@ def create_or_get_top_layer(context, filepath):
     return toplayer
 
 
+def load_model(filepath : str, keep : bool = True) -> r3d.File3dm:
+    """
+    Read the 3dm file at filepath through the session model cache.
+    Returns None if the file can't be read.
+    """
+    entry = model_cache.load(filepath, keep)
+    return entry.model if entry is not None else None
+
+
+def model_cache_limit(context : bpy.types.Context) -> int:
+    """
+    Model cache limit in bytes from the add-on preferences.
+    """
+    addon = context.preferences.addons.get(__package__, None)
+    if addon is None:
+        return model_cache.DEFAULT_LIMIT
+    return addon.preferences.model_cache_size * 1024 * 1024
+
+
+def buffer_cache(filepath : str, digest : str = None) -> buffers.BufferCache:
+    """
+    The geometry buffer cache for the content of the file at filepath,
+    or for the file content with digest if given. Returns None if the
+    file can't be read.
+    """
+    if digest is None:
+        try:
+            digest = converters.utils.file_digest(filepath)
+        except OSError:
+            return None
+    return buffers.BufferCache(os.path.join(converters.utils.cache_directory(BUFFER_CACHE), digest))
+
+
+def source_changed(filepath : str, digest : str) -> bool:
+    """
+    True if the file at filepath no longer has the content with digest
+    it had when data was imported from it. Files that can't be read
+    are left to the model loading to report.
+    """
+    if not digest:
+        return False
+    try:
+        return converters.utils.file_digest(filepath) != digest
+    except OSError:
+        return False
+
+
+def hydrate_proxies(
+        context : bpy.types.Context,
+        objects
+    )   -> int:
+    """
+    Replace the proxy meshes of objects with their full render meshes.
+    Returns the number of objects hydrated. Proxies of files changed
+    since the import are only hydrated from the buffer cache.
+    """
+    by_source = dict()
+    for ob in objects:
+        if ob.type != 'MESH':
+            continue
+        source = converters.proxy_source(ob.data)
+        if source and source.get("file"):
+            by_source.setdefault((source["file"], source.get("digest", None)), list()).append(ob)
+
+    count = 0
+    # meshes are looked up by their Rhino id like during import
+    converters.initialize(context)
+    try:
+        for (filepath, digest), obs in by_source.items():
+            use_cache = any(converters.proxy_source(ob.data).get("buffer_cache", False) for ob in obs)
+            cache = buffer_cache(filepath, digest) if use_cache else None
+            # the file is only read for proxies missing from the cache
+            model = None
+            changed = None
+            for ob in obs:
+                # objects can share a proxy mesh, hydrate each mesh once
+                if 'rhproxy' not in ob.data:
+                    continue
+                if cache is not None and converters.hydrate_proxy_from_cache(context, cache, ob):
+                    count += 1
+                    continue
+                if changed is None:
+                    changed = source_changed(filepath, digest)
+                    if changed:
+                        print("{} changed since the proxies were imported, not hydrating them".format(filepath))
+                if changed:
+                    continue
+                if model is None:
+                    model = load_model(filepath)
+                    if model is None:
+                        break
+                if converters.hydrate_proxy(context, model, ob, cache):
+                    count += 1
+            if cache is not None:
+                cache.flush()
+    finally:
+        converters.cleanup()
+    return count
+
+
+def hydrate_materials(
+        context : bpy.types.Context,
+        blender_materials,
+        retry : bool = False
+    )   -> int:
+    """
+    Harvest the full node trees of deferred materials from the 3dm
+    files they were imported from. Returns the number of materials
+    hydrated. Materials that failed to hydrate before are skipped
+    unless retry is set.
+    """
+    by_source = dict()
+    for blmat in blender_materials:
+        source = converters.material.deferred_source(blmat)
+        if source and (retry or not converters.material.deferred_failed(blmat)):
+            key = (source['file'], source['textures'], source.get('digest', None))
+            by_source.setdefault(key, set()).add(blmat)
+
+    count = 0
+    for (filepath, texture_storage, digest), blmats in by_source.items():
+        if source_changed(filepath, digest):
+            for blmat in blmats:
+                converters.material.defer_failed(blmat, "source file {} changed since the import".format(filepath))
+            continue
+        model = load_model(filepath)
+        if model is None:
+            for blmat in blmats:
+                converters.material.defer_failed(blmat, "source file {} can't be read".format(filepath))
+            continue
+        converters.material.handle_embedded_files(model, texture_storage)
+        for blmat in blmats:
+            if converters.material.hydrate_material(model, blmat):
+                count += 1
+    return count
+
+
+def _deferred_materials(objects):
+    blmats = set()
+    for ob in objects:
+        for slot in ob.material_slots:
+            if slot.material and 'rhdeferred' in slot.material:
+                blmats.add(slot.material)
+    return blmats
+
+
+def renderable_deferred_materials(scene):
+    """
+    The deferred materials used by the objects scene renders.
+    """
+    return _deferred_materials(ob for ob in scene.objects if not ob.hide_render)
+
+
+@persistent
+def material_render_handler(scene, _):
+    # bpy.data can't be changed once rendering starts, deferred
+    # materials have to be hydrated before with Hydrate Rhino Materials
+    count = sum(1 for blmat in renderable_deferred_materials(scene)
+                if not converters.material.deferred_failed(blmat))
+    if count:
+        print("Rendering {} deferred Rhino materials with their viewport color".format(count))
+
+
+def material_preview_timer():
+    """
+    Hydrate deferred materials of visible objects once a 3D view
+    switches to material preview or rendered shading.
+    """
+    context = bpy.context
+    wm = getattr(context, "window_manager", None)
+    if wm is None:
+        return 1.0
+    for window in wm.windows:
+        for area in window.screen.areas:
+            if area.type != 'VIEW_3D':
+                continue
+            shading = area.spaces.active.shading
+            if shading.type not in ('MATERIAL', 'RENDERED'):
+                continue
+            if not any('rhdeferred' in blmat and not converters.material.deferred_failed(blmat)
+                       for blmat in context.blend_data.materials):
+                return 1.0
+            view_layer = window.view_layer
+            visible = [ob for ob in view_layer.objects if ob.visible_get(view_layer=view_layer)]
+            hydrate_materials(context, _deferred_materials(visible))
+            return 1.0
+    return 1.0
+
+
+def register_handlers() -> None:
+    converters.register_handlers()
+    bpy.app.handlers.render_pre.append(material_render_handler)
+    bpy.app.timers.register(material_preview_timer, first_interval=1.0, persistent=True)
+
+
+def unregister_handlers() -> None:
+    converters.unregister_handlers()
+    if material_render_handler in bpy.app.handlers.render_pre:
+        bpy.app.handlers.render_pre.remove(material_render_handler)
+    if bpy.app.timers.is_registered(material_preview_timer):
+        bpy.app.timers.unregister(material_preview_timer)
+
+
+def peak_rss():
+    """
+    Peak resident set size of Blender in MB, or None where it
+    can't be queried.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def _memory_phase(report, phase):
+    """
+    Release unreferenced memory and note the peak memory use at the
+    end of phase, if report is a list.
+    """
+    if report is None:
+        return
+    gc.collect()
+    report.append((phase, peak_rss()))
+
+
+def _print_memory_report(filepath, report):
+    # the peak can only be queried for the whole process, so the
+    # increase of the peak is what a phase added to it
+    print("Peak memory use importing {}, cumulative and increase in phase".format(filepath))
+    previous = None
+    for phase, peak in report:
+        if peak is None:
+            print("  {:<12} n/a".format(phase))
+            continue
+        increase = peak - previous if previous is not None else 0.0
+        print("  {:<12} {:.1f} MB  +{:.1f} MB".format(phase, peak, increase))
+        previous = peak
+
+
+def _objects_in_chunks(model, chunk_size):
+    """
+    Yield the objects of model, reading chunk_size objects from the
+    object table at a time. Once a chunk is converted its objects are
+    deleted from model where rhino3dm supports it, so their geometry
+    is freed while the import goes on. model must not be shared, see
+    model_cache.discard.
+    """
+    delete = getattr(model.Objects, "Delete", None)
+    ids = [ob.Attributes.Id for ob in model.Objects]
+    for start in range(0, len(ids), chunk_size):
+        chunk_ids = ids[start:start + chunk_size]
+        chunk = [model.Objects.FindId(rhid) for rhid in chunk_ids]
+        for ob in chunk:
+            if ob is not None:
+                yield ob
+        del chunk, ob
+        if delete is not None:
+            for rhid in chunk_ids:
+                delete(rhid)
+        gc.collect()
+
+
+def viewport_matrix(context):
+    """
+    Projection times view matrix of the first 3D viewport, or None
+    if there is no 3D viewport.
+    """
+    wm = getattr(context, "window_manager", None)
+    if wm is None:
+        return None
+    for window in wm.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                return area.spaces.active.region_3d.perspective_matrix
+    return None
+
+
+def _object_boxes(model):
+    """
+    Bounding boxes of the objects of model by id, as (min, max)
+    tuples. The boxes of block instances are the boxes of their
+    definition members transformed by the instance transform, objects
+    without a valid box are left out.
+    """
+    boxes = dict()
+    references = dict()
+    for ob in model.Objects:
+        og = ob.Geometry
+        rhid = str(ob.Attributes.Id)
+        if og.ObjectType == r3d.ObjectType.InstanceReference:
+            xform = list(og.Xform.ToFloatArray(1))
+            references[rhid] = (str(og.ParentIdefId), [xform[0:4], xform[4:8], xform[8:12], xform[12:16]])
+            continue
+        bbox = og.GetBoundingBox(False)
+        if bbox.IsValid:
+            boxes[rhid] = ((bbox.Min.X, bbox.Min.Y, bbox.Min.Z), (bbox.Max.X, bbox.Max.Y, bbox.Max.Z))
+
+    members = {str(idef.Id): [str(guid) for guid in idef.GetObjectIds()] for idef in model.InstanceDefinitions}
+    definition_boxes = dict()
+
+    def definition_box(idef_id):
+        if idef_id in definition_boxes:
+            return definition_boxes[idef_id]
+        # guards against definitions nesting themselves
+        definition_boxes[idef_id] = None
+        member_boxes = [b for b in (object_box(m) for m in members.get(idef_id, ())) if b is not None]
+        if member_boxes:
+            definition_boxes[idef_id] = (
+                tuple(min(b[0][i] for b in member_boxes) for i in range(3)),
+                tuple(max(b[1][i] for b in member_boxes) for i in range(3)))
+        return definition_boxes[idef_id]
+
+    def object_box(rhid):
+        if rhid in boxes:
+            return boxes[rhid]
+        if rhid not in references:
+            return None
+        idef_id, matrix = references[rhid]
+        box = definition_box(idef_id)
+        if box is not None:
+            lo, hi = spatial.transform_box(box[0], box[1], matrix)
+            box = (tuple(lo), tuple(hi))
+        boxes[rhid] = box
+        return box
+
+    for rhid in list(references):
+        object_box(rhid)
+    return {rhid: box for rhid, box in boxes.items() if box is not None}
+
+
+def _objects_in_region(context, model, options, scale):
+    """
+    Collect the ids of the objects to import when restricting the
+    import to a region or culling small objects. Returns None if the
+    region can't be determined, in which case everything is imported.
+    """
+    region = options.get("import_region", "NONE")
+    min_size = options.get("min_object_size", 0.0) / scale
+
+    boxes = _object_boxes(model)
+
+    ids = []
+    mins = []
+    maxs = []
+    keep = set()
+    for ob in model.Objects:
+        attr = ob.Attributes
+        box = boxes.get(str(attr.Id), None)
+        # definition objects aren't placed in the world
+        if attr.IsInstanceDefinitionObject or box is None:
+            keep.add(str(attr.Id))
+            continue
+        ids.append(str(attr.Id))
+        mins.append(box[0])
+        maxs.append(box[1])
+
+    index = spatial.BoxIndex(mins, maxs)
+
+    if region == "BOX":
+        lo = [v / scale for v in options.get("region_min", (0.0, 0.0, 0.0))]
+        hi = [v / scale for v in options.get("region_max", (0.0, 0.0, 0.0))]
+        hits = index.query_box(lo, hi)
+    elif region == "NAMED_VIEW":
+        view_name = options.get("region_view", "")
+        view = next((v for v in model.NamedViews if v.Name == view_name), None)
+        if view is None:
+            print("Named view {} not found, importing everything".format(view_name))
+            return None
+        vp = view.Viewport
+        corners = spatial.frustum_corners(
+            (vp.CameraLocation.X, vp.CameraLocation.Y, vp.CameraLocation.Z),
+            (vp.CameraX.X, vp.CameraX.Y, vp.CameraX.Z),
+            (vp.CameraY.X, vp.CameraY.Y, vp.CameraY.Z),
+            (vp.CameraZ.X, vp.CameraZ.Y, vp.CameraZ.Z),
+            vp.GetFrustum(), vp.IsPerspectiveProjection)
+        hits = index.query_planes(spatial.frustum_planes(corners), corners)
+    elif region == "VIEWPORT":
+        matrix = viewport_matrix(context)
+        if matrix is None:
+            print("No 3D viewport found, importing everything")
+            return None
+        # the viewport is in Blender units, the boxes in model units
+        m = [list(row) for row in matrix]
+        for row in m:
+            row[0] *= scale
+            row[1] *= scale
+            row[2] *= scale
+        hits = index.query_planes(spatial.matrix_planes(m), spatial.matrix_corners(m))
+    else:
+        hits = range(len(ids))
+
+    sizes = index.sizes()
+    keep.update(ids[i] for i in hits if sizes[i] >= min_size)
+    return keep
+
+
+# object types and the option enabling their import
+_TYPE_OPTIONS = {
+    r3d.ObjectType.Curve: "import_curves",
+    r3d.ObjectType.Annotation: "import_annotations",
+    r3d.ObjectType.PointSet: "import_pointset",
+    r3d.ObjectType.Brep: "import_brep",
+    r3d.ObjectType.Extrusion: "import_extrusions",
+    r3d.ObjectType.SubD: "import_subd",
+    r3d.ObjectType.Mesh: "import_meshes",
+}
+
+
+def _skip_object(ob, cached_model, options, idef_members, region_ids) -> bool:
+    """
+    True if ob isn't imported: its type isn't supported or disabled,
+    it is a member of an unused instance definition, it lies outside
+    the import region or it is hidden.
+    """
+    og = ob.Geometry
+    if og.ObjectType not in converters.RHINO_TYPE_TO_IMPORT and og.ObjectType != r3d.ObjectType.InstanceReference:
+        return True
+    option = _TYPE_OPTIONS.get(og.ObjectType, None)
+    if option is not None and not options.get(option, False):
+        return True
+
+    attr = ob.Attributes
+
+    # Skip members of instance definitions nothing refers to
+    if idef_members is not None and attr.IsInstanceDefinitionObject and str(attr.Id) not in idef_members:
+        return True
+
+    # Skip objects outside the region or too small
+    if region_ids is not None and str(attr.Id) not in region_ids:
+        return True
+
+    # Check object visibility
+    if not attr.Visible and not options.get("import_hidden_objects", False):
+        return True
+
+    # Check object layer visibility
+    rhinolayer = cached_model.layer(attr.LayerIndex)
+    if not rhinolayer.Visible and not options.get("import_hidden_layers", False):
+        return True
+
+    return False
+
+
+MIN_OBJECT_BUDGET = 12
+
+
+def _scene_face_budgets(cached_model, options, idef_members, region_ids):
+    """
+    Split the scene triangle budget over the render meshes of the
+    objects that get imported, in proportion to their triangle counts.
+    Returns a dictionary from object id to budget, or None if the
+    objects fit the budget.
+    """
+    budget = options.get("polygon_budget_faces", 100000)
+    counts = dict()
+    for ob in cached_model.model.Objects:
+        if converters.RHINO_TYPE_TO_IMPORT.get(ob.Geometry.ObjectType, None) is not converters.import_render_mesh:
+            continue
+        if _skip_object(ob, cached_model, options, idef_members, region_ids):
+            continue
+        counts[str(ob.Attributes.Id)] = converters.render_mesh_triangles(ob.Geometry, ob.Attributes, options)
+    total = sum(counts.values())
+    if total <= budget:
+        return None
+    # every object gets the minimum, the rest of the budget is split
+    # so that the minimums don't push the total over the budget
+    spare = max(budget - MIN_OBJECT_BUDGET * len(counts), 0)
+    if spare == 0:
+        print("Scene polygon budget of {} is too small for {} objects".format(budget, len(counts)))
+    ratio = spare / total
+    return {rhid: MIN_OBJECT_BUDGET + int(count * ratio) for rhid, count in counts.items()}
+
+
 def read_3dm(
         context : bpy.types.Context,
         filepath : str,
@@ -85,24 +573,42 @@ def read_3dm(
     import_hidden_objects = options.get("import_hidden_objects", False)
     import_hidden_layers = options.get("import_hidden_layers", False)
     import_layers_as_empties = options.get("import_layers_as_empties", False)
+    import_empty_layers = options.get("import_empty_layers", False)
     import_groups = options.get("import_groups", False)
     import_nested_groups = options.get("import_nested_groups", False)
+    group_mode = options.get("group_mode", "COLLECTIONS")
     import_instances = options.get("import_instances",False)
+    prune_instance_definitions = options.get("prune_instance_definitions", False)
     update_materials = options.get("update_materials", False)
-
-    model = None
-
-    try:
-        model = r3d.File3dm.Read(filepath)
-    except:
-        print("Failed to import .3dm model: {}".format(filepath))
+    texture_storage = options.get("texture_storage", "PACK")
+    material_templates = options.get("material_templates", False)
+    defer_materials = options.get("defer_materials", False)
+    low_memory = options.get("low_memory", False)
+    chunk_size = max(options.get("memory_chunk_size", 1000), 1)
+
+    memory_report = list() if low_memory else None
+
+    # low memory imports don't keep the model around in the cache
+    model_cache.set_limit(model_cache_limit(context))
+    cached_model = model_cache.load(filepath, keep=not low_memory)
+    if cached_model is None:
         return {'CANCELLED'}
+    model = cached_model.model
+    if low_memory:
+        # objects are deleted from the model once converted
+        model_cache.discard(filepath)
+    _memory_phase(memory_report, "read")
 
 
     # place model in context so we can access it when we need to
     # find data from different tables, like for instance dimension
     # styles while working on annotation import.
     options["rh_model"] = model
+    options["rh_filepath"] = os.path.abspath(filepath)
+
+    # render meshes are read from and added to the geometry buffer cache
+    geometry_cache = buffer_cache(filepath) if options.get("buffer_cache", False) else None
+    options["rh_buffer_cache"] = geometry_cache
 
     toplayer = create_or_get_top_layer(context, filepath)
 
@@ -111,6 +617,7 @@ def read_3dm(
 
     layerids = {}
     materials = {}
+    matkeys = {}
 
     # Import Views and NamedViews
     if import_views:
@@ -119,19 +626,43 @@ def read_3dm(
         converters.handle_views(context, model, toplayer, model.NamedViews, "NamedViews", scale)
 
     # Handle materials
-    converters.handle_materials(context, model, materials, update_materials)
+    converters.handle_materials(context, model, materials, update_materials, texture_storage, material_templates,
+                                defer_source=os.path.abspath(filepath) if defer_materials else None)
+
+    _memory_phase(memory_report, "materials")
 
     # Handle layers
-    converters.handle_layers(context, model, toplayer, layerids, materials, update_materials, import_hidden_layers, import_layers_as_empties)
+    converters.handle_layers(context, model, toplayer, layerids, materials, update_materials, import_hidden_layers, import_layers_as_empties, import_empty_layers)
     materials[converters.DEFAULT_RHINO_MATERIAL] = None
 
+    # find the instance definitions actually used so that unused
+    # definitions and their member objects can be skipped
+    reachable_idefs = None
+    idef_members = None
+    if import_instances and prune_instance_definitions:
+        reachable_idefs, idef_members = converters.reachable_instance_definitions(model)
+
     #build skeletal hierarchy of instance definitions as collections (will be populated by object importer)
     if import_instances:
-        converters.handle_instance_definitions(context, model, toplayer, "Instance Definitions")
+        converters.handle_instance_definitions(context, model, toplayer, "Instance Definitions", reachable_idefs)
+
+    _memory_phase(memory_report, "layers")
+
+    # Restrict the import to the objects in a region
+    region_ids = None
+    if options.get("import_region", "NONE") != "NONE" or options.get("min_object_size", 0.0) > 0.0:
+        region_ids = _objects_in_region(context, model, options, scale)
+
+    # Allocate the scene polygon budget to the objects that get imported.
+    # With the geometry cache the meshes extracted for counting are
+    # read from the cache again when the objects are converted.
+    if options.get("polygon_budget", "NONE") == "SCENE":
+        options["rh_face_budgets"] = _scene_face_budgets(cached_model, options, idef_members, region_ids)
 
     # Handle objects
     ob : r3d.File3dmObject = None
-    for ob in model.Objects:
+    objects = _objects_in_chunks(model, chunk_size) if low_memory else model.Objects
+    for ob in objects:
         og : r3d.GeometryBase = ob.Geometry
 
         # Skip unsupported object types early
@@ -139,31 +670,13 @@ def read_3dm(
             print("Unsupported object type: {}".format(og.ObjectType))
             continue
 
-        if not import_curves and og.ObjectType == r3d.ObjectType.Curve:
-            continue
-        if not import_annotations and og.ObjectType == r3d.ObjectType.Annotation:
-            continue
-        if not import_pointset and og.ObjectType == r3d.ObjectType.PointSet:
-            continue
-        if not import_brep and og.ObjectType == r3d.ObjectType.Brep:
-            continue
-        if not import_extrusions and og.ObjectType == r3d.ObjectType.Extrusion:
-            continue
-        if not import_subd and og.ObjectType == r3d.ObjectType.SubD:
+        # Skip disabled object types, unused definition members, objects
+        # outside the region and hidden objects
+        if _skip_object(ob, cached_model, options, idef_members, region_ids):
             continue
-        if not import_meshes and og.ObjectType == r3d.ObjectType.Mesh:
-            continue
-
 
-        # Check object visibility
         attr = ob.Attributes
-        if not attr.Visible and not import_hidden_objects:
-            continue
-
-        # Check object layer visibility
-        rhinolayer = model.Layers.FindIndex(attr.LayerIndex)
-        if not rhinolayer.Visible and not import_hidden_layers:
-            continue
+        rhinolayer = cached_model.layer(attr.LayerIndex)
 
         # Create object name if none exists or it is an empty string.
         # Otherwise use the name from the 3dm file.
@@ -177,15 +690,17 @@ def read_3dm(
         mat_index = attr.MaterialIndex
         if attr.MaterialSource == r3d.ObjectMaterialSource.MaterialFromLayer:
             mat_index = rhinolayer.RenderMaterialIndex
-        rhino_material = model.Materials.FindIndex(mat_index)
+        rhino_material = cached_model.material(mat_index)
 
-        # Get material name. In case of the Rhino default material use
-        # DEFAULT_RHINO_MATERIAL, otherwise compute a name from the material
-        # so that it is fit for Blender usage.
+        # Get material key. In case of the Rhino default material use
+        # DEFAULT_RHINO_MATERIAL, otherwise key the material by the hash of
+        # its render content, like handle_materials does.
         if mat_index == -1 or rhino_material.Name == "":
             matname = converters.material.DEFAULT_RHINO_MATERIAL
         else:
-            matname = converters.material_name(rhino_material)
+            if mat_index not in matkeys:
+                matkeys[mat_index] = converters.material_key(model, rhino_material)
+            matname = matkeys[mat_index]
 
         # Handle object view color
         if ob.Attributes.ColorSource == r3d.ObjectColorSource.ColorFromLayer:
@@ -201,8 +716,11 @@ def read_3dm(
         if og.ObjectType == r3d.ObjectType.Annotation:
             blender_material = materials[converters.material.DEFAULT_TEXT_MATERIAL]
 
-        # Fetch layer
-        layer = layerids[str(rhinolayer.Id)][1]
+        # Fetch layer, instance definition objects don't need one
+        # since they are linked in their definition collections
+        layer = None
+        if not attr.IsInstanceDefinitionObject:
+            layer = converters.get_layer(context, rhinolayer, layerids)
 
         if og.ObjectType==r3d.ObjectType.InstanceReference and import_instances:
             object_name = model.InstanceDefinitions.FindId(og.ParentIdefId).Name
@@ -211,25 +729,65 @@ def read_3dm(
         converters.convert_object(context, ob, object_name, layer, blender_material, view_color, scale, options)
 
         if import_groups:
-            converters.handle_groups(context,attr,toplayer,import_nested_groups)
+            if group_mode == "ATTRIBUTES":
+                converters.handle_group_attributes(context, model, attr)
+            else:
+                converters.handle_groups(context,attr,toplayer,import_nested_groups)
+
+    # drop the references to the last converted object
+    ob = og = attr = objects = None
+    _memory_phase(memory_report, "objects")
 
     if import_instances:
-        converters.populate_instance_definitions(context, model, toplayer, "Instance Definitions", options, scale)
+        converters.populate_instance_definitions(context, model, toplayer, "Instance Definitions", options, scale, reachable_idefs)
+
+    # the model isn't needed anymore
+    if low_memory:
+        options.pop("rh_model", None)
+        del model, cached_model
+        converters.annotation.initialize()
+        converters.material.release_embedded_files()
+        _memory_phase(memory_report, "release")
 
     # finally link in the container collection (top layer) into the main
     # scene collection.
     if toplayer.name not in context.scene.collection.children:
         context.scene.collection.children.link(toplayer)
+
+    # meshes with imported Rhino normals already shade correctly, smoothing
+    # them again would only cost time
+    smooth_objects = [o for o in toplayer.all_objects if not getattr(o.data, "has_custom_normals", False)]
     if bpy.app.version[0] < 4:
-        bpy.ops.object.shade_smooth({'selected_editable_objects': toplayer.all_objects})
+        bpy.ops.object.shade_smooth({'selected_editable_objects': smooth_objects})
     else:
         # set the active object on the viewlayer to none as that is checked by shade smooth
         active_object = bpy.context.view_layer.objects.active
         bpy.context.view_layer.objects.active = None
-        with context.temp_override(selected_editable_objects=toplayer.all_objects):
+        with context.temp_override(selected_editable_objects=smooth_objects):
             bpy.ops.object.shade_smooth()
         bpy.context.view_layer.objects.active = active_object
 
+    options["rh_instances_found"] = converters.instancing.instance_count()
+
+    if geometry_cache is not None:
+        geometry_cache.flush()
+        options.pop("rh_buffer_cache", None)
+        # caches other processes have open are kept as well
+        cachedir = converters.utils.cache_directory(BUFFER_CACHE)
+        in_use = [path for path in (os.path.join(cachedir, name) for name in os.listdir(cachedir))
+                  if buffers.BufferCache.in_use(path)]
+        converters.utils.trim_cache_directory(
+            cachedir,
+            options.get("buffer_cache_size", 8192) * 1024 * 1024,
+            [geometry_cache.directory] + in_use)
+
+    if options.get("pointcloud_tiling", False):
+        converters.trim_tile_cache(context, options.get("pointcloud_tile_cache_size", 8192) * 1024 * 1024)
+
     converters.cleanup()
 
+    if memory_report is not None:
+        _memory_phase(memory_report, "finish")
+        _print_memory_report(filepath, memory_report)
+
     return {'FINISHED'}
@@ -0,0 +1,201 @@
+# MIT License
+
+# Copyright (c) 2018-2024 Nathan Letwory, Joel Putnam, Tom Svilans, Lukas Fertig
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Cache of converted scenes. The top collection produced by importing a
+3dm file is written to a .blend file keyed by the content of the 3dm
+file and the import options. Importing the same file with the same
+options again links or appends the cached collection instead of
+converting the file again.
+"""
+
+import bpy
+import hashlib
+import json
+import os
+
+from typing import Any, Dict
+
+from .converters import utils
+from . import read3dm
+
+SCENE_CACHE = "scenes"
+
+# options that don't change the converted scene
+_IGNORED_OPTIONS = {
+    "filepath",
+    "files",
+    "directory",
+    "filter_glob",
+    "scene_cache",
+    "scene_cache_size",
+    "buffer_cache",
+    "buffer_cache_size",
+    "pointcloud_tile_cache_size",
+    "low_memory",
+    "memory_chunk_size",
+}
+
+
+def _setting(value):
+    """
+    value as something json can write, or None for values that aren't
+    numbers, strings or sequences of numbers.
+    """
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    try:
+        return [float(v) for v in value]
+    except (TypeError, ValueError):
+        return None
+
+
+def cache_key(
+        context     : bpy.types.Context,
+        filepath    : str,
+        options     : Dict[str, Any],
+        version) -> str:
+    """
+    Key for the converted scene of the file at filepath: a digest of
+    the file content, the options that affect the conversion, the unit
+    scale of the scene, the viewport for imports restricted to it and
+    the add-on and Blender versions.
+    """
+    settings = dict()
+    for k, v in options.items():
+        if k not in _IGNORED_OPTIONS:
+            setting = _setting(v)
+            if setting is not None:
+                settings[k] = setting
+    settings["scale_length"] = context.scene.unit_settings.scale_length
+    if options.get("import_region", "NONE") == "VIEWPORT":
+        matrix = read3dm.viewport_matrix(context)
+        settings["viewport"] = [list(row) for row in matrix] if matrix is not None else None
+    settings["version"] = list(version)
+    settings["blender"] = list(bpy.app.version)
+
+    sha = hashlib.sha256()
+    sha.update(utils.file_digest(filepath).encode())
+    sha.update(json.dumps(settings, sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+def _cache_path(key : str) -> str:
+    return os.path.join(utils.cache_directory(SCENE_CACHE), key + ".blend")
+
+
+def load_scene(
+        context         : bpy.types.Context,
+        key             : str,
+        collection_name : str,
+        link            : bool) -> bpy.types.Collection:
+    """
+    Link or append the cached collection for key into the scene.
+    Returns the collection, or None if there is no cached scene or the
+    blend has the collection of an earlier import already. Those are
+    updated in place by converting the file again, appending would
+    duplicate every object and material.
+    """
+    path = _cache_path(key)
+    if not os.path.exists(path):
+        return None
+
+    existing = context.blend_data.collections.get(collection_name, None)
+    if existing is not None:
+        library = existing.library
+        if library is None or os.path.normpath(bpy.path.abspath(library.filepath)) != os.path.normpath(path):
+            return None
+        # linked from this entry before
+        if existing.name not in context.scene.collection.children:
+            context.scene.collection.children.link(existing)
+        os.utime(path)
+        return existing
+
+    try:
+        with context.blend_data.libraries.load(path, link=link) as (data_from, data_to):
+            if collection_name in data_from.collections:
+                data_to.collections = [collection_name]
+    except OSError:
+        print("Failed to load cached scene {}".format(path))
+        return None
+
+    if not data_to.collections or data_to.collections[0] is None:
+        return None
+    collection = data_to.collections[0]
+    if collection.name not in context.scene.collection.children:
+        context.scene.collection.children.link(collection)
+
+    # mark the entry as recently used for eviction
+    os.utime(path)
+    return collection
+
+
+def store_scene(
+        key         : str,
+        collection  : bpy.types.Collection,
+        size_limit  : int) -> None:
+    """
+    Write collection and everything it uses to the cache under key,
+    then evict the least recently used entries so that the cache stays
+    below size_limit bytes.
+    """
+    path = _cache_path(key)
+    tmppath = path[:-len(".blend")] + ".tmp.blend"
+    try:
+        # fake_user is only known to Blender 4.2 and later
+        extra = {"fake_user": True} if bpy.app.version >= (4, 2) else {}
+        bpy.data.libraries.write(tmppath, {collection}, path_remap='ABSOLUTE', compress=True, **extra)
+        os.replace(tmppath, path)
+    except OSError:
+        print("Failed to write cached scene {}".format(path))
+        return
+    evict(size_limit, keep=path)
+
+
+def evict(size_limit : int, keep : str = None) -> None:
+    """
+    Remove the least recently used cached scenes until the cache takes
+    at most size_limit bytes. The entry at path keep is never removed.
+    """
+    directory = utils.cache_directory(SCENE_CACHE)
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(".blend"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= size_limit:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
@@ -0,0 +1,287 @@
+# MIT License
+
+# Copyright (c) 2018-2024 Nathan Letwory, Joel Putnam, Tom Svilans, Lukas Fertig
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Local import server. A background Blender registers the add-on once and
+runs import jobs sent over a Unix socket, saving each result to a
+.blend file. Between jobs the scene is reset to an empty file.
+
+Start the server:
+
+    blender -b --factory-startup --python import_3dm/server.py -- serve
+
+Send jobs from plain Python:
+
+    python import_3dm/server.py submit model.3dm model.blend --options '{"import_curves": false}'
+    python import_3dm/server.py status 1
+    python import_3dm/server.py wait 1
+    python import_3dm/server.py shutdown
+
+Requests and replies are single lines of JSON. Requests have a
+"command" of submit, status or shutdown. Submitting options the import
+operator doesn't have gets an error reply.
+"""
+
+import argparse
+import json
+import os
+import queue
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+try:
+    import bpy
+except ImportError:
+    # the client side runs without Blender
+    bpy = None
+
+
+def default_socket_path() -> str:
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return os.path.join(tempfile.gettempdir(), "import_3dm-{}.sock".format(uid))
+
+
+# *** client
+
+def request(socket_path : str, message : dict) -> dict:
+    """
+    Send message to the server at socket_path and return its reply.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(message) + "\n").encode())
+        with sock.makefile("r") as f:
+            return json.loads(f.readline())
+
+
+def submit(socket_path : str, input_path : str, output_path : str, options : dict = None) -> str:
+    """
+    Queue an import of input_path saved to output_path. Returns the
+    job id.
+    """
+    reply = request(socket_path, {
+        "command": "submit",
+        "input": os.path.abspath(input_path),
+        "output": os.path.abspath(output_path),
+        "options": options or {},
+    })
+    if "error" in reply:
+        raise RuntimeError(reply["error"])
+    return reply["job"]
+
+
+def status(socket_path : str, job : str) -> dict:
+    return request(socket_path, {"command": "status", "job": job})
+
+
+def wait(socket_path : str, job : str, interval : float = 0.5) -> dict:
+    """
+    Poll the status of job until it is done or failed.
+    """
+    while True:
+        reply = status(socket_path, job)
+        if reply.get("state") not in ("queued", "running"):
+            return reply
+        time.sleep(interval)
+
+
+# *** server
+
+class ImportServer:
+    """
+    Accepts requests on a Unix socket in a thread and runs the queued
+    jobs on the main thread, since bpy may only be used from there.
+    """
+
+    def __init__(self, addon, socket_path : str, keep_models : bool = False, valid_options = None):
+        self.addon = addon
+        self.socket_path = socket_path
+        self.keep_models = keep_models
+        # names of the import options jobs may set, None to allow any
+        self.valid_options = valid_options
+        self.jobs = dict()
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.running = True
+        self._next_job = 1
+
+    def _reply(self, message : dict) -> dict:
+        command = message.get("command", None)
+        if command == "submit":
+            if not message.get("input") or not message.get("output"):
+                return {"error": "submit needs input and output"}
+            options = message.get("options", {})
+            if not isinstance(options, dict):
+                return {"error": "options have to be an object"}
+            if self.valid_options is not None:
+                unknown = sorted(set(options) - self.valid_options)
+                if unknown:
+                    return {"error": "unknown import options: {}".format(", ".join(unknown))}
+            with self.lock:
+                job = str(self._next_job)
+                self._next_job += 1
+                self.jobs[job] = {"job": job, "state": "queued", "input": message["input"], "output": message["output"]}
+            self.queue.put((job, message["input"], message["output"], options))
+            return {"job": job}
+        if command == "status":
+            with self.lock:
+                entry = self.jobs.get(str(message.get("job")), None)
+                return dict(entry) if entry else {"error": "unknown job"}
+        if command == "shutdown":
+            self.running = False
+            self.queue.put(None)
+            return {"state": "shutting down"}
+        return {"error": "unknown command {}".format(command)}
+
+    def _handle(self, conn : socket.socket) -> None:
+        with conn, conn.makefile("rw") as f:
+            for line in f:
+                try:
+                    reply = self._reply(json.loads(line))
+                except ValueError as e:
+                    reply = {"error": str(e)}
+                f.write(json.dumps(reply) + "\n")
+                f.flush()
+
+    def _accept(self, listener : socket.socket) -> None:
+        while self.running:
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _set(self, job : str, **values) -> None:
+        with self.lock:
+            self.jobs[job].update(values)
+
+    def _run(self, job : str, input_path : str, output_path : str, options : dict) -> None:
+        self._set(job, state="running", started=time.time())
+        try:
+            bpy.ops.wm.read_homefile(use_empty=True)
+            # undo steps are useless in a background server and fail
+            # without a window
+            result = bpy.ops.import_3dm.some_data_no_undo(filepath=input_path, **options)
+            if 'FINISHED' not in result:
+                raise RuntimeError("import {}".format(", ".join(result).lower()))
+            bpy.ops.wm.save_as_mainfile(filepath=output_path)
+            self._set(job, state="done", finished=time.time())
+        except Exception as e:
+            traceback.print_exc()
+            self._set(job, state="failed", error=str(e), finished=time.time())
+        finally:
+            if not self.keep_models:
+                self.addon.model_cache.clear()
+
+    def serve(self) -> None:
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen()
+        listener.settimeout(0.5)
+        accept = threading.Thread(target=self._accept, args=(listener,), daemon=True)
+        accept.start()
+        print("import_3dm server listening on {}".format(self.socket_path))
+
+        try:
+            while self.running:
+                item = self.queue.get()
+                if item is None:
+                    break
+                self._run(*item)
+        finally:
+            self.running = False
+            listener.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def _register_addon():
+    """
+    Register the add-on unless Blender already has it enabled. Returns
+    the add-on package.
+    """
+    operator = getattr(bpy.types, "IMPORT_3DM_OT_some_data", None)
+    if operator is not None:
+        return sys.modules[operator.__module__]
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import import_3dm
+    import_3dm.register()
+    return import_3dm
+
+
+def import_options() -> set:
+    """
+    Names of the options of the import operator jobs run.
+    """
+    properties = bpy.types.IMPORT_3DM_OT_some_data_no_undo.bl_rna.properties
+    return {prop.identifier for prop in properties if prop.identifier not in ("rna_type", "filepath")}
+
+
+def _arguments():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Local Rhino 3dm import server")
+    parser.add_argument("--socket", default=default_socket_path(), help="path of the Unix socket")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the server, inside Blender")
+    serve.add_argument("--keep-models", action="store_true", help="keep parsed models cached between jobs")
+
+    sub = commands.add_parser("submit", help="queue an import")
+    sub.add_argument("input")
+    sub.add_argument("output")
+    sub.add_argument("--options", default="{}", help="import options as JSON")
+
+    for name in ("status", "wait"):
+        sub = commands.add_parser(name, help="{} a job".format(name))
+        sub.add_argument("job")
+
+    commands.add_parser("shutdown", help="stop the server after the running job")
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = _arguments()
+    if args.command == "serve":
+        if bpy is None:
+            sys.exit("the server has to run inside Blender")
+        addon = _register_addon()
+        ImportServer(addon, args.socket, args.keep_models, import_options()).serve()
+    elif args.command == "submit":
+        print(submit(args.socket, args.input, args.output, json.loads(args.options)))
+    elif args.command == "status":
+        print(json.dumps(status(args.socket, args.job)))
+    elif args.command == "wait":
+        print(json.dumps(wait(args.socket, args.job)))
+    elif args.command == "shutdown":
+        print(json.dumps(request(args.socket, {"command": "shutdown"})))
+
+
+if __name__ == "__main__":
+    main()
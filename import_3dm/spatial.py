@@ -0,0 +1,213 @@
+# MIT License
+
+# Copyright (c) 2018-2024 Nathan Letwory, Joel Putnam, Tom Svilans, Lukas Fertig
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Spatial index over object bounding boxes, used to import only the
+objects in a region. Like buffers.py this module doesn't use bpy.
+"""
+
+import numpy as np
+
+# boxes covering more grid cells than this are kept in a separate
+# list that every query tests
+MAX_CELLS_PER_BOX = 8
+MAX_CELLS_PER_AXIS = 64
+
+
+class BoxIndex:
+    """
+    Uniform grid over axis aligned boxes given as (N, 3) arrays of
+    minimum and maximum corners. Each small box is listed in the cells
+    it overlaps, with the (cell, box) pairs kept as sorted arrays.
+    """
+    __slots__ = ("mins", "maxs", "origin", "cell", "dims", "cells", "items", "large")
+
+    def __init__(self, mins, maxs):
+        self.mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+        self.maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+        count = len(self.mins)
+
+        if count == 0:
+            self.origin = np.zeros(3)
+            self.cell = 1.0
+            self.dims = np.ones(3, dtype=np.int64)
+            self.cells = np.zeros(0, dtype=np.int64)
+            self.items = np.zeros(0, dtype=np.int64)
+            self.large = np.zeros(0, dtype=np.int64)
+            return
+
+        self.origin = self.mins.min(axis=0)
+        extent = self.maxs.max(axis=0) - self.origin
+        per_axis = min(max(int(round(count ** (1.0 / 3.0))), 1), MAX_CELLS_PER_AXIS)
+        self.cell = max(float(extent.max()) / per_axis, 1e-12)
+        self.dims = np.clip(np.ceil(extent / self.cell).astype(np.int64), 1, MAX_CELLS_PER_AXIS)
+
+        c0 = self._cell_coords(self.mins)
+        c1 = self._cell_coords(self.maxs)
+        span = c1 - c0 + 1
+        small = span.prod(axis=1) <= MAX_CELLS_PER_BOX
+        self.large = np.flatnonzero(~small)
+
+        # enumerate the cells of the small boxes, a small box can still
+        # span up to MAX_CELLS_PER_BOX cells along one axis
+        idx = np.flatnonzero(small)
+        longest = span[idx].max(axis=0) if len(idx) else np.zeros(3, dtype=np.int64)
+        cells = [np.zeros(0, dtype=np.int64)]
+        items = [np.zeros(0, dtype=np.int64)]
+        for dx in range(longest[0]):
+            for dy in range(longest[1]):
+                for dz in range(longest[2]):
+                    c = c0[idx] + (dx, dy, dz)
+                    inside = (c <= c1[idx]).all(axis=1)
+                    cells.append(self._linear(c[inside]))
+                    items.append(idx[inside])
+        cells = np.concatenate(cells)
+        items = np.concatenate(items)
+        order = np.argsort(cells, kind="stable")
+        self.cells = cells[order]
+        self.items = items[order]
+
+    def _cell_coords(self, points):
+        c = np.floor((points - self.origin) / self.cell).astype(np.int64)
+        return np.clip(c, 0, self.dims - 1)
+
+    def _linear(self, c):
+        return (c[:, 0] * self.dims[1] + c[:, 1]) * self.dims[2] + c[:, 2]
+
+    def _candidates(self, lo, hi):
+        c0 = self._cell_coords(np.asarray(lo, dtype=np.float64).reshape(1, 3))[0]
+        c1 = self._cell_coords(np.asarray(hi, dtype=np.float64).reshape(1, 3))[0]
+        # the cells of each x, y column of the query range have
+        # consecutive ids, look their runs up in the sorted cell ids
+        x, y = np.meshgrid(np.arange(c0[0], c1[0] + 1), np.arange(c0[1], c1[1] + 1), indexing="ij")
+        column = (x.ravel() * self.dims[1] + y.ravel()) * self.dims[2]
+        starts = np.searchsorted(self.cells, column + c0[2], side="left")
+        ends = np.searchsorted(self.cells, column + c1[2], side="right")
+        runs = [self.items[a:b] for a, b in zip(starts, ends) if b > a]
+        return np.unique(np.concatenate(runs + [self.large]))
+
+    def query_box(self, lo, hi):
+        """
+        Indices of the boxes intersecting the box from lo to hi.
+        """
+        lo = np.asarray(lo, dtype=np.float64)
+        hi = np.asarray(hi, dtype=np.float64)
+        idx = self._candidates(lo, hi)
+        hit = ((self.mins[idx] <= hi) & (self.maxs[idx] >= lo)).all(axis=1)
+        return idx[hit]
+
+    def query_planes(self, planes, corners):
+        """
+        Indices of the boxes that may intersect the convex volume
+        bounded by planes, a (K, 4) array of (a, b, c, d) with normals
+        pointing inwards. corners are the corner points of the volume,
+        used to narrow down the candidates through the grid.
+        """
+        corners = np.asarray(corners, dtype=np.float64)
+        idx = self._candidates(corners.min(axis=0), corners.max(axis=0))
+        mins = self.mins[idx]
+        maxs = self.maxs[idx]
+        hit = np.ones(len(idx), dtype=bool)
+        for plane in np.asarray(planes, dtype=np.float64):
+            # the box corner farthest along the plane normal
+            p = np.where(plane[:3] >= 0.0, maxs, mins)
+            hit &= p @ plane[:3] + plane[3] >= 0.0
+        return idx[hit]
+
+    def sizes(self):
+        """
+        Length of the diagonal of every box.
+        """
+        return np.linalg.norm(self.maxs - self.mins, axis=1)
+
+
+def transform_box(lo, hi, matrix):
+    """
+    Axis aligned box around the box from lo to hi transformed by the
+    4x4 matrix. Returns the minimum and maximum corners.
+    """
+    corners = np.array([(x, y, z, 1.0) for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])])
+    world = corners @ np.asarray(matrix, dtype=np.float64).T
+    world = world[:, :3] / world[:, 3:4]
+    return (world.min(axis=0), world.max(axis=0))
+
+
+def frustum_corners(origin, x_axis, y_axis, z_axis, frustum, perspective):
+    """
+    World space corners of a Rhino viewport frustum: near corners
+    followed by far corners, each as left-bottom, right-bottom,
+    right-top, left-top. The camera looks along -z_axis, frustum is
+    the dictionary returned by ViewportInfo.GetFrustum.
+    """
+    origin = np.asarray(origin, dtype=np.float64)
+    axes = np.array([x_axis, y_axis, z_axis], dtype=np.float64)
+    near = frustum['near']
+    far = frustum['far']
+    local = []
+    for depth in (near, far):
+        f = depth / near if perspective else 1.0
+        for x, y in ((frustum['left'], frustum['bottom']), (frustum['right'], frustum['bottom']),
+                     (frustum['right'], frustum['top']), (frustum['left'], frustum['top'])):
+            local.append((x * f, y * f, -depth))
+    return origin + np.array(local) @ axes
+
+
+def frustum_planes(corners):
+    """
+    The six planes bounding a frustum given by corners as returned by
+    frustum_corners, with normals pointing inwards.
+    """
+    corners = np.asarray(corners, dtype=np.float64)
+    center = corners.mean(axis=0)
+    faces = ((0, 1, 2), (4, 7, 6), (0, 4, 5), (1, 5, 6), (2, 6, 7), (3, 7, 4))
+    planes = []
+    for a, b, c in faces:
+        n = np.cross(corners[b] - corners[a], corners[c] - corners[a])
+        n /= max(np.linalg.norm(n), 1e-12)
+        d = -n @ corners[a]
+        if n @ center + d < 0.0:
+            n, d = -n, -d
+        planes.append((n[0], n[1], n[2], d))
+    return np.array(planes)
+
+
+def matrix_planes(m):
+    """
+    The six clipping planes of a 4x4 projection times view matrix,
+    normalized, with normals pointing inwards.
+    """
+    m = np.asarray(m, dtype=np.float64)
+    planes = np.array([m[3] + m[0], m[3] - m[0],
+                       m[3] + m[1], m[3] - m[1],
+                       m[3] + m[2], m[3] - m[2]])
+    return planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+
+def matrix_corners(m):
+    """
+    World space corners of the clip volume of a 4x4 projection times
+    view matrix.
+    """
+    inv = np.linalg.inv(np.asarray(m, dtype=np.float64))
+    ndc = np.array([(x, y, z, 1.0) for z in (-1.0, 1.0) for x, y in ((-1, -1), (1, -1), (1, 1), (-1, 1))])
+    world = ndc @ inv.T
+    return world[:, :3] / world[:, 3:4]
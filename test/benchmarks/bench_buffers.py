@@ -0,0 +1,66 @@
+#!python3
+"""
+Compare per-element rhino3dm access against the bulk extraction in
+import_3dm/buffers.py. Needs rhino3dm and NumPy, but not Blender.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_buffers.py 200
+"""
+import importlib.util
+import sys
+import time
+from pathlib import Path
+
+import rhino3dm as r3d
+
+# load buffers.py on its own, the import_3dm package needs bpy
+_path = Path(__file__).resolve().parents[2] / "import_3dm" / "buffers.py"
+_spec = importlib.util.spec_from_file_location("buffers", _path)
+buffers = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(buffers)
+
+
+def _grid_mesh(size):
+    m = r3d.Mesh()
+    for y in range(size + 1):
+        for x in range(size + 1):
+            m.Vertices.Add(float(x), float(y), 0.0)
+            m.TextureCoordinates.Add(x / size, y / size)
+    for y in range(size):
+        for x in range(size):
+            a = y * (size + 1) + x
+            m.Faces.AddFace(a, a + 1, a + size + 2, a + size + 1)
+    m.Normals.ComputeNormals()
+    return m
+
+
+def _per_element(m):
+    faces = [list(m.Faces[f]) for f in range(len(m.Faces))]
+    for f in faces:
+        if f[-1] == f[-2]:
+            del f[-1]
+    vertices = [(m.Vertices[v].X, m.Vertices[v].Y, m.Vertices[v].Z) for v in range(len(m.Vertices))]
+    coords = [(m.TextureCoordinates[v].X, m.TextureCoordinates[v].Y) for v in range(len(m.TextureCoordinates))]
+    normals = [(m.Normals[v].X, m.Normals[v].Y, m.Normals[v].Z) for v in range(len(m.Normals))]
+    return (vertices, faces, coords, normals)
+
+
+def _bulk(m):
+    return buffers.mesh_buffer([m], normals=True)
+
+
+def bench(size, repeat=5):
+    m = _grid_mesh(size)
+    print("grid {0}x{0}: {1} vertices, {2} faces".format(size, len(m.Vertices), len(m.Faces)))
+    print("{:20} {:>12}".format("method", "time (s)"))
+    for extract in (_per_element, _bulk):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            extract(m)
+        print("{:20} {:>12.4f}".format(extract.__name__, (time.perf_counter() - start) / repeat))
+    print("buffer size: {} bytes".format(_bulk(m).nbytes()))
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
@@ -0,0 +1,55 @@
+#!python3
+"""
+Compare creating materials by building each node tree from scratch
+against copying the per handler type template node tree.
+
+Run with Blender from the repository root:
+
+    blender -b --factory-startup --python test/benchmarks/bench_material_templates.py -- 500
+"""
+import sys
+import time
+from pathlib import Path
+
+import bpy
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+import rhino3dm as r3d
+from import_3dm.converters import material
+
+
+def _scratch(type_name, handler, rm, i):
+    blmat = bpy.data.materials.new(name="scratch_{}_{}".format(type_name, i))
+    if bpy.app.version[0] < 5:
+        blmat.use_nodes = True
+    handler(rm, blmat)
+    return blmat
+
+
+def _template(type_name, handler, rm, i):
+    blmat = material.material_template(type_name).copy()
+    blmat.name = "template_{}_{}".format(type_name, i)
+    handler(rm, blmat)
+    return blmat
+
+
+def bench(count):
+    rm = r3d.RenderMaterial()
+    print("{:40} {:>12} {:>12}".format("handler", "scratch (s)", "template (s)"))
+    for type_name, handler in material.material_handlers.items():
+        timings = []
+        for create in (_scratch, _template):
+            created = []
+            start = time.perf_counter()
+            for i in range(count):
+                created.append(create(type_name, handler, rm, i))
+            timings.append(time.perf_counter() - start)
+            for blmat in created:
+                bpy.data.materials.remove(blmat)
+        print("{:40} {:>12.3f} {:>12.3f}".format(handler.__name__, *timings))
+
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    bench(int(argv[0]) if argv else 200)
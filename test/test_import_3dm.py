@@ -1,8 +1,10 @@
 #!python3
+import os
 import pytest
 
 import bpy
 import addon_utils
+import rhino3dm as r3d
 
 
 testfiles = [
@@ -28,3 +30,189 @@ def enable_addon():
 @pytest.mark.parametrize("filepath", testfiles)
 def test_create_article(filepath):
     bpy.ops.import_3dm.some_data(filepath=filepath)
+
+
+def test_import_no_undo():
+    assert bpy.ops.import_3dm.some_data_no_undo(filepath=testfiles[0]) == {'FINISHED'}
+    assert any(ob.get("rhid") for ob in bpy.data.objects)
+
+
+def test_compact_tags():
+    bpy.ops.import_3dm.some_data(filepath=testfiles[0])
+    tagged = [ob for ob in bpy.data.objects if ob.get("rhid")]
+    assert tagged
+    for ob in tagged:
+        for legacy in ("rhname", "rhmatid", "rhparentid", "rhidef", "rhmat_from_object"):
+            assert legacy not in ob
+
+
+def test_reimport_reuses_materials():
+    bpy.ops.import_3dm.some_data(filepath=testfiles[0])
+    count = len(bpy.data.materials)
+    bpy.ops.import_3dm.some_data(filepath=testfiles[0])
+    assert len(bpy.data.materials) == count
+
+
+def test_adaptive_nurbs_curve_resolution(tmp_path):
+    model = r3d.File3dm()
+    attributes = r3d.ObjectAttributes()
+    attributes.Name = "adaptive_circle"
+    model.Objects.AddCurve(r3d.Circle(r3d.Point3d(0, 0, 0), 10.0).ToNurbsCurve(), attributes)
+    filepath = str(tmp_path / "circle.3dm")
+    model.Write(filepath, 7)
+
+    bpy.ops.import_3dm.some_data(filepath=filepath, curve_adaptive_resolution=True, curve_chord_tolerance=0.0001)
+    curves = [ob.data for ob in bpy.data.objects if ob.name.startswith("adaptive_circle")]
+    assert curves
+    spline = curves[-1].splines[0]
+    assert spline.type == 'NURBS'
+    assert spline.resolution_u > 12
+
+
+def test_hydrate_proxies():
+    bpy.ops.import_3dm.some_data(filepath=testfiles[1], proxy_mode="BBOX")
+    proxies = [ob for ob in bpy.data.objects if ob.type == 'MESH' and 'rhproxy' in ob.data]
+    assert proxies
+    vertices = sum(len(ob.data.vertices) for ob in proxies)
+    with bpy.context.temp_override(selected_objects=proxies):
+        assert bpy.ops.import_3dm.hydrate_proxies(target="SELECTED") == {'FINISHED'}
+    assert not any('rhproxy' in ob.data for ob in proxies)
+    assert sum(len(ob.data.vertices) for ob in proxies) >= vertices
+
+
+def test_box_index_long_boxes():
+    from import_3dm import spatial
+    grid = [(x, y, z) for x in (0.0, 1.5, 2.8) for y in (0.0, 1.5, 2.8) for z in (0.0, 1.5, 2.8)]
+    mins = [(0.1, 0.1, 0.1)] + grid
+    maxs = [(2.9, 0.2, 0.2)] + [(x + 0.05, y + 0.05, z + 0.05) for x, y, z in grid]
+    index = spatial.BoxIndex(mins, maxs)
+    # the first box spans three cells along x
+    assert 0 in index.query_box((2.6, 0.1, 0.1), (2.8, 0.15, 0.15))
+
+
+def test_server_replies():
+    from import_3dm import server
+    srv = server.ImportServer(None, "unused", valid_options={"import_curves"})
+
+    reply = srv._reply({"command": "submit", "input": "a.3dm", "output": "a.blend", "options": {"import_curves": False}})
+    assert reply == {"job": "1"}
+    assert srv.queue.get_nowait() == ("1", "a.3dm", "a.blend", {"import_curves": False})
+    assert srv._reply({"command": "status", "job": "1"})["state"] == "queued"
+    assert "error" in srv._reply({"command": "status", "job": "2"})
+
+    assert "error" in srv._reply({"command": "submit", "input": "a.3dm"})
+    reply = srv._reply({"command": "submit", "input": "a.3dm", "output": "a.blend", "options": {"import_curve": False}})
+    assert reply == {"error": "unknown import options: import_curve"}
+    assert srv.queue.empty()
+
+    assert "error" in srv._reply({"command": "restart"})
+
+    assert srv._reply({"command": "shutdown"}) == {"state": "shutting down"}
+    assert not srv.running
+    assert srv.queue.get_nowait() is None
+
+
+def test_server_job(tmp_path):
+    import import_3dm
+    from import_3dm import server
+    srv = server.ImportServer(import_3dm, "unused", valid_options=server.import_options())
+    output = str(tmp_path / "boxes.blend")
+    srv._reply({"command": "submit", "input": os.path.abspath(testfiles[0]), "output": output,
+                "options": {"import_curves": False}})
+    srv._run(*srv.queue.get_nowait())
+    state = srv._reply({"command": "status", "job": "1"})
+    assert state["state"] == "done", state.get("error")
+    assert os.path.exists(output)
+
+
+def test_canonical_key_far_copies():
+    import numpy as np
+    from import_3dm import buffers
+    rng = np.random.default_rng(1)
+    positions = rng.normal(size=(200, 3)) * (3.0, 2.0, 1.0)
+    faces = np.arange(198 * 3, dtype=np.int32) % 200
+    tolerance = 0.0001
+
+    _, _, canonical = buffers.canonical_frame(positions.astype(np.float32), tolerance)
+    key = buffers.canonical_key(canonical, faces, tolerance * 10.0)
+    for _ in range(40):
+        q, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+        q *= np.sign(np.linalg.det(q))
+        moved = (positions @ q.T + rng.uniform(-1000.0, 1000.0, 3)).astype(np.float32)
+        _, _, other = buffers.canonical_frame(moved, tolerance)
+        assert np.abs(other - canonical).max() <= tolerance
+        assert buffers.canonical_key(other, faces, tolerance * 10.0) in buffers.neighbour_keys(key)
+
+
+def _grid_part(nu, nv, offset, width):
+    import numpy as np
+    u, v = np.meshgrid(np.linspace(0.0, width, nu), np.linspace(0.0, 1.0, nv), indexing="ij")
+    positions = np.stack((u.ravel(), v.ravel() + offset, np.zeros(u.size)), axis=1)
+    i = np.arange(nu - 1)[:, None] * nv + np.arange(nv - 1)[None, :]
+    quads = np.stack((i, i + nv, i + nv + 1, i + 1), axis=-1).reshape(-1, 4)
+    return positions, quads
+
+
+def test_decimate_to_budget_thin_faces():
+    import numpy as np
+    from import_3dm import buffers
+    # thin fillet-like strips, every vertex lies on a face boundary
+    positions, quads, offsets = [], [], [0]
+    for k in range(100):
+        p, q = _grid_part(200, 2, k * 1.01, 0.05)
+        quads.append(q + offsets[-1])
+        positions.append(p)
+        offsets.append(offsets[-1] + len(p))
+    quads = np.concatenate(quads)
+    buffer = buffers.GeometryBuffer(
+        np.concatenate(positions).astype(np.float32),
+        face_sizes=np.full(len(quads), 4, dtype=np.int32),
+        face_indices=quads.ravel().astype(np.int32),
+        part_offsets=np.array(offsets, dtype=np.int32))
+    for budget in (5000, 500):
+        reduced = buffers.decimate_to_budget(buffer, budget)
+        assert 0 < buffers.triangle_count(reduced) <= budget
+
+    p, q = _grid_part(120, 120, 0.0, 1.0)
+    patch = buffers.GeometryBuffer(p.astype(np.float32), face_sizes=np.full(len(q), 4, dtype=np.int32),
+                                   face_indices=q.ravel().astype(np.int32))
+    assert buffers.triangle_count(buffers.decimate_to_budget(patch, 1000)) <= 1000
+
+
+def test_buffer_cache_round_trip(tmp_path):
+    import numpy as np
+    from import_3dm import buffers
+
+    def box(offset):
+        return buffers.bbox_buffer((offset, 0.0, 0.0), (offset + 1.0, 1.0, 1.0))
+
+    directory = str(tmp_path / "cache")
+    first = buffers.BufferCache(directory)
+    second = buffers.BufferCache(directory)
+    # two users of one cache, interleaving their appends
+    first.put("a", box(0.0))
+    second.put("b", box(5.0))
+    first.put("c", box(10.0))
+    assert buffers.BufferCache.in_use(directory) == (buffers.fcntl is not None)
+    first.flush()
+    second.flush()
+    assert not buffers.BufferCache.in_use(directory)
+
+    reopened = buffers.BufferCache(directory)
+    for key, offset in (("a", 0.0), ("b", 5.0), ("c", 10.0)):
+        cached = reopened.get(key)
+        expected = box(offset)
+        assert np.array_equal(cached.positions, expected.positions)
+        assert np.array_equal(cached.face_indices, expected.face_indices)
+    assert reopened.get("d") is None
+    reopened.flush()
+
+
+def test_scene_cache_reimport():
+    bpy.ops.import_3dm.some_data(filepath=testfiles[2], scene_cache="APPEND")
+    objects = len(bpy.data.objects)
+    materials = len(bpy.data.materials)
+    # the second import finds the cached scene
+    bpy.ops.import_3dm.some_data(filepath=testfiles[2], scene_cache="APPEND")
+    assert len(bpy.data.objects) == objects
+    assert len(bpy.data.materials) == materials